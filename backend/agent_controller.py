@@ -0,0 +1,206 @@
+"""
+Agent execution control: per-ticket step budgets, duplicate tool calls, early termination.
+
+- Step budgets: instead of a fixed `max_steps`, each agent role gets a budget per ticket
+  category from the run ledger (p90 of the LLM calls that role needed in recent
+  successful runs, plus one step of headroom, within [floor, ceiling]). Categories with
+  too little history use the budget of all runs, then the static defaults.
+- Duplicate tool calls: within one run, the same tool with the same input (sub-agents
+  included) returns the memoized result instead of running again.
+- Early termination: a sub-agent stops as soon as its evidence is sufficient (sql_expert:
+  rows from the dossier or a query; history_expert: both manuals and past tickets), which
+  saves the LLM turn that would only restate the tool output. Its answer to the master is
+  then the collected tool output.
+"""
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from datapizza.agents.agent import AgentHooks, StepContext, StepResult
+from datapizza.type import FunctionCallResultBlock
+
+from models import Ticket
+
+DEFAULT_BUDGETS = {"master": 6, "sql_expert": 4, "history_expert": 4}
+# The master needs at least a sub-agent round and the final answer; a sub-agent one tool step
+# (early termination / evidence fallback answer for it)
+BUDGET_FLOORS = {"master": 3, "sql_expert": 2, "history_expert": 2}
+BUDGET_CEILINGS = {"master": 8, "sql_expert": 6, "history_expert": 6}
+
+# Evidence that lets a sub-agent stop before another LLM turn: (any/all, tools with data)
+EVIDENCE_RULES = {
+    "sql_expert": (any, ("lookup_child_dossier", "run_sql_query")),
+    "history_expert": (all, ("search_knowledge_base", "search_past_tickets")),
+}
+# Tool outputs that carry no evidence (errors, empty results)
+NO_EVIDENCE_PREFIXES = ("Error", "Errore", "Nessun", "[]")
+
+MEMO_NOTE = "(Risultato già ottenuto in questa esecuzione con la stessa richiesta: non ripetere la chiamata)\n"
+
+
+def _percentile(samples, q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def has_evidence(result: Optional[str]) -> bool:
+    text = (result or "").removeprefix(MEMO_NOTE).strip()
+    return bool(text) and not text.startswith(NO_EVIDENCE_PREFIXES)
+
+
+# ====== STEP BUDGETS ======
+
+class StepBudgets:
+    """max_steps per agent role and ticket category, from the LLM calls of past runs"""
+
+    def __init__(self, ledger=None, adaptive: bool = True, early_stop: bool = True, min_runs: int = 20,
+                 window_hours: float = 168.0, refresh_seconds: float = 600.0):
+        self.ledger = ledger
+        self.adaptive = adaptive and ledger is not None and ledger.enabled
+        self.early_stop = early_stop
+        self.min_runs = min_runs
+        self.window_hours = window_hours
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._budgets: Dict[str, Dict[str, int]] = {}  # category ("*" = all runs) -> role -> steps
+        self._samples: Dict[str, int] = {}
+        self._refreshed_at: Optional[float] = None
+        self._counters = {"runs": 0, "duplicate_calls": 0, "early_stops": 0, "capped": 0}
+
+    @classmethod
+    def from_env(cls, ledger=None, replaying: bool = False) -> "StepBudgets":
+        # Replayed cassettes need the step limits they were recorded with
+        adaptive = os.getenv("AGENT_STEP_BUDGETS", "adaptive").lower() == "adaptive" and not replaying
+        return cls(
+            ledger=ledger,
+            adaptive=adaptive,
+            early_stop=os.getenv("AGENT_EARLY_STOP", "true").lower() in ("true", "1", "yes"),
+            min_runs=int(os.getenv("AGENT_BUDGET_MIN_RUNS", "20")),
+            window_hours=float(os.getenv("AGENT_BUDGET_WINDOW_HOURS", "168")),
+            refresh_seconds=float(os.getenv("AGENT_BUDGET_REFRESH_SECONDS", "600")),
+        )
+
+    def refresh(self):
+        """Recompute the budgets from the ledger (runs of the last `window_hours`)"""
+        calls: Dict[str, Dict[str, List[int]]] = {}
+        for run in self.ledger.llm_calls_by_role(since_hours=self.window_hours):
+            for category in ("*", run["category"] or "*"):
+                for role, n in run["calls"].items():
+                    calls.setdefault(category, {}).setdefault(role, []).append(n)
+        budgets, samples = {}, {}
+        for category, by_role in calls.items():
+            for role, counts in by_role.items():
+                if role not in DEFAULT_BUDGETS or len(counts) < self.min_runs:
+                    continue
+                steps = int(_percentile(counts, 0.9)) + 1
+                budgets.setdefault(category, {})[role] = max(BUDGET_FLOORS[role], min(BUDGET_CEILINGS[role], steps))
+                samples[f"{role}@{category}"] = len(counts)
+        with self._lock:
+            self._budgets, self._samples, self._refreshed_at = budgets, samples, time.monotonic()
+
+    def for_ticket(self, ticket: Optional[Ticket]) -> Dict[str, int]:
+        """{role: max_steps} for a ticket"""
+        if self.adaptive and (self._refreshed_at is None or time.monotonic() - self._refreshed_at >= self.refresh_seconds):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"⚠️ Step budgets not refreshed: {e}")
+                self._refreshed_at = time.monotonic()
+        category = ticket.category if ticket is not None else None
+        with self._lock:
+            learned = {**self._budgets.get("*", {}), **self._budgets.get(category, {})} if self.adaptive else {}
+        return {role: learned.get(role, steps) for role, steps in DEFAULT_BUDGETS.items()}
+
+    def count(self, counter: str, n: int = 1):
+        with self._lock:
+            self._counters[counter] += n
+
+    def describe(self) -> dict:
+        with self._lock:
+            return {
+                "adaptive": self.adaptive,
+                "early_stop": self.early_stop,
+                "defaults": DEFAULT_BUDGETS,
+                "budgets": self._budgets,
+                "samples": self._samples,
+                **self._counters,
+            }
+
+
+# ====== PER-RUN CONTROLLER ======
+
+class AgentController(AgentHooks):
+    """Hooks of the agents of one run: budget reset per invocation, memoized tool calls, early stop"""
+
+    def __init__(self, budgets: StepBudgets, ticket: Optional[Ticket] = None):
+        self.budgets = budgets
+        self.max_steps = budgets.for_ticket(ticket)
+        self._memo: Dict[Tuple[str, str], str] = {}
+        self._evidence: Dict[str, List[Tuple[str, str]]] = {}  # agent -> [(tool, output)] of its current invocation
+        budgets.count("runs")
+
+    @staticmethod
+    def _key(tool_name: str, tool_input: str) -> Tuple[str, str]:
+        return tool_name, " ".join((tool_input or "").split())
+
+    def recall(self, tool_name: str, tool_input: str) -> Optional[str]:
+        """Memoized output of an identical earlier call of this run (None if there is none)"""
+        result = self._memo.get(self._key(tool_name, tool_input))
+        if result is None:
+            return None
+        self.budgets.count("duplicate_calls")
+        print(f"   ♻️ Duplicate {tool_name} call: memoized result")
+        return MEMO_NOTE + result
+
+    def remember(self, tool_name: str, tool_input: str, result: str, status: str = "success"):
+        # Failures aren't memoized: a retry may well succeed (timeouts, transient Qdrant errors)
+        if status == "success":
+            self._memo[self._key(tool_name, tool_input)] = result
+
+    # ====== HOOKS ======
+
+    def before_step(self, context: StepContext) -> None:
+        agent = context.agent
+        if context.step_index == 1:
+            # Sub-agents run once per master tool call: every invocation starts with the full budget
+            agent._max_steps = self.max_steps.get(agent.name, agent._max_steps)
+            self._evidence[agent.name] = []
+
+    def after_step(self, context: StepContext, result: StepResult) -> None:
+        agent = context.agent
+        outputs = [
+            (block.tool.name, str(block.result or ""))
+            for block in result.content if isinstance(block, FunctionCallResultBlock)
+        ]
+        self._evidence.setdefault(agent.name, []).extend(outputs)
+        if not outputs:
+            return
+        if context.step_index >= (agent._max_steps or 0):
+            self.budgets.count("capped")
+            print(f"   ⏱️ {agent.name}: step budget ({agent._max_steps}) used up")
+            return
+        rule = EVIDENCE_RULES.get(agent.name)
+        if not self.budgets.early_stop or rule is None or not all(has_evidence(output) for _, output in outputs):
+            return
+        quantifier, tools = rule
+        found = {name for name, output in self._evidence[agent.name] if has_evidence(output)}
+        if quantifier(tool in found for tool in tools):
+            # The runner checks max_steps before the next LLM call: this step is the last one
+            agent._max_steps = context.step_index
+            self.budgets.count("early_stops")
+            print(f"   ✋ {agent.name}: evidence sufficient after step {context.step_index}, stopping")
+
+    def answer(self, agent_name: str, result: Optional[StepResult]) -> str:
+        """Text for the master: the sub-agent's answer, or its tool outputs when it stopped on a tool step"""
+        if result is not None and result.structured_data:
+            return "\n".join(item.model_dump_json() for item in result.structured_data)
+        if result is not None and result.text:
+            return result.text
+        outputs = self._evidence.get(agent_name) or []
+        _, tools = EVIDENCE_RULES.get(agent_name, (any, ()))
+        # Just the evidence (rows, search results) when there is some, not list_tables & co.
+        outputs = [(tool, output) for tool, output in outputs if tool in tools and has_evidence(output)] or outputs
+        return "\n\n".join(f"[{tool}]\n{output.removeprefix(MEMO_NOTE)}" for tool, output in outputs)
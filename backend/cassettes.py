@@ -0,0 +1,347 @@
+"""
+Record/replay cassettes for ticket runs (offline benchmarks and regression tests).
+
+CASSETTE_MODE=record writes one gzip JSON cassette per generate request with everything
+that crossed a process boundary: OpenAI HTTP exchanges (LLM and embeddings, captured at
+the httpx transport), Qdrant search results, SQL results and prefetched evidence, each
+with its original latency. CASSETTE_MODE=replay serves the same run from the cassette
+with no network, sleeping the recorded latency (CASSETTE_LATENCY=original), a multiple
+of it (e.g. 0.5) or nothing (zero) - so our own overhead can be measured on its own.
+
+The active cassette travels in a ContextVar; code that hands work to other threads
+must wrap it with bind() (or run_with() for a given cassette).
+"""
+import asyncio
+import base64
+import contextvars
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+from pydantic import BaseModel
+
+MODES = ("off", "record", "replay")
+
+# Response headers kept in the cassette (the body is stored decoded)
+KEPT_HEADERS = ("content-type", "x-request-id", "openai-processing-ms", "retry-after")
+
+
+class CassetteMiss(Exception):
+    """Replay found no recorded entry for a call"""
+
+
+class CassetteSettings(BaseModel):
+    mode: str = "off"
+    directory: str = "cassettes"
+    latency_scale: float = 1.0  # 1 = original timings, 0 = zero latency
+    strict: bool = False  # False: an unmatched call takes the next unused entry of its kind
+
+    @classmethod
+    def from_env(cls) -> "CassetteSettings":
+        defaults = cls()
+        latency = os.getenv("CASSETTE_LATENCY", "original").strip().lower()
+        latency_scale = {"original": 1.0, "zero": 0.0}.get(latency)
+        mode = os.getenv("CASSETTE_MODE", defaults.mode).strip().lower()
+        if mode not in MODES:
+            raise ValueError(f"CASSETTE_MODE must be one of {MODES}, got '{mode}'")
+        return cls(
+            mode=mode,
+            directory=os.getenv("CASSETTE_DIR", defaults.directory),
+            latency_scale=latency_scale if latency_scale is not None else float(latency),
+            strict=os.getenv("CASSETTE_STRICT", "false").lower() in ("1", "true", "yes"),
+        )
+
+
+def request_key(kind: str, data: Any) -> str:
+    """Stable key of a call: sha1 of kind + canonical JSON of its inputs"""
+    raw = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(f"{kind}\n{raw}".encode("utf-8")).hexdigest()
+
+
+def _http_key(request: httpx.Request) -> str:
+    try:
+        body = json.loads(request.content or b"{}")
+    except (ValueError, UnicodeDecodeError):
+        body = hashlib.sha1(request.content).hexdigest()
+    return request_key("http", [request.method, request.url.path, body])
+
+
+class Cassette:
+    """Entries of one run, in recording order; replay consumes each entry once"""
+
+    def __init__(self, name: str, meta: Optional[dict] = None, entries: Optional[List[dict]] = None):
+        self.name = name
+        self.meta = meta or {}
+        self.entries: List[dict] = entries or []
+        self._lock = threading.Lock()
+        self._by_key: Dict[str, deque] = defaultdict(deque)
+        self._by_kind: Dict[str, deque] = defaultdict(deque)
+        for index, entry in enumerate(self.entries):
+            self._by_key[entry["key"]].append(index)
+            self._by_kind[entry["kind"]].append(index)
+        self._used = set()
+        self.hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self.replayed_seconds = 0.0
+
+    def add(self, kind: str, key: str, payload: Any, elapsed: float):
+        with self._lock:
+            self.entries.append({"kind": kind, "key": key, "elapsed": round(elapsed, 4), "payload": payload})
+
+    def take(self, kind: str, key: str, strict: bool = False) -> dict:
+        with self._lock:
+            for queue, fuzzy in ((self._by_key[key], False), (self._by_kind[kind], True)):
+                if fuzzy and strict:
+                    break
+                while queue and queue[0] in self._used:
+                    queue.popleft()
+                if queue:
+                    index = queue.popleft()
+                    self._used.add(index)
+                    if fuzzy:
+                        self.fuzzy_hits += 1
+                    else:
+                        self.hits += 1
+                    entry = self.entries[index]
+                    self.replayed_seconds += entry["elapsed"]
+                    return entry
+            self.misses += 1
+        raise CassetteMiss(f"Cassette '{self.name}': no recorded {kind} call for key {key[:12]}")
+
+    @property
+    def recorded_seconds(self) -> float:
+        return sum(entry["elapsed"] for entry in self.entries)
+
+    def save(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {"name": self.name, "meta": self.meta, "entries": self.entries}
+        tmp = path.with_suffix(".tmp")
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "Cassette":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["name"], meta=data.get("meta"), entries=data.get("entries"))
+
+
+_current: contextvars.ContextVar[Optional[Cassette]] = contextvars.ContextVar("cassette", default=None)
+
+
+def current() -> Optional[Cassette]:
+    return _current.get()
+
+
+def bind(fn: Callable) -> Callable:
+    """Run `fn` (typically in another thread) with the caller's active cassette"""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+class CassetteDeck:
+    """Opens/saves the cassette of each run and records or replays calls made during it"""
+
+    def __init__(self, settings: Optional[CassetteSettings] = None):
+        self.settings = settings or CassetteSettings.from_env()
+        self.directory = Path(self.settings.directory)
+        self._lock = threading.Lock()
+        self._counters = {"recorded": 0, "replayed": 0, "missing": 0, "misses": 0, "fuzzy_hits": 0}
+
+    @property
+    def recording(self) -> bool:
+        return self.settings.mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return self.settings.mode == "replay"
+
+    @staticmethod
+    def cassette_name(ticket_id: str, *parts: Optional[str]) -> str:
+        """'NP-1042-3f9c0a1b2d': ticket id + hash of what makes the run different (content, feedback, image)"""
+        digest = hashlib.sha1("\n".join(p or "" for p in parts).encode("utf-8")).hexdigest()[:10]
+        safe_id = re.sub(r"[^A-Za-z0-9_.-]", "_", ticket_id or "ticket")
+        return f"{safe_id}-{digest}"
+
+    def path(self, name: str) -> Path:
+        return self.directory / f"{name}.json.gz"
+
+    # ====== RUN SCOPE ======
+
+    def open(self, name: str, meta: Optional[dict] = None) -> Optional[Cassette]:
+        """Cassette for a run (None when off). Replay raises CassetteMiss if it was never recorded"""
+        if self.recording:
+            return Cassette(name, meta={**(meta or {}), "recorded_at": time.time()})
+        if self.replaying:
+            path = self.path(name)
+            if not path.exists():
+                with self._lock:
+                    self._counters["missing"] += 1
+                raise CassetteMiss(f"No cassette '{name}' in {self.directory}")
+            return Cassette.load(path)
+        return None
+
+    def close(self, cassette: Optional[Cassette], elapsed: Optional[float] = None):
+        if cassette is None:
+            return
+        with self._lock:
+            if self.recording:
+                cassette.meta["run_seconds"] = round(elapsed or 0.0, 4)
+                cassette.save(self.path(cassette.name))
+                self._counters["recorded"] += 1
+            else:
+                self._counters["replayed"] += 1
+                self._counters["misses"] += cassette.misses
+                self._counters["fuzzy_hits"] += cassette.fuzzy_hits
+        if self.recording:
+            print(f"📼 Recorded cassette {cassette.name} ({len(cassette.entries)} calls)")
+
+    @contextmanager
+    def session(self, name: str, meta: Optional[dict] = None):
+        """`with deck.session(name):` opens, activates and closes the run's cassette"""
+        cassette = self.open(name, meta)
+        token = _current.set(cassette)
+        started = time.perf_counter()
+        try:
+            yield cassette
+        finally:
+            _current.reset(token)
+            self.close(cassette, time.perf_counter() - started)
+
+    @staticmethod
+    def run_with(cassette: Optional[Cassette], fn: Callable, *args, **kwargs):
+        """Run `fn` with `cassette` active (thread targets of the streaming path)"""
+        def activated():
+            _current.set(cassette)
+            return fn(*args, **kwargs)
+        return contextvars.copy_context().run(activated)
+
+    # ====== CALLS ======
+
+    def delay(self, entry: dict) -> float:
+        return entry["elapsed"] * self.settings.latency_scale
+
+    def call(self, kind: str, key_data: Any, fn: Callable[[], Any], encode: Callable = None, decode: Callable = None):
+        """Record fn()'s (JSON-serializable) result, or return the recorded one when replaying"""
+        cassette = current()
+        if cassette is None:
+            return fn()
+        key = request_key(kind, key_data)
+        if self.replaying:
+            entry = cassette.take(kind, key, strict=self.settings.strict)
+            if self.delay(entry):
+                time.sleep(self.delay(entry))
+            return decode(entry["payload"]) if decode else entry["payload"]
+        started = time.perf_counter()
+        result = fn()
+        cassette.add(kind, key, encode(result) if encode else result, time.perf_counter() - started)
+        return result
+
+    async def a_call(self, kind: str, key_data: Any, fn: Callable[[], Awaitable[Any]], encode: Callable = None, decode: Callable = None):
+        """Async `call`: same keys, so a run recorded through one path replays through the other"""
+        cassette = current()
+        if cassette is None:
+            return await fn()
+        key = request_key(kind, key_data)
+        if self.replaying:
+            entry = cassette.take(kind, key, strict=self.settings.strict)
+            if self.delay(entry):
+                await asyncio.sleep(self.delay(entry))
+            return decode(entry["payload"]) if decode else entry["payload"]
+        started = time.perf_counter()
+        result = await fn()
+        cassette.add(kind, key, encode(result) if encode else result, time.perf_counter() - started)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "mode": self.settings.mode,
+                "directory": str(self.directory),
+                "latency_scale": self.settings.latency_scale,
+                "strict": self.settings.strict,
+                **self._counters,
+            }
+
+
+# ====== HTTP TRANSPORTS (OpenAI LLM + embeddings) ======
+
+def _recorded_response(request: httpx.Request, entry: dict) -> httpx.Response:
+    payload = entry["payload"]
+    content = base64.b64decode(payload["body_b64"]) if "body_b64" in payload else payload["body"].encode("utf-8")
+    return httpx.Response(payload["status"], headers=payload["headers"], content=content, request=request)
+
+
+def _response_payload(response: httpx.Response) -> dict:
+    headers = {k: v for k, v in response.headers.items() if k.lower() in KEPT_HEADERS}
+    try:
+        return {"status": response.status_code, "headers": headers, "body": response.content.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"status": response.status_code, "headers": headers, "body_b64": base64.b64encode(response.content).decode("ascii")}
+
+
+class CassetteTransport(httpx.BaseTransport):
+    """Outermost transport: replay short-circuits the network (and the rate-limit governor)"""
+
+    def __init__(self, inner: httpx.BaseTransport, deck: CassetteDeck):
+        self._transport = inner
+        self.deck = deck
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        cassette = current()
+        if cassette is None:
+            if self.deck.replaying:
+                raise CassetteMiss(f"{request.method} {request.url.path} outside a recorded run")
+            return self._transport.handle_request(request)
+        key = _http_key(request)
+        if self.deck.replaying:
+            entry = cassette.take("http", key, strict=self.deck.settings.strict)
+            if self.deck.delay(entry):
+                time.sleep(self.deck.delay(entry))
+            return _recorded_response(request, entry)
+        started = time.perf_counter()
+        response = self._transport.handle_request(request)
+        response.read()
+        cassette.add("http", key, _response_payload(response), time.perf_counter() - started)
+        return response
+
+    def close(self):
+        self._transport.close()
+
+
+class AsyncCassetteTransport(httpx.AsyncBaseTransport):
+    def __init__(self, inner: httpx.AsyncBaseTransport, deck: CassetteDeck):
+        self._transport = inner
+        self.deck = deck
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        cassette = current()
+        if cassette is None:
+            if self.deck.replaying:
+                raise CassetteMiss(f"{request.method} {request.url.path} outside a recorded run")
+            return await self._transport.handle_async_request(request)
+        key = _http_key(request)
+        if self.deck.replaying:
+            entry = cassette.take("http", key, strict=self.deck.settings.strict)
+            if self.deck.delay(entry):
+                await asyncio.sleep(self.deck.delay(entry))
+            return _recorded_response(request, entry)
+        started = time.perf_counter()
+        response = await self._transport.handle_async_request(request)
+        await response.aread()
+        cassette.add("http", key, _response_payload(response), time.perf_counter() - started)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
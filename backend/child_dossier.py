@@ -0,0 +1,244 @@
+"""
+Materialized child dossier: children_log joined with the inventory item of the requested gift.
+
+Gift names in children_log rarely match inventory item names exactly ("Lego Star Wars" vs
+"Lego Star Wars Millennium Falcon", "Pokemon Cards" vs "Pokemon Card Booster Box"), so the
+match is done once here on normalized tokens and stored in `child_dossier`: one row per
+child with score, status, gift and the stock/sector of the matched item.
+
+Triggers on children_log and inventory only append the changed child ids / item names to
+`child_dossier_changes` (plain SQL, so they work for any writer of northpole.db); `sync()`
+replays that queue and recomputes just the affected rows before a lookup.
+"""
+import re
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import text as sql_text
+
+from entity_extraction import normalize
+
+DOSSIER_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS child_dossier (
+    child_id INTEGER PRIMARY KEY,
+    name TEXT,
+    name_key TEXT,
+    city TEXT,
+    naughty_score INTEGER,
+    status TEXT,
+    last_incident TEXT,
+    gift_requested TEXT,
+    item_id INTEGER,
+    item_name TEXT,
+    stock_level TEXT,
+    warehouse_sector TEXT,
+    gift_match TEXT,
+    match_score REAL,
+    updated_at TEXT
+)
+"""
+DOSSIER_INDEXES_SQL = [
+    "CREATE INDEX IF NOT EXISTS idx_child_dossier_name ON child_dossier (name_key)",
+    "CREATE INDEX IF NOT EXISTS idx_child_dossier_item ON child_dossier (item_id)",
+]
+CHANGES_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS child_dossier_changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    child_id INTEGER,
+    item_name TEXT
+)
+"""
+TRIGGERS_SQL = {
+    "child_dossier_children_insert": "AFTER INSERT ON children_log BEGIN "
+        "INSERT INTO child_dossier_changes (child_id) VALUES (NEW.id); END",
+    "child_dossier_children_update": "AFTER UPDATE ON children_log BEGIN "
+        "INSERT INTO child_dossier_changes (child_id) VALUES (OLD.id), (NEW.id); END",
+    "child_dossier_children_delete": "AFTER DELETE ON children_log BEGIN "
+        "INSERT INTO child_dossier_changes (child_id) VALUES (OLD.id); END",
+    "child_dossier_inventory_insert": "AFTER INSERT ON inventory BEGIN "
+        "INSERT INTO child_dossier_changes (item_name) VALUES (NEW.item_name); END",
+    "child_dossier_inventory_update": "AFTER UPDATE ON inventory BEGIN "
+        "INSERT INTO child_dossier_changes (item_name) VALUES (OLD.item_name), (NEW.item_name); END",
+    "child_dossier_inventory_delete": "AFTER DELETE ON inventory BEGIN "
+        "INSERT INTO child_dossier_changes (item_name) VALUES (OLD.item_name); END",
+}
+
+DOSSIER_COLUMNS = (
+    "child_id, name, city, naughty_score, status, last_incident, gift_requested, "
+    "item_id, item_name, stock_level, warehouse_sector, gift_match, match_score"
+)
+DOSSIER_BY_IDS_SQL = f"SELECT {DOSSIER_COLUMNS} FROM child_dossier WHERE child_id IN ({{ids}}) ORDER BY child_id"
+DOSSIER_BY_NAME_SQL = f"SELECT {DOSSIER_COLUMNS} FROM child_dossier WHERE name_key LIKE :name ORDER BY child_id LIMIT 10"
+
+# Words that describe the packaging more than the gift: they don't count towards a match
+GENERIC_TOKENS = {"set", "kit", "kids", "edition", "junior", "official", "classic", "deluxe", "large", "premium", "starter", "the"}
+# Share of the gift's significant tokens the item name must contain
+MIN_COVERAGE = 0.6
+
+
+# ====== GIFT -> ITEM MATCHING ======
+
+def gift_tokens(value: Optional[str]) -> Set[str]:
+    """Normalized tokens, plurals folded ("Pokemon Cards" -> {"pokemon", "card"})"""
+    tokens = set()
+    for token in re.findall(r"[a-z0-9]+", normalize(value or "")):
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.add(token)
+    return tokens
+
+
+def _significant(tokens: Set[str]) -> Set[str]:
+    return (tokens - GENERIC_TOKENS) or tokens
+
+
+class GiftMatcher:
+    """Best inventory item for a requested gift (token coverage, then Jaccard, then shortest name)"""
+
+    def __init__(self, items: Iterable[Tuple[int, str]]):
+        self.items: Dict[int, Tuple[str, Set[str]]] = {}
+        self.exact: Dict[str, int] = {}
+        self.by_token: Dict[str, Set[int]] = {}
+        for item_id, item_name in items:
+            tokens = gift_tokens(item_name)
+            self.items[item_id] = (item_name, tokens)
+            self.exact.setdefault(normalize(item_name or ""), item_id)
+            for token in tokens:
+                self.by_token.setdefault(token, set()).add(item_id)
+
+    def match(self, gift: Optional[str]) -> Tuple[Optional[int], str, float]:
+        """(item_id, "exact" | "tokens" | "none", score)"""
+        if not gift:
+            return None, "none", 0.0
+        if normalize(gift) in self.exact:
+            return self.exact[normalize(gift)], "exact", 1.0
+        wanted = _significant(gift_tokens(gift))
+        candidates = set().union(*(self.by_token.get(t, set()) for t in wanted)) if wanted else set()
+        best, best_rank = None, None
+        for item_id in candidates:
+            item_name, tokens = self.items[item_id]
+            coverage = len(wanted & tokens) / len(wanted)
+            if coverage < MIN_COVERAGE:
+                continue
+            jaccard = len(wanted & tokens) / len(wanted | _significant(tokens))
+            rank = (coverage, jaccard, -len(item_name), -item_id)
+            if best_rank is None or rank > best_rank:
+                best, best_rank = item_id, rank
+        if best is None:
+            return None, "none", 0.0
+        return best, "tokens", round(best_rank[0] * 0.5 + best_rank[1] * 0.5, 3)
+
+
+# ====== DOSSIER ======
+
+class ChildDossier:
+    def __init__(self, db_engine):
+        self.db_engine = db_engine
+        self._lock = threading.Lock()
+        self.stats = {"rebuilds": 0, "synced_changes": 0, "recomputed_rows": 0}
+
+    def install(self) -> bool:
+        """Create table, queue and triggers; full rebuild when triggers were missing. True if rebuilt"""
+        with self.db_engine.begin() as conn:
+            conn.execute(sql_text(DOSSIER_TABLE_SQL))
+            for sql in DOSSIER_INDEXES_SQL:
+                conn.execute(sql_text(sql))
+            conn.execute(sql_text(CHANGES_TABLE_SQL))
+            existing = {row[0] for row in conn.execute(sql_text("SELECT name FROM sqlite_master WHERE type = 'trigger'"))}
+            missing = [name for name in TRIGGERS_SQL if name not in existing]
+            for name in missing:
+                conn.execute(sql_text(f"CREATE TRIGGER IF NOT EXISTS {name} {TRIGGERS_SQL[name]}"))
+        # Tables recreated (setup_db.py drops them with their triggers): changes may have been missed
+        if missing:
+            self.rebuild()
+            return True
+        self.sync()
+        return False
+
+    def rebuild(self):
+        """Recompute every row from scratch"""
+        with self._lock, self.db_engine.begin() as conn:
+            conn.execute(sql_text("DELETE FROM child_dossier_changes"))
+            matcher = self._matcher(conn)
+            children = list(conn.execute(sql_text("SELECT * FROM children_log")).mappings())
+            conn.execute(sql_text("DELETE FROM child_dossier"))
+            self._write(conn, matcher, children)
+            self.stats["rebuilds"] += 1
+            self.stats["recomputed_rows"] += len(children)
+
+    def sync(self) -> int:
+        """Apply the queued changes (no-op when the queue is empty). Rows recomputed"""
+        with self._lock, self.db_engine.begin() as conn:
+            changes = list(conn.execute(sql_text("SELECT id, child_id, item_name FROM child_dossier_changes ORDER BY id")))
+            if not changes:
+                return 0
+            child_ids = {child_id for _, child_id, _ in changes if child_id is not None}
+            item_tokens = set().union(*(gift_tokens(name) for _, _, name in changes if name is not None))
+            if item_tokens:
+                # An inventory change can move the best match of any child whose gift shares a word with it
+                for child_id, gift in conn.execute(sql_text("SELECT id, gift_requested FROM children_log")):
+                    if gift_tokens(gift) & item_tokens:
+                        child_ids.add(child_id)
+
+            matcher = self._matcher(conn)
+            children = []
+            if child_ids:
+                params = {f"id{i}": child_id for i, child_id in enumerate(child_ids)}
+                placeholders = ", ".join(f":{key}" for key in params)
+                children = list(conn.execute(sql_text(f"SELECT * FROM children_log WHERE id IN ({placeholders})"), params).mappings())
+                conn.execute(sql_text(f"DELETE FROM child_dossier WHERE child_id IN ({placeholders})"), params)
+            self._write(conn, matcher, children)
+            conn.execute(sql_text("DELETE FROM child_dossier_changes WHERE id <= :last"), {"last": changes[-1][0]})
+            self.stats["synced_changes"] += len(changes)
+            self.stats["recomputed_rows"] += len(children)
+            return len(children)
+
+    @staticmethod
+    def _matcher(conn) -> GiftMatcher:
+        return GiftMatcher(conn.execute(sql_text("SELECT item_id, item_name FROM inventory")))
+
+    @staticmethod
+    def _write(conn, matcher: GiftMatcher, children: List[dict]):
+        if not children:
+            return
+        inventory = {
+            row["item_id"]: row
+            for row in conn.execute(sql_text("SELECT item_id, item_name, stock_level, warehouse_sector FROM inventory")).mappings()
+        }
+        updated_at = datetime.now(timezone.utc).isoformat()
+        rows = []
+        for child in children:
+            item_id, method, score = matcher.match(child.get("gift_requested"))
+            item = inventory.get(item_id, {})
+            rows.append({
+                "child_id": child["id"],
+                "name": child.get("name"),
+                "name_key": normalize(child.get("name") or ""),
+                "city": child.get("city"),
+                "naughty_score": child.get("naughty_score"),
+                "status": child.get("status"),
+                "last_incident": child.get("last_incident"),
+                "gift_requested": child.get("gift_requested"),
+                "item_id": item_id,
+                "item_name": item.get("item_name"),
+                "stock_level": item.get("stock_level"),
+                "warehouse_sector": item.get("warehouse_sector"),
+                "gift_match": method,
+                "match_score": score,
+                "updated_at": updated_at,
+            })
+        conn.execute(sql_text(
+            "INSERT OR REPLACE INTO child_dossier (child_id, name, name_key, city, naughty_score, status, last_incident, "
+            "gift_requested, item_id, item_name, stock_level, warehouse_sector, gift_match, match_score, updated_at) "
+            "VALUES (:child_id, :name, :name_key, :city, :naughty_score, :status, :last_incident, :gift_requested, "
+            ":item_id, :item_name, :stock_level, :warehouse_sector, :gift_match, :match_score, :updated_at)"
+        ), rows)
+
+
+def dossier_query(child: str) -> Tuple[str, dict]:
+    """(sql, params) for a lookup by id ("CH-8847", "8847") or by (partial) name"""
+    match = re.fullmatch(r"\s*(?:CH[-\s]?)?(\d{1,9})\s*", child, re.IGNORECASE)
+    if match:
+        return DOSSIER_BY_IDS_SQL.format(ids=":id0"), {"id0": int(match.group(1))}
+    return DOSSIER_BY_NAME_SQL, {"name": f"%{normalize(child.strip())}%"}
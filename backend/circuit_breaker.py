@@ -0,0 +1,162 @@
+"""
+Circuit breaker on LLM calls (error rate and latency over a sliding window).
+
+Every LLM call made through the model router is recorded here. When, over the last
+`window_seconds`, too many calls failed or were slower than `slow_call_seconds`, the
+breaker opens and generate requests take the degraded (LLM-free) pipeline right away
+instead of waiting for the provider. After `cooldown_seconds` a single request is let
+through as a probe (half-open): its first LLM call closes the breaker again, or
+re-opens it for another cooldown.
+"""
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+MODES = ("auto", "off", "always")
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        mode: str = "auto",
+        window_seconds: float = 60.0,
+        min_calls: int = 5,
+        error_rate: float = 0.5,
+        slow_call_seconds: float = 20.0,
+        slow_rate: float = 0.5,
+        cooldown_seconds: float = 30.0,
+    ):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}")
+        self.mode = mode
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.cooldown_seconds = cooldown_seconds
+        self._lock = threading.Lock()
+        self._calls: Deque[Tuple[float, bool, bool]] = deque()  # (at, error, slow)
+        self._state = "closed"
+        self._opened_at: Optional[float] = None
+        self._probe_started: Optional[float] = None
+        self._reason: Optional[str] = None
+        self._counters = {"opened": 0, "rejected": 0, "probes": 0}
+
+    @classmethod
+    def from_env(cls) -> "CircuitBreaker":
+        return cls(
+            mode=os.getenv("DEGRADED_MODE", "auto").lower(),
+            window_seconds=float(os.getenv("LLM_BREAKER_WINDOW_SECONDS", "60")),
+            min_calls=int(os.getenv("LLM_BREAKER_MIN_CALLS", "5")),
+            error_rate=float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5")),
+            slow_call_seconds=float(os.getenv("LLM_BREAKER_SLOW_SECONDS", "20")),
+            slow_rate=float(os.getenv("LLM_BREAKER_SLOW_RATE", "0.5")),
+            cooldown_seconds=float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30")),
+        )
+
+    def _prune(self, now: float):
+        while self._calls and self._calls[0][0] < now - self.window_seconds:
+            self._calls.popleft()
+
+    def _open(self, now: float, reason: str):
+        self._state, self._opened_at, self._probe_started, self._reason = "open", now, None, reason
+        self._counters["opened"] += 1
+        print(f"🔌 LLM circuit breaker OPEN ({reason}): degraded mode for {self.cooldown_seconds:.0f}s")
+
+    def record(self, latency_seconds: float, error: bool = False):
+        """Outcome of one LLM call"""
+        now = time.monotonic()
+        slow = latency_seconds >= self.slow_call_seconds
+        with self._lock:
+            if self._state == "half_open":
+                if error or slow:
+                    self._open(now, "probe " + ("failed" if error else f"took {latency_seconds:.1f}s"))
+                else:
+                    self._state, self._reason = "closed", None
+                    self._calls.clear()
+                    print("🔌 LLM circuit breaker CLOSED: provider healthy again")
+                return
+            self._calls.append((now, error, slow))
+            if self._state == "open":
+                return
+            self._prune(now)
+            total = len(self._calls)
+            if total < self.min_calls:
+                return
+            errors = sum(1 for _, e, _ in self._calls if e)
+            slows = sum(1 for _, _, s in self._calls if s)
+            if errors / total >= self.error_rate:
+                self._open(now, f"{errors}/{total} LLM calls failed")
+            elif slows / total >= self.slow_rate:
+                self._open(now, f"{slows}/{total} LLM calls slower than {self.slow_call_seconds:.0f}s")
+
+    def allow(self) -> bool:
+        """True if this request may use the LLM (False = take the degraded pipeline)"""
+        if self.mode == "off":
+            return True
+        if self.mode == "always":
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if self._state == "closed":
+                return True
+            if self._state == "open" and now - self._opened_at >= self.cooldown_seconds:
+                self._state = "half_open"
+            if self._state == "half_open":
+                # One probe at a time; a probe that never reported back is replaced after a cooldown
+                if self._probe_started is None or now - self._probe_started >= self.cooldown_seconds:
+                    self._probe_started = now
+                    self._counters["probes"] += 1
+                    return True
+            self._counters["rejected"] += 1
+            return False
+
+    @property
+    def is_open(self) -> bool:
+        """Requests are being degraded right now (read-only: never starts a probe)"""
+        if self.mode != "auto":
+            return self.mode == "always"
+        now = time.monotonic()
+        with self._lock:
+            if self._state == "open":
+                return now - self._opened_at < self.cooldown_seconds
+            if self._state == "half_open":
+                return self._probe_started is not None and now - self._probe_started < self.cooldown_seconds
+            return False
+
+    @property
+    def state(self) -> str:
+        if self.mode != "auto":
+            return "forced_open" if self.mode == "always" else "disabled"
+        return self._state
+
+    @property
+    def reason(self) -> Optional[str]:
+        return "DEGRADED_MODE=always" if self.mode == "always" else self._reason
+
+    def describe(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            total = len(self._calls)
+            errors = sum(1 for _, e, _ in self._calls if e)
+            slows = sum(1 for _, _, s in self._calls if s)
+            retry_in = (
+                max(0.0, self.cooldown_seconds - (now - self._opened_at))
+                if self._state == "open" and self._opened_at is not None else None
+            )
+        return {
+            "mode": self.mode,
+            "state": self.state,
+            "reason": self.reason,
+            "window_seconds": self.window_seconds,
+            "calls": total,
+            "error_rate": round(errors / total, 3) if total else None,
+            "slow_rate": round(slows / total, 3) if total else None,
+            "slow_call_seconds": self.slow_call_seconds,
+            "probe_in": round(retry_in, 1) if retry_in is not None else None,
+            **self._counters,
+        }
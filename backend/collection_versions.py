@@ -0,0 +1,177 @@
+"""
+Versioned Qdrant collections behind an alias.
+
+The RAG engine only knows the alias names (`northpole_manuals`, `northpole_tickets`):
+Qdrant resolves them server side on every search, so a swap costs nothing per query.
+A re-index writes into a fresh `{alias}_v{n}` collection while the server keeps
+answering from the current one, validates it (point count + recall smoke test) and
+then moves the alias in a single atomic `update_collection_aliases` call. Previous
+versions are kept for rollback and pruned after `keep` versions.
+"""
+import re
+import time
+from typing import Dict, List, Optional
+
+from qdrant_client import models as qmodels
+
+VERSION_SUFFIX = re.compile(r"^(?P<alias>.+)_v(?P<version>\d+)$")
+
+
+def versioned_name(alias: str, version: int) -> str:
+    return f"{alias}_v{version}"
+
+
+def alias_of(collection_name: str) -> str:
+    """`northpole_tickets_v3` -> `northpole_tickets` (unversioned names are returned as is)"""
+    match = VERSION_SUFFIX.match(collection_name)
+    return match.group("alias") if match else collection_name
+
+
+class ReindexValidationError(RuntimeError):
+    """A freshly built version failed its checks: the alias was not moved"""
+
+
+class CollectionVersions:
+    def __init__(self, client, vector_name: str):
+        self.client = client
+        self.vector_name = vector_name
+
+    # ====== LOOKUP ======
+
+    def _collection_names(self) -> List[str]:
+        return [c.name for c in self.client.get_collections().collections]
+
+    def versions(self, alias: str) -> List[int]:
+        """Existing version numbers of `alias`, oldest first"""
+        found = []
+        for name in self._collection_names():
+            match = VERSION_SUFFIX.match(name)
+            if match and match.group("alias") == alias:
+                found.append(int(match.group("version")))
+        return sorted(found)
+
+    def resolve(self, alias: str) -> Optional[str]:
+        """Collection currently served under `alias` (None if it's not an alias)"""
+        for description in self.client.get_aliases().aliases:
+            if description.alias_name == alias:
+                return description.collection_name
+        return None
+
+    def is_legacy(self, alias: str) -> bool:
+        """True when `alias` is still a plain collection (layout before versioning)"""
+        return alias in self._collection_names()
+
+    def next_name(self, alias: str) -> str:
+        versions = self.versions(alias)
+        return versioned_name(alias, (versions[-1] if versions else 0) + 1)
+
+    # ====== VALIDATION ======
+
+    def wait_until_indexed(self, collection_name: str, timeout: float = 300.0, poll_seconds: float = 1.0) -> str:
+        """Wait for the optimizer to finish building the index (status green)"""
+        deadline = time.monotonic() + timeout
+        while True:
+            status = self.client.get_collection(collection_name).status
+            if status == qmodels.CollectionStatus.GREEN or time.monotonic() >= deadline:
+                return str(status.value if hasattr(status, "value") else status)
+            time.sleep(poll_seconds)
+
+    def recall_smoke_test(self, collection_name: str, sample: int = 50, k: int = 3,
+                          search_params: Optional[qmodels.SearchParams] = None) -> dict:
+        """Self-recall@k: each sampled point, searched with its own stored vector, must come back in its top k.
+
+        Cheap (no embedding calls) and catches what breaks a rebuilt index in practice:
+        empty or partial upload, wrong vector name/size, quantization without rescoring.
+        """
+        points, _ = self.client.scroll(
+            collection_name=collection_name,
+            limit=sample,
+            with_vectors=[self.vector_name],
+            with_payload=False
+        )
+        hits = 0
+        for point in points:
+            vector = point.vector.get(self.vector_name) if isinstance(point.vector, dict) else point.vector
+            result = self.client.query_points(
+                collection_name=collection_name,
+                query=vector,
+                using=self.vector_name,
+                limit=k,
+                search_params=search_params
+            )
+            hits += any(p.id == point.id for p in result.points)
+        return {
+            "sampled": len(points),
+            "k": k,
+            "recall": round(hits / len(points), 4) if points else None,
+        }
+
+    def validate(self, collection_name: str, expected_points: int, min_recall: float = 0.9,
+                 search_params: Optional[qmodels.SearchParams] = None, index_timeout: float = 300.0) -> dict:
+        """Point count + recall smoke test; raises ReindexValidationError on failure"""
+        status = self.wait_until_indexed(collection_name, timeout=index_timeout)
+        points = self.client.count(collection_name=collection_name, exact=True).count
+        report = {"collection": collection_name, "status": status, "points": points, "expected_points": expected_points}
+        if points != expected_points or points == 0:
+            raise ReindexValidationError(f"'{collection_name}' has {points} points, expected {expected_points}")
+        report.update(self.recall_smoke_test(collection_name, search_params=search_params))
+        if report["recall"] is None or report["recall"] < min_recall:
+            raise ReindexValidationError(
+                f"'{collection_name}' recall smoke test failed: {report['recall']} < {min_recall}"
+            )
+        return report
+
+    # ====== SWAP ======
+
+    def swap(self, alias: str, collection_name: str) -> Optional[str]:
+        """Point `alias` at `collection_name` atomically. Returns the previously served collection"""
+        previous = self.resolve(alias)
+        if self.is_legacy(alias):
+            # An alias can't shadow a real collection: the pre-versioning layout is dropped first,
+            # so this one-time migration leaves a few milliseconds with no collection under the name
+            print(f"⚠️ '{alias}' is a plain collection: dropping it to turn the name into an alias")
+            self.client.delete_collection(alias)
+            previous = None
+        operations = []
+        if previous is not None:
+            operations.append(qmodels.DeleteAliasOperation(delete_alias=qmodels.DeleteAlias(alias_name=alias)))
+        operations.append(qmodels.CreateAliasOperation(
+            create_alias=qmodels.CreateAlias(collection_name=collection_name, alias_name=alias)
+        ))
+        # Delete + create in one request: readers see either the old or the new collection
+        self.client.update_collection_aliases(change_aliases_operations=operations)
+        return previous
+
+    def prune(self, alias: str, keep: int = 1) -> List[str]:
+        """Drop old versions, keeping the served one and the `keep` previous ones (for rollback).
+
+        Unserved versions newer than the served one are builds that failed validation: dropped too.
+        """
+        match = VERSION_SUFFIX.match(self.resolve(alias) or "")
+        if match is None:
+            return []
+        served = int(match.group("version"))
+        older = [v for v in self.versions(alias) if v < served]
+        newer = [v for v in self.versions(alias) if v > served]
+        dropped = [versioned_name(alias, v) for v in older[:max(0, len(older) - keep)] + newer]
+        for name in dropped:
+            self.client.delete_collection(name)
+        return dropped
+
+    def rollback(self, alias: str) -> Optional[str]:
+        """Serve the newest version older than the current one (None if there is none)"""
+        match = VERSION_SUFFIX.match(self.resolve(alias) or "")
+        current = int(match.group("version")) if match else None
+        older = [v for v in self.versions(alias) if current is None or v < current]
+        if not older:
+            return None
+        target = versioned_name(alias, older[-1])
+        self.swap(alias, target)
+        return target
+
+    def describe(self, alias: str) -> Dict[str, object]:
+        return {
+            "alias": alias,
+            "serving": self.resolve(alias) or (alias if self.is_legacy(alias) else None),
+            "versions": [versioned_name(alias, v) for v in self.versions(alias)],
+        }
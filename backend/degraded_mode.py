@@ -0,0 +1,164 @@
+"""
+Degraded pipeline: a useful draft without any LLM or embedding call.
+
+Used when the LLM circuit breaker is open (provider slow or failing) or when the LLM
+pipeline errors out. Everything is local and takes milliseconds: the deterministic
+entity extraction + child dossier lookups, the closest past ticket (lexical match over
+data/past_tickets.json, plus the prefetched vector results when available) and an
+Italian template for the customer email. `coal_alert` follows the same rule the
+agent is given: naughty_score > 50.
+"""
+import json
+import math
+import pathlib
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+
+from entity_extraction import CHILD_ID_RE, normalize
+from models import OpsResponse, Ticket, ToolCall
+
+COAL_THRESHOLD = 50
+
+STOCK_PHRASES = {
+    "high": "disponibile a magazzino",
+    "medium": "disponibile a magazzino",
+    "low": "disponibile ma con scorte limitate",
+    "critical": "in esaurimento",
+    "out": "al momento esaurito",
+}
+STATUS_PHRASES = {
+    "APPROVED": "la richiesta risulta approvata",
+    "PENDING": "la richiesta è ancora in fase di verifica",
+    "COAL": "la richiesta è in fase di revisione da parte del nostro ufficio",
+}
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _words(text: str) -> List[str]:
+    return [w for w in _WORD_RE.findall(normalize(text or "")) if len(w) > 2]
+
+
+class PastTicketIndex:
+    """TF-IDF over past tickets (subject, message, tags): retrieval with no embedding call"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._tickets: Optional[List[dict]] = None
+        self._vectors: List[Dict[str, float]] = []
+        self._idf: Dict[str, float] = {}
+
+    def _load(self):
+        with self._lock:
+            if self._tickets is not None:
+                return
+            try:
+                tickets = json.loads(pathlib.Path(self.path).read_text(encoding="utf-8"))
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Past tickets not available for degraded mode: {e}")
+                tickets = []
+            docs = [Counter(_words(f"{t.get('subject')} {t.get('message')} {' '.join(t.get('tags', []))}")) for t in tickets]
+            df = Counter(word for doc in docs for word in doc)
+            self._idf = {word: math.log((1 + len(docs)) / (1 + n)) + 1 for word, n in df.items()}
+            self._vectors = [self._weigh(doc) for doc in docs]
+            self._tickets = tickets
+
+    def _weigh(self, counts: Counter) -> Dict[str, float]:
+        weights = {w: c * self._idf.get(w, 0.0) for w, c in counts.items()}
+        norm = math.sqrt(sum(v * v for v in weights.values())) or 1.0
+        return {w: v / norm for w, v in weights.items()}
+
+    def best_match(self, ticket: Ticket) -> Optional[dict]:
+        """Most similar past ticket (same category breaks ties), None if nothing overlaps"""
+        self._load()
+        query = self._weigh(Counter(_words(f"{ticket.subject} {ticket.message}")))
+        best, best_score = None, 0.0
+        for past, vector in zip(self._tickets, self._vectors):
+            score = sum(weight * vector.get(word, 0.0) for word, weight in query.items())
+            if score and past.get("category") == ticket.category:
+                score += 0.05
+            if score > best_score:
+                best, best_score = past, score
+        return best
+
+
+def _children(ticket: Ticket, facts: dict) -> List[dict]:
+    """Children the ticket is about: the ones named in full or by CH id. None otherwise: other
+    matches (first name + surname/city) are fine as facts for the agent, not for the email
+    and the coal alert"""
+    children = facts.get("child_dossier") or facts.get("children_log") or []
+    text = normalize(f"{ticket.subject}\n{ticket.message}")
+    ids = {int(i) for i in CHILD_ID_RE.findall(f"{ticket.subject}\n{ticket.message}")}
+    named = [
+        c for c in children
+        if (c.get("child_id") or c.get("id")) in ids or (c.get("name") and normalize(c["name"]) in text)
+    ]
+    return named
+
+
+def _child_lines(children: List[dict]) -> List[str]:
+    lines = []
+    for child in children:
+        name = child.get("name") or f"ID {child.get('child_id') or child.get('id')}"
+        line = f"Abbiamo verificato la posizione di {name}: {STATUS_PHRASES.get(child.get('status'), 'la richiesta è in lavorazione')}."
+        gift = child.get("gift_requested")
+        stock = STOCK_PHRASES.get((child.get("stock_level") or "").lower())
+        if gift and stock and child.get("status") != "COAL":
+            line += f" Il regalo richiesto ({gift}) risulta {stock}."
+        lines.append(line)
+    return lines
+
+
+def build_degraded_response(ticket: Ticket, facts: dict, sql_queries: List[str], reason: str,
+                            past_ticket: Optional[dict] = None, past_tickets_text: Optional[str] = None,
+                            tool_calls: Optional[List[ToolCall]] = None) -> OpsResponse:
+    """OpsResponse from local evidence only (template email, checklist from DB facts and the closest past ticket)"""
+    children = _children(ticket, facts)
+    coal = [c for c in children if (c.get("naughty_score") or 0) > COAL_THRESHOLD]
+
+    body = ["Gentile cliente,", "", f"grazie per averci contattato in merito a \"{ticket.subject}\"."]
+    child_lines = _child_lines(children)
+    if child_lines:
+        body += [""] + child_lines
+    body += [
+        "",
+        "Un membro del nostro team sta esaminando la sua richiesta e la ricontatterà al più presto con tutti i dettagli.",
+        "",
+        "Cordiali saluti,",
+        "Il Team del Polo Nord",
+    ]
+
+    checklist = ["Rivedere la bozza: generata in modalità degradata (senza LLM)"]
+    for child in children:
+        level = (child.get("stock_level") or "").lower()
+        reorder = f"Verificare il riordino di '{child.get('item_name')}' (stock {child.get('stock_level')}, {child.get('warehouse_sector')})"
+        if level in ("low", "critical", "out") and child.get("item_name") and reorder not in checklist:
+            checklist.append(reorder)
+    for child in coal:
+        checklist.append(f"Coal alert: {child.get('name')} ha naughty_score {child.get('naughty_score')}")
+    if past_ticket:
+        checklist.append(f"Applicare la soluzione del ticket {past_ticket.get('id')}: {(past_ticket.get('response') or '')[:200]}")
+    elif not facts:
+        checklist.append("Identificare il bambino o l'articolo coinvolto (nessun dato trovato nel database)")
+    elif not children:
+        checklist.append("Identificare il bambino coinvolto (nessun ID o nome completo nel ticket)")
+
+    thought = [f"Modalità degradata ({reason}): risposta costruita senza LLM."]
+    thought.append(f"Dati DB: {', '.join(facts) if facts else 'nessuno'}.")
+    if past_ticket:
+        thought.append(f"Ticket simile: {past_ticket.get('id')} - {past_ticket.get('subject')} ({past_ticket.get('resolution')}).")
+    if past_tickets_text:
+        thought.append(f"Ticket simili (ricerca pre-caricata):\n{past_tickets_text[:600]}")
+
+    return OpsResponse(
+        thought_process="\n".join(thought),
+        sql_query_used="\n".join(sql_queries) or "N/A",
+        action_checklist=checklist,
+        coal_alert=bool(coal),
+        final_response="\n".join(body),
+        tool_calls=tool_calls or [],
+        degraded=True,
+    )
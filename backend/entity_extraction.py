@@ -0,0 +1,189 @@
+"""
+Rule-based entity extraction for incoming tickets (fast path ahead of sql_expert).
+
+Tickets usually name the child ("child_id: CH-8847", "Giulia Bianchi", "mio figlio
+Pierre"), the city and the gift. The extractor matches the message against the
+vocabulary already in northpole.db (names, cities, requested gifts, inventory items)
+and the engine runs the canonical parameterized queries below directly, so the
+sql_expert agent is only needed when nothing is found.
+
+Only a child id or a full name identifies a child. A first name alone ("Marco e Luca",
+"Emma") matches children who merely share it, and a city matches everyone living there:
+they only narrow the children with that first name down to the ones whose surname or
+city the ticket also mentions ("mio figlio Pierre" + "Isabelle Méchant da Lyon").
+"""
+import re
+import threading
+import unicodedata
+from typing import Dict, List, Tuple
+
+from pydantic import BaseModel
+from sqlalchemy import text as sql_text
+
+# "child_id: CH-8847", "CH-8847", "CH 8847" -> children_log.id = 8847
+CHILD_ID_RE = re.compile(r"\bCH[-\s]?(\d{1,9})\b", re.IGNORECASE)
+
+# Italian spellings used in tickets -> city as stored in children_log
+CITY_ALIASES = {
+    "roma": "Rome",
+    "milano": "Milan",
+    "napoli": "Naples",
+    "firenze": "Florence",
+    "monaco di baviera": "Munich",
+    "parigi": "Paris",
+    "lione": "Lyon",
+    "londra": "London",
+    "berlino": "Berlin",
+    "amburgo": "Hamburg",
+    "vienna": "Vienna",
+    "praga": "Prague",
+    "varsavia": "Warsaw",
+    "copenaghen": "Copenhagen",
+    "stoccolma": "Stockholm",
+}
+
+# ====== CANONICAL QUERIES ======
+# Bounded: the rows end up in the prompt
+CHILDREN_BY_ID_SQL = "SELECT * FROM children_log WHERE id IN ({ids}) LIMIT 20"
+CHILDREN_BY_NAME_SQL = "SELECT * FROM children_log WHERE name IN ({names}) LIMIT 20"
+INVENTORY_BY_GIFT_SQL = "SELECT * FROM inventory WHERE lower(item_name) LIKE :gift LIMIT 10"
+
+
+def normalize(value: str) -> str:
+    """Casefold and strip accents ("Méchant" -> "mechant")"""
+    decomposed = unicodedata.normalize("NFKD", value)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def _strip_accents(value: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", value)
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def _phrase_re(phrase: str, flags: int = 0) -> "re.Pattern":
+    return re.compile(r"(?<!\w)" + re.escape(phrase) + r"(?!\w)", flags)
+
+
+class TicketEntities(BaseModel):
+    """Entities found in a ticket, with values as stored in the database"""
+    child_ids: List[int] = []
+    names: List[str] = []
+    cities: List[str] = []
+    gifts: List[str] = []
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.child_ids or self.names or self.cities or self.gifts)
+
+
+class EntityExtractor:
+    """Matches ticket text against the database vocabulary (loaded once, refreshable)"""
+
+    def __init__(self, db_engine):
+        self.db_engine = db_engine
+        self._lock = threading.Lock()
+        self._vocabulary = None
+
+    # ====== VOCABULARY ======
+
+    def _load_vocabulary(self):
+        names, cities, gifts = {}, {}, {}
+        first_names: Dict[str, List[Tuple[str, str, "re.Pattern"]]] = {}  # first name -> [(name, city, surname)]
+        with self.db_engine.connect() as conn:
+            for name, city, gift in conn.execute(sql_text("SELECT name, city, gift_requested FROM children_log")):
+                if name:
+                    names[normalize(name)] = name
+                    first, _, surname = _strip_accents(name).partition(" ")
+                    if surname:
+                        first_names.setdefault(first, []).append((name, city, _phrase_re(surname)))
+                if city:
+                    cities[normalize(city)] = city
+                if gift:
+                    gifts[normalize(gift)] = gift
+            for (item_name,) in conn.execute(sql_text("SELECT item_name FROM inventory")):
+                if item_name:
+                    gifts[normalize(item_name)] = item_name
+        for alias, city in CITY_ALIASES.items():
+            if normalize(city) in cities:
+                cities.setdefault(alias, city)
+
+        # Longest phrases first: "Lego Star Wars" wins over "Lego"
+        def patterns(vocab, flags=re.IGNORECASE):
+            return [(_phrase_re(k, flags), v) for k, v in sorted(vocab.items(), key=lambda kv: -len(kv[0]))]
+
+        return {
+            "names": patterns(names),
+            # First names and surnames must be capitalized in the text ("Emma", not "emma"; "Cattivo", not "cattivi")
+            "first_names": [(_phrase_re(k), v) for k, v in first_names.items()],
+            "cities": patterns(cities),
+            "gifts": patterns(gifts),
+        }
+
+    def refresh(self):
+        """Reload names/cities/gifts from the database"""
+        vocabulary = self._load_vocabulary()
+        with self._lock:
+            self._vocabulary = vocabulary
+
+    def _get_vocabulary(self):
+        if self._vocabulary is None:
+            self.refresh()
+        return self._vocabulary
+
+    # ====== EXTRACTION ======
+
+    def extract(self, text: str) -> TicketEntities:
+        """Child ids, names, cities and gifts mentioned in `text`"""
+        vocabulary = self._get_vocabulary()
+        folded = normalize(text)
+        plain = _strip_accents(text)
+
+        def find(patterns, haystack):
+            found, consumed = [], haystack
+            for pattern, value in patterns:
+                if pattern.search(consumed):
+                    if value not in found:
+                        found.append(value)
+                    # Don't let "Lego" match again inside an already matched "Lego Star Wars"
+                    consumed = pattern.sub(" ", consumed)
+            return found
+
+        names = find(vocabulary["names"], folded)
+        cities = find(vocabulary["cities"], folded)
+        # A first name identifies a child only together with that child's surname or city
+        for pattern, candidates in vocabulary["first_names"]:
+            if pattern.search(plain):
+                names.extend(
+                    name for name, city, surname in candidates
+                    if name not in names and (city in cities or surname.search(plain))
+                )
+
+        return TicketEntities(
+            child_ids=sorted({int(m) for m in CHILD_ID_RE.findall(text)}),
+            names=names,
+            cities=cities,
+            gifts=find(vocabulary["gifts"], folded),
+        )
+
+
+def canonical_queries(entities: TicketEntities) -> List[Tuple[str, str, dict]]:
+    """(table, sql, params) for the entities (cities only narrow names down, see extract())"""
+    queries = []
+
+    def in_clause(sql_template, placeholder, prefix, values):
+        keys = [f"{prefix}{i}" for i in range(len(values))]
+        sql = sql_template.format(**{placeholder: ", ".join(f":{k}" for k in keys)})
+        return sql, dict(zip(keys, values))
+
+    if entities.child_ids:
+        queries.append(("children_log", *in_clause(CHILDREN_BY_ID_SQL, "ids", "id", entities.child_ids)))
+    if entities.names:
+        queries.append(("children_log", *in_clause(CHILDREN_BY_NAME_SQL, "names", "name", entities.names)))
+    for gift in entities.gifts:
+        queries.append(("inventory", INVENTORY_BY_GIFT_SQL, {"gift": f"%{gift.lower()}%"}))
+    return queries
+
+
+def format_query(sql: str, params: dict) -> str:
+    """Readable form of a parameterized query for logs/tool call traces"""
+    return f"{sql} -- {params}" if params else sql
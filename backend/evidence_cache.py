@@ -0,0 +1,206 @@
+"""
+Short-lived, per-ticket cache of prefetched evidence (retrieval + DB lookups).
+
+When the console lists or opens a ticket, the engine starts collecting evidence in
+the background; generate_response then only has to run the synthesis step.
+"""
+import asyncio
+import hashlib
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from models import Ticket, ToolCall
+from shared_cache import SharedCache
+
+# Workers waiting for evidence another worker is collecting check the shared cache this often
+SHARED_POLL_SECONDS = 0.1
+
+
+def ticket_key(ticket: Ticket) -> str:
+    """Cache key: ticket id + content hash (an edited ticket is a different ticket)"""
+    digest = hashlib.sha1(f"{ticket.subject}\n{ticket.message}".encode("utf-8")).hexdigest()[:16]
+    return f"{ticket.id}:{digest}"
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class TicketEvidence:
+    """Evidence gathered for one ticket before the operator clicks generate"""
+
+    def __init__(self, ticket_id: str):
+        self.ticket_id = ticket_id
+        self.manuals = ""
+        self.past_tickets = ""
+        self.db_facts = ""  # JSON rows from children_log / inventory ("" = nothing found)
+        self.sql_queries: List[str] = []
+        self.tool_calls: List[ToolCall] = []
+        self.collected_at = time.time()
+        self.duration_ms = 0.0
+
+    @property
+    def has_db_facts(self) -> bool:
+        return bool(self.db_facts)
+
+    def to_dict(self) -> dict:
+        return {
+            "ticket_id": self.ticket_id,
+            "manuals": self.manuals,
+            "past_tickets": self.past_tickets,
+            "db_facts": self.db_facts,
+            "sql_queries": self.sql_queries,
+            "tool_calls": [tc.model_dump() for tc in self.tool_calls],
+            "collected_at": self.collected_at,
+            "duration_ms": self.duration_ms,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TicketEvidence":
+        evidence = cls(data["ticket_id"])
+        evidence.manuals = data.get("manuals", "")
+        evidence.past_tickets = data.get("past_tickets", "")
+        evidence.db_facts = data.get("db_facts", "")
+        evidence.sql_queries = list(data.get("sql_queries", []))
+        evidence.tool_calls = [ToolCall(**tc) for tc in data.get("tool_calls", [])]
+        evidence.collected_at = data.get("collected_at", evidence.collected_at)
+        evidence.duration_ms = data.get("duration_ms", 0.0)
+        return evidence
+
+    def to_prompt(self, db_facts: Optional[str] = None) -> str:
+        """Evidence block for the synthesis prompt (`db_facts` overrides the prefetched rows)"""
+        return f"""DATI DATABASE (children_log / inventory):
+{db_facts or self.db_facts or "Nessun dato trovato nel database."}
+
+QUERY SQL ESEGUITE:
+{chr(10).join(self.sql_queries) or "N/A"}
+
+MANUALI E PROTOCOLLI:
+{self.manuals or "Nessuna informazione rilevante trovata nei manuali."}
+
+TICKET PASSATI SIMILI:
+{self.past_tickets or "Nessun ticket passato simile trovato."}"""
+
+
+class EvidenceCache:
+    """TTL cache of in-flight/completed evidence futures, one per ticket.
+
+    With a cross-worker SharedCache, only one worker collects a ticket's evidence (it
+    claims the ticket in the shared cache) and publishes it there: a generate request
+    landing on another worker uses it, waiting for it if it is still being collected.
+    """
+
+    def __init__(self, ttl_seconds: float = 120.0, max_entries: int = 512, max_workers: int = 4, shared: Optional[SharedCache] = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: Dict[str, Tuple[float, Future]] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        # An in-process shared cache would only duplicate the futures above
+        self.shared = shared if shared is not None and shared.shared else None
+
+    def _evict(self, now: float):
+        expired = [k for k, (expires_at, _) in self._entries.items() if expires_at <= now]
+        for k in expired:
+            del self._entries[k]
+        # Oldest first when still over budget (dict keeps insertion order)
+        while len(self._entries) > self.max_entries:
+            del self._entries[next(iter(self._entries))]
+
+    def start(self, key: str, collect: Callable[[], TicketEvidence]) -> bool:
+        """Start collecting evidence for `key` unless already cached/in flight. True if started"""
+        return self._start(key, lambda: self._executor.submit(self._collect_and_publish, key, collect))
+
+    def start_async(self, key: str, collect: Callable[[], Awaitable[TicketEvidence]], loop: asyncio.AbstractEventLoop) -> bool:
+        """Like start(), with `collect()` run as a task on `loop` (get() works from any thread)"""
+        async def collect_and_publish():
+            try:
+                evidence = await collect()
+            except Exception:
+                self._release(key)
+                raise
+            return self._publish(key, evidence)
+
+        return self._start(key, lambda: asyncio.run_coroutine_threadsafe(collect_and_publish(), loop))
+
+    def _start(self, key: str, submit: Callable[[], Future]) -> bool:
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                future = entry[1]
+                # A failed prefetch must not block a retry
+                if not (future.done() and future.exception() is not None):
+                    return False
+            # Another worker is collecting (or has collected) this ticket's evidence
+            if self.shared is not None and not self.shared.add("evidence_claims", key, b"1", self.ttl_seconds):
+                return False
+            future = submit()
+            self._entries[key] = (now + self.ttl_seconds, future)
+            return True
+
+    def _collect_and_publish(self, key: str, collect: Callable[[], TicketEvidence]) -> TicketEvidence:
+        try:
+            evidence = collect()
+        except Exception:
+            self._release(key)
+            raise
+        return self._publish(key, evidence)
+
+    def _publish(self, key: str, evidence: TicketEvidence) -> TicketEvidence:
+        if self.shared is not None:
+            self.shared.set_json("evidence", key, evidence.to_dict(), self.ttl_seconds)
+        return evidence
+
+    def _release(self, key: str):
+        if self.shared is not None:
+            self.shared.delete("evidence_claims", key)
+
+    def _shared_get(self, key: str, wait_seconds: float) -> Optional[TicketEvidence]:
+        if self.shared is None:
+            return None
+        # Polling sleeps: only from worker threads, a single check on the event loop
+        deadline = time.monotonic() + (0 if _on_event_loop() else wait_seconds)
+        while True:
+            data = self.shared.get_json("evidence", key)
+            if data is not None:
+                return TicketEvidence.from_dict(data)
+            # Nobody is collecting it (any more), or no time left to wait
+            if self.shared.get("evidence_claims", key) is None or time.monotonic() >= deadline:
+                return None
+            time.sleep(SHARED_POLL_SECONDS)
+
+    def get(self, key: str, wait_seconds: float = 0.0) -> Optional[TicketEvidence]:
+        """Completed evidence for `key` (waits up to `wait_seconds` for an in-flight prefetch).
+
+        Call it from a worker thread to wait: on an event loop thread it only checks, since
+        blocking the loop would also stall an async prefetch running on it (start_async).
+        """
+        with self._lock:
+            self._evict(time.time())
+            entry = self._entries.get(key)
+        if entry is None:
+            return self._shared_get(key, wait_seconds)
+        try:
+            return entry[1].result(timeout=0 if _on_event_loop() else wait_seconds)
+        except FutureTimeout:
+            return None
+        except Exception as e:
+            print(f"⚠️ Prefetch failed for {key}: {e}")
+            return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = list(self._entries.values())
+        return {
+            "entries": len(entries),
+            "in_flight": sum(1 for _, f in entries if not f.done()),
+            "shared": self.shared is not None,
+        }
@@ -0,0 +1,256 @@
+"""
+HTTP caching and compression helpers for the FastAPI app:
+- CompressionMiddleware: Brotli/Gzip for HTML/JSON/text responses (never SSE)
+- StaticAsset: in-memory, pre-compressed file with strong ETag + Last-Modified (304 support)
+- CachedStaticFiles: StaticFiles with long-lived immutable caching for fingerprinted assets
+"""
+import gzip
+import hashlib
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+
+try:
+    import brotli  # Optional: falls back to gzip only
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    "text/html",
+    "text/css",
+    "text/plain",
+    "text/javascript",
+    "application/javascript",
+    "application/json",
+    "image/svg+xml",
+)
+
+# name.<hash>.ext, e.g. app.3f9a1c2b.js -> content never changes for that URL
+FINGERPRINT_RE = re.compile(r"\.[0-9a-f]{8,}\.[a-z0-9]+$", re.IGNORECASE)
+ETAG_SUFFIX_RE = re.compile(r'-(?:br|gzip)"')
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+def accepted_encodings(accept_encoding: str) -> dict:
+    """Parse an Accept-Encoding header into {encoding: q}"""
+    encodings = {}
+    for part in accept_encoding.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        encodings[name.strip().lower()] = q
+    return encodings
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Best supported content-coding for the client ("br", "gzip" or None)"""
+    encodings = accepted_encodings(accept_encoding)
+    wildcard = encodings.get("*", 0.0)
+    if brotli is not None and encodings.get("br", wildcard) > 0:
+        return "br"
+    if encodings.get("gzip", wildcard) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str, static: bool = False) -> bytes:
+    """Compress a body; `static` content is compressed once so it can afford max level"""
+    if encoding == "br":
+        return brotli.compress(body, quality=11 if static else 5)
+    return gzip.compress(body, compresslevel=9 if static else 6, mtime=0)
+
+
+def _is_compressible(content_type: str) -> bool:
+    media_type = content_type.split(";")[0].strip().lower()
+    return media_type in COMPRESSIBLE_TYPES
+
+
+class CompressionMiddleware:
+    """Pure ASGI middleware compressing single-body HTML/JSON/text responses.
+
+    Streamed responses (e.g. the SSE endpoint) are passed through untouched, as well
+    as responses that already carry a Content-Encoding.
+    """
+
+    def __init__(self, app, minimum_size: int = 500):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        scope = self._strip_etag_suffixes(scope)
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if (
+                    "content-encoding" in headers
+                    or not _is_compressible(headers.get("content-type", ""))
+                ):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start_message = message  # Delay until we see the body
+                return
+
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            if start_message is None:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            headers = MutableHeaders(raw=start_message["headers"])
+            if more_body or len(body) < self.minimum_size:
+                # Streaming or tiny body: not worth compressing
+                headers.add_vary_header("Accept-Encoding")
+                await send(start_message)
+                start_message = None
+                passthrough = True
+                await send(message)
+                return
+
+            compressed = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            if "etag" in headers:
+                # Strong validators must differ between representations
+                headers["ETag"] = headers["etag"][:-1] + f'-{encoding}"'
+            await send(start_message)
+            start_message = None
+            await send({"type": "http.response.body", "body": compressed, "more_body": False})
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def _strip_etag_suffixes(scope):
+        """Map If-None-Match tags of compressed variants back to the app's own ETags"""
+        raw = scope.get("headers", [])
+        if not any(k == b"if-none-match" for k, _ in raw):
+            return scope
+        headers = []
+        for key, value in raw:
+            if key == b"if-none-match":
+                value = ETAG_SUFFIX_RE.sub('"', value.decode("latin-1")).encode("latin-1")
+            headers.append((key, value))
+        return {**scope, "headers": headers}
+
+
+def etag_for(body: bytes) -> str:
+    """Strong ETag derived from the content"""
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[float] = None) -> bool:
+    """Conditional request check (If-None-Match wins over If-Modified-Since)"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        # Compressed variants get a "-br"/"-gzip" suffix, they validate the same content
+        base = etag[:-1]
+        return "*" in tags or any(t == etag or t.startswith(base + "-") for t in tags)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+class StaticAsset:
+    """A small file served from memory with pre-compressed variants.
+
+    The file is re-read only when its mtime/size change, so edits are picked up
+    without restarting while normal hits cost a single stat().
+    """
+
+    def __init__(self, path, media_type: str, cache_control: str = REVALIDATE_CACHE_CONTROL):
+        self.path = str(path)
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self._signature = None
+        self._load()
+
+    def _load(self):
+        stat = os.stat(self.path)
+        with open(self.path, "rb") as f:
+            body = f.read()
+        self.body = body
+        self.etag = etag_for(body)
+        self.last_modified = stat.st_mtime
+        self.variants = {"br": None, "gzip": compress(body, "gzip", static=True)}
+        if brotli is not None:
+            self.variants["br"] = compress(body, "br", static=True)
+        self._signature = (stat.st_mtime_ns, stat.st_size)
+
+    def _refresh(self):
+        stat = os.stat(self.path)
+        if (stat.st_mtime_ns, stat.st_size) != self._signature:
+            self._load()
+
+    def response(self, request: Request) -> Response:
+        self._refresh()
+        headers = {
+            "ETag": self.etag,
+            "Last-Modified": formatdate(self.last_modified, usegmt=True),
+            "Cache-Control": self.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        if is_not_modified(request, self.etag, self.last_modified):
+            return Response(status_code=304, headers=headers)
+
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""))
+        body = self.variants.get(encoding) if encoding else None
+        if body is None:
+            return Response(content=self.body, media_type=self.media_type, headers=headers)
+        headers["Content-Encoding"] = encoding
+        headers["ETag"] = self.etag[:-1] + f'-{encoding}"'
+        return Response(content=body, media_type=self.media_type, headers=headers)
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles with an explicit caching policy.
+
+    Fingerprinted files (name.<hash>.ext) are cached for a year as immutable; every
+    other file must be revalidated (StaticFiles already answers 304 on ETag/Last-Modified).
+    """
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if FINGERPRINT_RE.search(str(full_path)):
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        else:
+            response.headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL
+        return response
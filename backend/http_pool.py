@@ -0,0 +1,397 @@
+"""
+Shared HTTP connection pool for every OpenAI call (LLM and embeddings).
+
+One keep-alive pool per process (HTTP/2 when the `h2` package is installed), sized to
+the request concurrency, instead of a default httpx stack per client:
+- limits/keep-alive from HTTP_* env vars, per-kind timeouts (LLM reads are long, embeddings short)
+- DNS answers cached for HTTP_DNS_TTL_SECONDS (new connections skip the lookup)
+- hedged embedding calls: if an embedding request (idempotent) has no answer after
+  HTTP_HEDGE_AFTER_SECONDS a second copy is sent and the first response wins; the copy
+  takes its own RPM/TPM from the rate-limit governor and is skipped when that would wait
+- counters: requests, new connections (TCP+TLS handshakes), reuse ratio, DNS cache, hedges
+
+Layering (see openai_clients.governed_http_clients):
+    CassetteTransport -> GovernedTransport -> metered -> [hedged] -> shared pool
+"""
+import asyncio
+import ipaddress
+import os
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
+
+import anyio
+import httpcore
+import httpx
+from pydantic import BaseModel
+
+from rate_limiter import RateLimitGovernor, RateLimitShed
+
+try:
+    import h2  # noqa: F401 - enables httpx's HTTP/2 support
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+KINDS = ("llm", "embeddings")
+
+
+class HttpPoolSettings(BaseModel):
+    http2: bool = True
+    max_connections: int = 32
+    max_keepalive_connections: int = 32
+    keepalive_expiry: float = 90.0
+    connect_timeout: float = 5.0
+    pool_timeout: float = 10.0
+    write_timeout: float = 30.0
+    llm_read_timeout: float = 120.0
+    embeddings_read_timeout: float = 15.0
+    dns_ttl_seconds: float = 300.0
+    hedge_after_seconds: float = 0.0  # 0 = no hedging
+    hedge_max_ratio: float = 0.1
+
+    @classmethod
+    def from_env(cls) -> "HttpPoolSettings":
+        # Every admitted request fans out to a few parallel calls (evidence collection, prefetch)
+        concurrency = int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "4"))
+        max_connections = int(os.getenv("HTTP_MAX_CONNECTIONS", str(max(20, 8 * concurrency))))
+        return cls(
+            http2=os.getenv("HTTP_HTTP2", "true").lower() == "true",
+            max_connections=max_connections,
+            max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE", str(max_connections))),
+            keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_SECONDS", "90")),
+            connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT", "5")),
+            pool_timeout=float(os.getenv("HTTP_POOL_TIMEOUT", "10")),
+            write_timeout=float(os.getenv("HTTP_WRITE_TIMEOUT", "30")),
+            llm_read_timeout=float(os.getenv("HTTP_LLM_TIMEOUT", "120")),
+            embeddings_read_timeout=float(os.getenv("HTTP_EMBEDDINGS_TIMEOUT", "15")),
+            dns_ttl_seconds=float(os.getenv("HTTP_DNS_TTL_SECONDS", "300")),
+            hedge_after_seconds=float(os.getenv("HTTP_HEDGE_AFTER_SECONDS", "0")),
+            hedge_max_ratio=float(os.getenv("HTTP_HEDGE_MAX_RATIO", "0.1")),
+        )
+
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def timeout(self, kind: str) -> httpx.Timeout:
+        read = self.llm_read_timeout if kind == "llm" else self.embeddings_read_timeout
+        return httpx.Timeout(connect=self.connect_timeout, read=read, write=self.write_timeout, pool=self.pool_timeout)
+
+
+# ====== DNS CACHE ======
+
+class DNSCache:
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[Tuple[str, int], Tuple[float, List[str]]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _is_ip(host: str) -> bool:
+        try:
+            ipaddress.ip_address(host)
+            return True
+        except ValueError:
+            return False
+
+    def cached(self, host: str, port: int) -> Optional[List[str]]:
+        if self._is_ip(host) or self.ttl_seconds <= 0:
+            return [host] if self._is_ip(host) else None
+        with self._lock:
+            entry = self._entries.get((host, port))
+            if entry and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+        return None
+
+    def resolve(self, host: str, port: int) -> List[str]:
+        addresses = self.cached(host, port)
+        if addresses is not None:
+            return addresses
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        # Unique addresses, in resolver order (IPv6/IPv4 preference is the resolver's)
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        with self._lock:
+            self.misses += 1
+            if self.ttl_seconds > 0:
+                self._entries[(host, port)] = (time.monotonic() + self.ttl_seconds, addresses)
+        return addresses
+
+
+class _CachingSyncBackend(httpcore.SyncBackend):
+    """Connects to the cached addresses of the host; TLS still verifies the original host name (SNI)"""
+
+    def __init__(self, pool: "SharedHttpPool"):
+        self.pool = pool
+
+    def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        error: Optional[Exception] = None
+        for address in self.pool.dns.resolve(host, port):
+            try:
+                stream = super().connect_tcp(address, port, timeout, local_address, socket_options)
+                self.pool._count("connections_opened")
+                return stream
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                error = e
+        raise error or httpcore.ConnectError(f"No address for {host}")
+
+
+class _CachingAsyncBackend(httpcore.AnyIOBackend):
+    def __init__(self, pool: "SharedHttpPool"):
+        self.pool = pool
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        addresses = self.pool.dns.cached(host, port)
+        if addresses is None:
+            addresses = await anyio.to_thread.run_sync(self.pool.dns.resolve, host, port)
+        error: Optional[Exception] = None
+        for address in addresses:
+            try:
+                stream = await super().connect_tcp(address, port, timeout, local_address, socket_options)
+                self.pool._count("connections_opened")
+                return stream
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                error = e
+        raise error or httpcore.ConnectError(f"No address for {host}")
+
+
+# ====== METERING & HEDGING ======
+
+def _copy_request(request: httpx.Request) -> httpx.Request:
+    return httpx.Request(
+        request.method, request.url, headers=request.headers, content=request.content, extensions=request.extensions
+    )
+
+
+class _MeteredTransport(httpx.BaseTransport):
+    def __init__(self, transport: httpx.BaseTransport, pool: "SharedHttpPool", kind: str):
+        self._transport = transport
+        self.pool = pool
+        self.kind = kind
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.pool._count(f"{self.kind}_requests", in_flight=1)
+        try:
+            return self._transport.handle_request(request)
+        except httpx.TransportError:
+            self.pool._count(f"{self.kind}_errors")
+            raise
+        finally:
+            self.pool._count(in_flight=-1)
+
+
+class _AsyncMeteredTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport: httpx.AsyncBaseTransport, pool: "SharedHttpPool", kind: str):
+        self._transport = transport
+        self.pool = pool
+        self.kind = kind
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.pool._count(f"{self.kind}_requests", in_flight=1)
+        try:
+            return await self._transport.handle_async_request(request)
+        except httpx.TransportError:
+            self.pool._count(f"{self.kind}_errors")
+            raise
+        finally:
+            self.pool._count(in_flight=-1)
+
+
+def _reserve_hedge(governor: Optional[RateLimitGovernor], pool: "SharedHttpPool", request: httpx.Request) -> bool:
+    """Take RPM/TPM for a hedge; False (budget left untouched) when the governor would make it wait"""
+    plan = governor.plan(request) if governor is not None else None
+    if plan is None:
+        return True
+    try:
+        wait = governor.reserve(plan)
+    except RateLimitShed:
+        wait = None
+    if wait is None or wait > 0:
+        if wait is not None:
+            governor.refund(plan)
+        pool._count("hedges_throttled")
+        return False
+    return True
+
+
+class HedgedTransport(httpx.BaseTransport):
+    """For idempotent requests: after `hedge_after_seconds` without a response, send a copy; first answer wins.
+
+    Hedges are capped at `hedge_max_ratio` of the requests, so a slow provider is not
+    hit with twice the load. The governor above only paces the original request: the copy
+    reserves its own budget here, and is not sent if the buckets can't grant it right away.
+    """
+
+    def __init__(self, transport: httpx.BaseTransport, pool: "SharedHttpPool", governor: Optional[RateLimitGovernor] = None):
+        self._transport = transport
+        self.pool = pool
+        self.governor = governor
+        self._executor = ThreadPoolExecutor(max_workers=pool.settings.max_connections, thread_name_prefix="hedge")
+
+    def _send(self, request: httpx.Request) -> httpx.Response:
+        response = self._transport.handle_request(request)
+        response.read()
+        return response
+
+    @staticmethod
+    def _discard(future):
+        if not future.cancelled() and future.exception() is None:
+            future.result().close()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.pool._count("hedgeable")
+        request.read()
+        primary = self._executor.submit(self._send, request)
+        done, _ = wait([primary], timeout=self.pool.settings.hedge_after_seconds)
+        if done or not self.pool._take_hedge() or not _reserve_hedge(self.governor, self.pool, request):
+            return primary.result()
+
+        hedge = self._executor.submit(self._send, _copy_request(request))
+        pending, error = {primary, hedge}, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self.pool._count("hedges_won")
+                    for other in pending:
+                        other.add_done_callback(self._discard)
+                    for other in done - {future}:
+                        self._discard(other)
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+
+class AsyncHedgedTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport: httpx.AsyncBaseTransport, pool: "SharedHttpPool", governor: Optional[RateLimitGovernor] = None):
+        self._transport = transport
+        self.pool = pool
+        self.governor = governor
+
+    async def _reserve_hedge(self, request: httpx.Request) -> bool:
+        if self.governor is not None and self.governor.shared_state:
+            return await asyncio.to_thread(_reserve_hedge, self.governor, self.pool, request)
+        return _reserve_hedge(self.governor, self.pool, request)
+
+    async def _send(self, request: httpx.Request) -> httpx.Response:
+        response = await self._transport.handle_async_request(request)
+        await response.aread()
+        return response
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.pool._count("hedgeable")
+        await request.aread()
+        primary = asyncio.ensure_future(self._send(request))
+        done, _ = await asyncio.wait({primary}, timeout=self.pool.settings.hedge_after_seconds)
+        if done or not self.pool._take_hedge() or not await self._reserve_hedge(request):
+            return await primary
+
+        hedge = asyncio.ensure_future(self._send(_copy_request(request)))
+        pending, error = {primary, hedge}, None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        self.pool._count("hedges_won")
+                    for other in pending:
+                        other.cancel()
+                    for other in done - {task}:
+                        if other.exception() is None:
+                            await other.result().aclose()
+                    return task.result()
+                error = error or task.exception()
+        raise error
+
+
+# ====== SHARED POOL ======
+
+class SharedHttpPool:
+    """The process-wide keep-alive pool; clients get per-kind transports/timeouts on top of it"""
+
+    def __init__(self, settings: Optional[HttpPoolSettings] = None):
+        self.settings = settings or HttpPoolSettings()
+        self.http2 = self.settings.http2 and HTTP2_AVAILABLE
+        if self.settings.http2 and not HTTP2_AVAILABLE:
+            print("⚠️ HTTP/2 requested but the 'h2' package is not installed: using HTTP/1.1")
+        self.dns = DNSCache(self.settings.dns_ttl_seconds)
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {"in_flight": 0, "connections_opened": 0, "hedgeable": 0, "hedges": 0, "hedges_won": 0, "hedges_throttled": 0}
+        for kind in KINDS:
+            self._counters[f"{kind}_requests"] = 0
+            self._counters[f"{kind}_errors"] = 0
+
+        limits = self.settings.limits()
+        self._transport = httpx.HTTPTransport(http2=self.http2, limits=limits)
+        self._async_transport = httpx.AsyncHTTPTransport(http2=self.http2, limits=limits)
+        # httpx doesn't expose the network backend: set it on the underlying httpcore pools
+        self._transport._pool._network_backend = _CachingSyncBackend(self)
+        self._async_transport._pool._network_backend = _CachingAsyncBackend(self)
+
+    @classmethod
+    def from_env(cls) -> "SharedHttpPool":
+        return cls(HttpPoolSettings.from_env())
+
+    def _count(self, name: Optional[str] = None, in_flight: int = 0):
+        with self._lock:
+            if name:
+                self._counters[name] += 1
+            self._counters["in_flight"] += in_flight
+
+    def _take_hedge(self) -> bool:
+        with self._lock:
+            budget = max(1, int(self._counters["hedgeable"] * self.settings.hedge_max_ratio))
+            if self._counters["hedges"] >= budget:
+                return False
+            self._counters["hedges"] += 1
+            return True
+
+    def _hedging(self, kind: str) -> bool:
+        return kind == "embeddings" and self.settings.hedge_after_seconds > 0
+
+    def transport(self, kind: str, governor: Optional[RateLimitGovernor] = None) -> httpx.BaseTransport:
+        inner = HedgedTransport(self._transport, self, governor) if self._hedging(kind) else self._transport
+        return _MeteredTransport(inner, self, kind)
+
+    def async_transport(self, kind: str, governor: Optional[RateLimitGovernor] = None) -> httpx.AsyncBaseTransport:
+        inner = AsyncHedgedTransport(self._async_transport, self, governor) if self._hedging(kind) else self._async_transport
+        return _AsyncMeteredTransport(inner, self, kind)
+
+    def timeout(self, kind: str) -> httpx.Timeout:
+        return self.settings.timeout(kind)
+
+    @staticmethod
+    def _connections(transport) -> dict:
+        connections = list(transport._pool.connections)
+        return {
+            "open": len(connections),
+            "idle": sum(1 for c in connections if c.is_idle()),
+            "http2": sum(1 for c in connections if "HTTP/2" in c.info()),
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+        requests = sum(counters[f"{kind}_requests"] for kind in KINDS)
+        return {
+            "http2": self.http2,
+            "max_connections": self.settings.max_connections,
+            "max_keepalive_connections": self.settings.max_keepalive_connections,
+            "keepalive_expiry": self.settings.keepalive_expiry,
+            "timeouts": {kind: self.settings.timeout(kind).as_dict() for kind in KINDS},
+            **counters,
+            # Requests served on an already open connection (no TCP/TLS handshake)
+            "reuse_ratio": round(max(0.0, 1 - counters["connections_opened"] / requests), 4) if requests else None,
+            "dns_cache": {"hits": self.dns.hits, "misses": self.dns.misses, "ttl_seconds": self.dns.ttl_seconds},
+            "sync_pool": self._connections(self._transport),
+            "async_pool": self._connections(self._async_transport),
+        }
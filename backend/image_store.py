@@ -0,0 +1,130 @@
+"""
+Content-addressed store for damage photos attached to tickets.
+
+Uploads are streamed with a size limit, downscaled/re-encoded to a bounded
+resolution (JPEG) and saved under their SHA-256: uploading the same photo twice is
+free, and retries/regenerations refer to the image by id instead of re-sending it.
+"""
+import hashlib
+import io
+import os
+import re
+import tempfile
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from models import ImageUploadResponse
+
+try:
+    from PIL import Image, ImageOps  # Optional: without Pillow images are stored as uploaded
+except ImportError:
+    Image = None
+
+IMAGE_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+UPLOAD_CHUNK_SIZE = 64 * 1024
+ALLOWED_SIGNATURES = {
+    b"\xff\xd8\xff": ("image/jpeg", "jpg"),
+    b"\x89PNG\r\n\x1a\n": ("image/png", "png"),
+    b"GIF87a": ("image/gif", "gif"),
+    b"GIF89a": ("image/gif", "gif"),
+    b"RIFF": ("image/webp", "webp"),
+}
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def _sniff(data: bytes):
+    for signature, kind in ALLOWED_SIGNATURES.items():
+        if data.startswith(signature):
+            if signature == b"RIFF" and data[8:12] != b"WEBP":
+                continue
+            return kind
+    return None
+
+
+class ImageStore:
+    def __init__(self, root: str, max_upload_bytes: int = 10 * 1024 * 1024, max_side: int = 1600, jpeg_quality: int = 85):
+        self.root = root
+        self.max_upload_bytes = max_upload_bytes
+        self.max_side = max_side
+        self.jpeg_quality = jpeg_quality
+        os.makedirs(self.root, exist_ok=True)
+        if Image is None:
+            print("⚠️ Pillow not installed: images are stored without downscaling.")
+
+    # ====== WRITE ======
+
+    async def save_upload(self, upload) -> ImageUploadResponse:
+        """Read an UploadFile chunk by chunk (never more than the limit) and store it"""
+        buffer = io.BytesIO()
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            if buffer.tell() + len(chunk) > self.max_upload_bytes:
+                raise ImageTooLarge(f"Image exceeds {self.max_upload_bytes // (1024 * 1024)} MB")
+            buffer.write(chunk)
+        # Decoding/resizing is CPU bound: keep it off the event loop
+        return await run_in_threadpool(self.save_bytes, buffer.getvalue())
+
+    def save_bytes(self, data: bytes) -> ImageUploadResponse:
+        """Normalize raw image bytes and store them under their content hash"""
+        if len(data) > self.max_upload_bytes:
+            raise ImageTooLarge(f"Image exceeds {self.max_upload_bytes // (1024 * 1024)} MB")
+        if _sniff(data) is None:
+            raise InvalidImage("Unsupported image format (JPEG, PNG, GIF or WebP expected)")
+
+        body, content_type, ext, width, height = self._normalize(data)
+        image_id = hashlib.sha256(body).hexdigest()
+        path = self._path(image_id, ext)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file + rename: concurrent uploads of the same photo are safe
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+        return ImageUploadResponse(image_id=image_id, content_type=content_type, size_bytes=len(body), width=width, height=height)
+
+    def _normalize(self, data: bytes):
+        """Downscale to max_side and re-encode as JPEG (EXIF orientation applied)"""
+        if Image is None:
+            content_type, ext = _sniff(data)
+            return data, content_type, ext, None, None
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                img.draft("RGB", (self.max_side, self.max_side))  # JPEG: decode directly at reduced scale
+                img = ImageOps.exif_transpose(img)
+                img.thumbnail((self.max_side, self.max_side))
+                if img.mode != "RGB":
+                    img = img.convert("RGB")
+                out = io.BytesIO()
+                img.save(out, format="JPEG", quality=self.jpeg_quality, optimize=True)
+                return out.getvalue(), "image/jpeg", "jpg", img.width, img.height
+        except Exception as e:
+            raise InvalidImage(f"Cannot decode image: {e}")
+
+    # ====== READ ======
+
+    def _path(self, image_id: str, ext: str) -> str:
+        return os.path.join(self.root, image_id[:2], f"{image_id}.{ext}")
+
+    def find(self, image_id: str) -> Optional[str]:
+        """Path of a stored image, None if unknown"""
+        if not IMAGE_ID_RE.match(image_id or ""):
+            return None
+        for _, ext in ALLOWED_SIGNATURES.values():
+            path = self._path(image_id, ext)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def exists(self, image_id: str) -> bool:
+        return self.find(image_id) is not None
@@ -0,0 +1,220 @@
+"""
+Knowledge base ingestion: parallel parsing/splitting with a persistent chunk cache.
+
+Files are parsed and split in a process pool and their chunks are yielded in batches as
+soon as each file is done, so embedding starts while the rest of the corpus is still
+being split. Split results are cached by file content hash + parser + splitter
+settings (never by embedding model): re-indexing with another embedding model, or
+after editing a handful of manuals, only re-splits what actually changed.
+"""
+import hashlib
+import json
+import os
+import pathlib
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from html.parser import HTMLParser
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from shared_cache import SharedCache
+
+# Bump when a parser changes its output: cached chunks of the old parsers are ignored
+PARSER_VERSION = 1
+CACHE_NAMESPACE = "chunks"
+
+
+# ====== PARSERS ======
+# Each one turns a file into a datapizza Node tree; they run inside the worker processes
+
+class _HTMLText(HTMLParser):
+    """Visible text of an HTML page, one paragraph per block element"""
+
+    BLOCKS = {"p", "div", "section", "article", "li", "tr", "br", "h1", "h2", "h3", "h4", "h5", "h6", "pre", "table"}
+    SKIP = {"script", "style", "head", "nav"}
+
+    def __init__(self):
+        super().__init__()
+        self.parts: List[str] = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self._skipping += 1
+        elif tag in self.BLOCKS:
+            self.parts.append("\n\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP and self._skipping:
+            self._skipping -= 1
+        elif tag in self.BLOCKS:
+            self.parts.append("\n\n")
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self.parts.append(data)
+
+    def text(self) -> str:
+        paragraphs = (" ".join(p.split()) for p in "".join(self.parts).split("\n\n"))
+        return "\n\n".join(p for p in paragraphs if p)
+
+
+def _parse_txt(path: pathlib.Path, metadata: dict):
+    from datapizza.modules.parsers.text_parser import parse_text
+    return parse_text(path.read_text(encoding="utf-8"), metadata=metadata)
+
+
+def _parse_md(path: pathlib.Path, metadata: dict):
+    from datapizza.modules.parsers.md_parser import MDParser
+    return MDParser().parse(str(path), metadata=metadata)
+
+
+def _parse_html(path: pathlib.Path, metadata: dict):
+    from datapizza.modules.parsers.text_parser import parse_text
+    extractor = _HTMLText()
+    extractor.feed(path.read_text(encoding="utf-8", errors="replace"))
+    return parse_text(extractor.text(), metadata=metadata)
+
+
+def _parse_pdf(path: pathlib.Path, metadata: dict):
+    from datapizza.modules.parsers.text_parser import parse_text
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise RuntimeError("pypdf not installed (pip install pypdf)")
+    pages = (page.extract_text() or "" for page in PdfReader(str(path)).pages)
+    return parse_text("\n\n".join(pages), metadata=metadata)
+
+
+PARSERS = {
+    ".txt": _parse_txt,
+    ".md": _parse_md,
+    ".markdown": _parse_md,
+    ".html": _parse_html,
+    ".htm": _parse_html,
+    ".pdf": _parse_pdf,
+}
+
+
+def split_file(path: str, max_char: int, overlap: int) -> List[str]:
+    """Parse + split one file (runs in a worker process): the chunk texts, in order"""
+    from datapizza.modules.splitters import RecursiveSplitter
+
+    file_path = pathlib.Path(path)
+    node = PARSERS[file_path.suffix.lower()](file_path, {"source": file_path.name})
+    chunks = RecursiveSplitter(max_char=max_char, overlap=overlap).split(node)
+    texts = [c.text if hasattr(c, "text") else str(c) for c in chunks]
+    return [text for text in texts if text and text.strip()]
+
+
+# ====== INGESTION ======
+
+class KnowledgeBaseIngestor:
+    def __init__(self, max_char: int = 1000, overlap: int = 100, workers: Optional[int] = None,
+                 cache: Optional[SharedCache] = None):
+        self.max_char = max_char
+        self.overlap = overlap
+        self.workers = workers or os.cpu_count() or 1
+        self.cache = cache
+        self.stats = {"files": 0, "cached": 0, "split": 0, "failed": 0, "chunks": 0}
+
+    @classmethod
+    def from_env(cls, default_cache_path: Optional[str] = None, **kwargs) -> "KnowledgeBaseIngestor":
+        """Workers from INGEST_WORKERS, cache file from CHUNK_CACHE_PATH ("off" disables it)"""
+        cache_path = os.getenv("CHUNK_CACHE_PATH", default_cache_path or "")
+        cache = None
+        if cache_path and cache_path.lower() != "off":
+            cache = SharedCache(cache_path, max_bytes=int(float(os.getenv("CHUNK_CACHE_MAX_MB", "1024")) * 1024 * 1024))
+        workers = int(os.getenv("INGEST_WORKERS", "0")) or None
+        return cls(workers=workers, cache=cache, **kwargs)
+
+    @staticmethod
+    def discover(root: pathlib.Path) -> List[pathlib.Path]:
+        """Supported files under `root` (recursive), in a stable order"""
+        return sorted(p for p in root.rglob("*") if p.is_file() and p.suffix.lower() in PARSERS)
+
+    def _cache_key(self, path: pathlib.Path) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        settings = f"{PARSER_VERSION}:{path.suffix.lower()}:{self.max_char}:{self.overlap}"
+        return f"{settings}:{digest.hexdigest()}"
+
+    def iter_texts(self, files: List[pathlib.Path]) -> Iterator[Tuple[pathlib.Path, List[str]]]:
+        """(file, chunk texts) for every file, cache hits first, then split files as they complete"""
+        keys = {path: self._cache_key(path) for path in files} if self.cache else {}
+        cached = self.cache.get_many(CACHE_NAMESPACE, keys.values()) if self.cache else {}
+        self.stats["files"] += len(files)
+
+        pending = []
+        for path in files:
+            hit = cached.get(keys.get(path))
+            if hit is not None:
+                self.stats["cached"] += 1
+                yield path, json.loads(hit)
+            else:
+                pending.append(path)
+
+        for path, texts in self._split_all(pending):
+            if texts is None:
+                continue
+            self.stats["split"] += 1
+            if self.cache:
+                self.cache.set(CACHE_NAMESPACE, keys[path], json.dumps(texts, ensure_ascii=False).encode("utf-8"))
+            yield path, texts
+
+    def _split_all(self, files: List[pathlib.Path]) -> Iterator[Tuple[pathlib.Path, Optional[List[str]]]]:
+        if not files:
+            return
+        if self.workers == 1 or len(files) == 1:
+            # Not worth spawning processes
+            for path in files:
+                yield path, self._split_one(path)
+            return
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(files))) as pool:
+            futures = {pool.submit(split_file, str(path), self.max_char, self.overlap): path for path in files}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    yield path, future.result()
+                except Exception as e:
+                    self._failed(path, e)
+                    yield path, None
+
+    def _split_one(self, path: pathlib.Path) -> Optional[List[str]]:
+        try:
+            return split_file(str(path), self.max_char, self.overlap)
+        except Exception as e:
+            self._failed(path, e)
+            return None
+
+    def _failed(self, path: pathlib.Path, error: Exception):
+        self.stats["failed"] += 1
+        print(f"   ❌ {path.name}: {error}")
+
+    def iter_chunk_batches(self, root: pathlib.Path, batch_size: int = 256) -> Iterator[list]:
+        """datapizza Chunks of every supported file under `root`, in batches of about `batch_size`"""
+        from datapizza.type import Chunk
+
+        batch: list = []
+        for path, texts in self.iter_texts(self.discover(root)):
+            source = path.relative_to(root).as_posix()
+            batch.extend(
+                Chunk(id=str(uuid.uuid4()), text=text, metadata={"source": source, "chunk_index": i})
+                for i, text in enumerate(texts)
+            )
+            self.stats["chunks"] += len(texts)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def describe(self) -> Dict[str, object]:
+        return {
+            "workers": self.workers,
+            "max_char": self.max_char,
+            "overlap": self.overlap,
+            "cache": self.cache.path if self.cache else None,
+            **self.stats,
+        }
@@ -1,17 +1,27 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Query, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, StreamingResponse
-from datetime import datetime
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import Optional
+import asyncio
+import base64
+import binascii
+import contextlib
 import os
 import json
 from dotenv import load_dotenv
 
 from models import (
     Ticket, GenerateResponseRequest, GenerateResponseResponse,
-    ExampleTicketsResponse, HealthResponse
+    ExampleTicketsResponse, HealthResponse, ImageUploadResponse
 )
-from rag_engine import RAGEngine
+from http_cache import CompressionMiddleware, CachedStaticFiles, StaticAsset, is_not_modified
+from ticket_inbox import TicketInbox
+from image_store import ImageStore, ImageTooLarge, InvalidImage
+from scheduler import PriorityScheduler, SchedulerQueueFull
+from rate_limiter import RateLimitShed
+from stream_runs import SSE_RETRY_MS, StreamRun, StreamRunRegistry, format_sse
+from startup import EngineStartup
 
 # Load environment variables
 load_dotenv()
@@ -31,25 +41,65 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount static files (frontend)
+# Brotli/Gzip for HTML/JSON responses (SSE streams are never buffered/compressed)
+app.add_middleware(CompressionMiddleware, minimum_size=500)
+
+# Mount static files (frontend) - fingerprinted assets cached as immutable
 import pathlib
 frontend_dir = pathlib.Path(__file__).parent.parent / "frontend"
-app.mount("/static", StaticFiles(directory=str(frontend_dir)), name="static")
+app.mount("/static", CachedStaticFiles(directory=str(frontend_dir)), name="static")
+
+# Operator console served from memory, pre-compressed, with ETag/Last-Modified (304)
+index_page = StaticAsset(frontend_dir / "index.html", media_type="text/html")
+
+# Example + open tickets, loaded and serialized once (reloaded when the sources change)
+root_dir = pathlib.Path(__file__).parent.parent
+ticket_inbox = TicketInbox(
+    seed_path=str(root_dir / "data" / "example_tickets.json"),
+    db_path=str(root_dir / "northpole.db")
+)
+
+# Content-addressed store for uploaded damage photos
+image_store = ImageStore(
+    root=os.getenv("IMAGE_STORE_DIR", str(root_dir / "data" / "image_store")),
+    max_upload_bytes=int(os.getenv("MAX_IMAGE_UPLOAD_MB", "10")) * 1024 * 1024,
+    max_side=int(os.getenv("MAX_IMAGE_SIDE", "1600"))
+)
 
-# Initialize RAG engine
+# Priority-aware admission in front of the engine (critical tickets first, no starvation)
+scheduler = PriorityScheduler()
+
+# Streamed runs outlive their HTTP connection: clients reconnect with Last-Event-ID
+stream_runs = StreamRunRegistry.from_env()
+
+# Initialize RAG engine (in background, see startup.py): None until built and warmed up
 rag_engine = None
+engine_startup = EngineStartup.from_env()
+
+
+def _build_engine():
+    # Imported here: datapizza/OpenAI/Qdrant imports run in the worker thread, not before the server listens
+    from rag_engine import RAGEngine
+    return RAGEngine()
+
+
+def _engine_ready(engine):
+    global rag_engine
+    rag_engine = engine
+
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize the RAG engine on startup"""
-    global rag_engine
+    """Start building and warming up the RAG engine; the server answers liveness probes meanwhile"""
     print("Initializing RAG engine...")
-    try:
-        rag_engine = RAGEngine()
-        print("RAG engine initialized successfully")
-    except Exception as e:
-        print(f"Failed to initialize RAG engine: {e}")
-        rag_engine = None
+    app.state.engine_startup_task = asyncio.create_task(engine_startup.run(_build_engine, _engine_ready))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush the run ledger's pending records and stop the evidence threads"""
+    if rag_engine is not None:
+        await run_in_threadpool(rag_engine.ledger.close)
+        rag_engine.evidence_executor.shutdown(wait=False, cancel_futures=True)
 
 @app.get("/api/health", response_model=HealthResponse)
 async def health_check():
@@ -57,7 +107,7 @@ async def health_check():
     if rag_engine is None:
         return HealthResponse(
             status="unhealthy",
-            message="RAG engine not initialized"
+            message=f"RAG engine not ready ({engine_startup.state})" + (f": {engine_startup.error}" if engine_startup.error else "")
         )
 
     return HealthResponse(
@@ -65,69 +115,209 @@ async def health_check():
         message="API is running and RAG engine is ready"
     )
 
+@app.get("/api/health/live")
+async def liveness():
+    """Liveness: the process serves requests (503 only if the engine could not be built at all)"""
+    body = {"status": "alive" if engine_startup.state != "failed" else "failed", **engine_startup.describe()}
+    return JSONResponse(body, status_code=503 if engine_startup.state == "failed" else 200)
+
+@app.get("/api/health/ready")
+async def readiness():
+    """Readiness: engine built and warmed up, DB and Qdrant answering (per-dependency latency)"""
+    if not engine_startup.ready:
+        return JSONResponse({"ready": False, **engine_startup.describe()}, status_code=503)
+    dependencies = await run_in_threadpool(rag_engine.check_dependencies)
+    ready = all(check["ok"] for check in dependencies.values())
+    body = {"ready": ready, "dependencies": dependencies, **engine_startup.describe()}
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+@app.get("/api/scheduler/stats")
+async def scheduler_stats():
+    """Per-priority queue lengths, queue-time percentiles and SLO attainment"""
+    return scheduler.stats()
+
+@app.get("/api/rate-limits")
+async def rate_limit_stats():
+    """OpenAI rate-limit governor: configured RPM/TPM, waits, sheds, 429s and token estimates"""
+    if rag_engine is None:
+        raise HTTPException(status_code=503, detail="RAG engine not available")
+    return rag_engine.governor.stats()
+
+
+@app.get("/api/http-pool")
+async def http_pool_stats():
+    """Shared OpenAI connection pool: open/idle connections, reuse ratio, DNS cache, hedged requests"""
+    if rag_engine is None:
+        raise HTTPException(status_code=503, detail="RAG engine not available")
+    return rag_engine.http_pool.stats()
+
+
+@app.get("/api/shared-cache")
+async def shared_cache_stats():
+    """Cross-worker cache: backend, size/entries, evictions and this worker's hit ratio per namespace"""
+    if rag_engine is None:
+        raise HTTPException(status_code=503, detail="RAG engine not available")
+    return {
+        **(await run_in_threadpool(rag_engine.shared_cache.stats)),
+        "evidence_prefetch": rag_engine.evidence_cache.stats(),
+    }
+
+
+@app.get("/api/degraded-mode")
+async def degraded_mode():
+    """LLM circuit breaker: state, error/slow rates over the window, opens and degraded requests"""
+    if rag_engine is None:
+        raise HTTPException(status_code=503, detail="RAG engine not available")
+    return rag_engine.breaker.describe()
+
+
+@app.get("/api/memory")
+async def memory_report(top: int = Query(0, ge=0, le=200), group_by: str = Query("lineno", pattern="^(lineno|filename|traceback)$")):
+    """RSS trend, per-path memory deltas of generate runs, live per-request objects and (with
+    MEMORY_PROFILING=tracemalloc and top > 0) the allocation sites that grew since the baseline"""
+    if rag_engine is None:
+        raise HTTPException(status_code=503, detail="RAG engine not available")
+    report = await run_in_threadpool(rag_engine.memory.describe, top, group_by)
+    report["objects"] = {
+        **(await run_in_threadpool(rag_engine.memory_gauges)),
+        "stream_runs": stream_runs.stats(),
+    }
+    return report
+
+
+@app.post("/api/memory/baseline")
+async def memory_baseline():
+    """New tracemalloc baseline: later top allocation sites are relative to now"""
+    if rag_engine is None:
+        raise HTTPException(status_code=503, detail="RAG engine not available")
+    if not rag_engine.memory.tracing:
+        raise HTTPException(status_code=409, detail="Set MEMORY_PROFILING=tracemalloc to trace allocations")
+    await run_in_threadpool(rag_engine.memory.reset_baseline)
+    return {"status": "ok"}
+
+
+@app.get("/api/collections")
+async def collection_versions():
+    """RAG collections: alias -> served version and the versions kept for rollback (see setup_rag.py)"""
+    if rag_engine is None:
+        raise HTTPException(status_code=503, detail="RAG engine not available")
+    return {"collections": await run_in_threadpool(rag_engine.describe_collections)}
+
+
+@app.get("/api/agent-budgets")
+async def agent_budgets():
+    """Agent step budgets per role and ticket category, duplicate tool calls served from memo, early stops"""
+    if rag_engine is None:
+        raise HTTPException(status_code=503, detail="RAG engine not available")
+    return rag_engine.step_budgets.describe()
+
+
+@app.get("/api/models/routes")
+async def model_route_stats():
+    """Model routing: rules (MODEL_ROUTES) and per-route calls, latency p50/p95, tokens and cost"""
+    if rag_engine is None:
+        raise HTTPException(status_code=503, detail="RAG engine not available")
+    return rag_engine.router.stats()
+
+
+# ====== RUN LEDGER (every generate request, see run_ledger.py) ======
+
+def _ledger():
+    if rag_engine is None:
+        raise HTTPException(status_code=503, detail="RAG engine not available")
+    return rag_engine.ledger
+
+
+@app.get("/api/runs/slowest")
+async def slowest_runs(limit: int = Query(20, ge=1, le=500), since_hours: Optional[float] = Query(None, gt=0), path: Optional[str] = None):
+    """Slowest runs with their tool sequence and per-LLM-call timings/tokens"""
+    return await run_in_threadpool(_ledger().slowest_runs, limit, since_hours, path)
+
+
+@app.get("/api/runs/tool-sequences")
+async def run_tool_sequences(limit: int = Query(20, ge=1, le=500), since_hours: Optional[float] = Query(None, gt=0)):
+    """Most frequent tool call sequences with average duration and tokens"""
+    return await run_in_threadpool(_ledger().tool_sequences, limit, since_hours)
+
+
+@app.get("/api/runs/cache-opportunities")
+async def run_cache_opportunities(limit: int = Query(20, ge=1, le=500), since_hours: Optional[float] = Query(None, gt=0)):
+    """Repeated tool calls, regenerated tickets and prompt-cache hit ratio per model"""
+    return await run_in_threadpool(_ledger().cache_opportunities, limit, since_hours)
+
+
+@app.get("/api/runs/summary")
+async def run_summary(since_hours: float = Query(24, gt=0)):
+    """Runs per hour, latency percentiles, errors and tokens per path/priority"""
+    return await run_in_threadpool(_ledger().summary, since_hours)
+
+def acquire_slot(priority: str):
+    """Scheduler lease for a generate request (503 when the queue is full)"""
+    try:
+        return scheduler.acquire(priority)
+    except SchedulerQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
 @app.get("/api/tickets/examples", response_model=ExampleTicketsResponse)
-async def get_example_tickets():
-    """Get example tickets for demo"""
-    example_tickets = [
-        Ticket(
-            id="NP-2025-001",
-            category="Reclamo Regalo",
-            priority="critical",
-            subject="MIO FIGLIO HA RICEVUTO CARBONE - VERGOGNA!",
-            message="Buongiorno, sono Maria Rossi, la madre di Tommy (child_id: CH-8847). Stamattina mio figlio ha aperto il pacco e invece della PlayStation 5 che aveva chiesto c'era un pezzo di CARBONE. Tommy ha pianto per due ore! È stato bravissimo tutto l'anno: fa i compiti, aiuta in casa, è gentile con la sorellina. Non capisco questo errore IMPERDONABILE. Siamo clienti fedeli da 5 anni e questo è il trattamento che riceviamo? Voglio spiegazioni IMMEDIATE e il regalo corretto consegnato entro oggi, altrimenti contatterò tutti i giornali. Non scherzate con me.",
-            created_at=datetime.now()
-        ),
-        Ticket(
-            id="NP-2025-002",
-            category="Regalo Sbagliato",
-            priority="high",
-            subject="Regalo completamente sbagliato per mia figlia",
-            message="Salve, mi chiamo Giulia Bianchi e scrivo per mia figlia Sofia di 8 anni. Sofia aveva chiesto una Barbie Dreamhouse e invece ha ricevuto... un set di attrezzi da meccanico?! Mia figlia è devastata, era il regalo che sognava da mesi. Ho le prove della letterina che abbiamo spedito insieme. Come è possibile un errore del genere? Potete sistemare questa situazione? Sofia non smette di piangere.",
-            created_at=datetime.now()
-        ),
-        Ticket(
-            id="NP-2025-003",
-            category="Mancata Consegna",
-            priority="critical",
-            subject="Babbo Natale NON è passato - Emergenza!",
-            message="Sono Francesco Verdi, padre di due gemelli di 6 anni (Marco e Luca). Stamattina sotto l'albero NON C'ERA NIENTE. I bambini sono traumatizzati, pensano di essere stati cattivi. Abbiamo controllato: camino pulito, biscotti e latte pronti, letterine inviate a Novembre. I nostri figli sono nella lista 'nice', ho verificato io stesso! Come è possibile che ci abbiate SALTATI? Pretendo una risposta e una soluzione OGGI. I miei figli stanno piangendo disperatamente.",
-            created_at=datetime.now()
-        ),
-        Ticket(
-            id="NP-2025-004",
-            category="Naughty Score Contestato",
-            priority="high",
-            subject="Contestazione punteggio 'cattivo' di Pierre",
-            message="Bonjour, sono Isabelle Méchant da Lyon. Ho ricevuto una notifica che mio figlio Pierre ha un 'naughty_score' di 78 e riceverà carbone. Questo è INACCETTABILE! Pierre ha fatto UNA marachella tutto l'anno (ha rotto un vaso per sbaglio!) e voi lo condannate così? I suoi compagni di classe che fanno i bulli hanno ricevuto regali normalmente! Voglio sapere ESATTAMENTE cosa risulta nel vostro database e chi ha deciso questo punteggio assurdo. Attendo risposta urgente.",
-            created_at=datetime.now()
-        ),
-        Ticket(
-            id="NP-2025-005",
-            category="Regalo Danneggiato",
-            priority="medium",
-            subject="LEGO arrivato in mille pezzi - pacco distrutto",
-            message="Salve, sono Andrea Neri. Il regalo per mio figlio Matteo (LEGO Star Wars Ultimate Collector) è arrivato con la scatola completamente DISTRUTTA. Matteo ha 10 anni e colleziona LEGO da quando ne aveva 5, questo era il pezzo forte della sua collezione. Mancano pezzi ovunque, il libretto istruzioni è strappato. 300 euro di regalo rovinato! Le renne hanno usato il pacco come palla da calcio? Voglio un rimborso o una sostituzione.",
-            created_at=datetime.now()
-        ),
-        Ticket(
-            id="NP-2025-006",
-            category="Richiesta Speciale",
-            priority="medium",
-            subject="Bambina malata - per favore aiutateci",
-            message="Gentile Babbo Natale, sono Elena Conti. Mia figlia Aurora di 7 anni è in ospedale da 3 mesi per una malattia seria. Il suo unico desiderio era un unicorno peluche gigante rosa, quello che canta. Il pacco è arrivato ma era VUOTO, solo carta da imballaggio. Aurora ha creduto di essere stata 'dimenticata' da Babbo Natale e questo le ha spezzato il cuore. Per favore, vi prego, potete rimediare? È l'unica cosa che la fa sorridere. Allego foto della letterina che ha scritto dall'ospedale.",
-            created_at=datetime.now()
-        ),
-        Ticket(
-            id="NP-2025-007",
-            category="Doppio Carbone",
-            priority="critical",
-            subject="ENTRAMBI i miei figli hanno ricevuto carbone - ASSURDO",
-            message="INCREDIBILE! Sono Roberto Martini, padre di Emma (9 anni) e Giulio (7 anni). ENTRAMBI i miei figli hanno trovato carbone sotto l'albero. Emma ha voti perfetti a scuola, fa volontariato alla parrocchia! Giulio è il bambino più buono del quartiere, lo dicono tutti! Il vostro sistema è COMPLETAMENTE ROTTO. Voglio parlare con Mrs. Claus personalmente. Ho le pagelle, le lettere delle maestre, tutto quello che serve per dimostrare che i miei figli sono ANGEL. RISPONDETE SUBITO!",
-            created_at=datetime.now()
-        )
-    ]
+async def get_example_tickets(request: Request, offset: int = Query(0, ge=0), limit: int = Query(50, ge=1, le=200)):
+    """Get example + open inbox tickets (paginated, pre-serialized, ETag)"""
+    body, etag = ticket_inbox.page(offset=offset, limit=limit)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if is_not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.post("/api/tickets/prefetch", status_code=202)
+async def prefetch_ticket(ticket: Ticket):
+    """Start collecting retrieval + DB evidence for a ticket the operator is looking at"""
+    if rag_engine is None:
+        raise HTTPException(status_code=503, detail="RAG engine not available")
+    started = rag_engine.prefetch(ticket)
+    return {"status": "started" if started else "cached", "ticket_id": ticket.id}
+
+@app.post("/api/images", response_model=ImageUploadResponse)
+async def upload_image(request: Request, file: UploadFile = File(...)):
+    """Upload a damage photo (multipart). Returns the image_id to use in generate-response"""
+    content_length = request.headers.get("content-length")
+    if content_length and not content_length.isdigit():
+        raise HTTPException(status_code=400, detail="Invalid Content-Length")
+    if content_length and int(content_length) > image_store.max_upload_bytes + 64 * 1024:
+        raise HTTPException(status_code=413, detail="Image too large")
+    try:
+        return await image_store.save_upload(file)
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidImage as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    finally:
+        await file.close()
 
-    return ExampleTicketsResponse(tickets=example_tickets)
+@app.get("/api/images/{image_id}")
+async def get_image(image_id: str):
+    """Serve a stored image (content-addressed, so cacheable forever)"""
+    path = image_store.find(image_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return FileResponse(path, headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+def _store_base64_image(image_base64: str):
+    return image_store.save_bytes(base64.b64decode(image_base64, validate=True))
+
+async def resolve_image_id(request: GenerateResponseRequest) -> Optional[str]:
+    """image_id of the attached photo; legacy base64 payloads are stored once and replaced by their id"""
+    if request.image_id:
+        if not image_store.exists(request.image_id):
+            raise HTTPException(status_code=404, detail="Image not found, upload it again via /api/images")
+        return request.image_id
+    if request.image_base64:
+        try:
+            # base64 + Pillow decoding/downscaling: off the event loop
+            stored = await run_in_threadpool(_store_base64_image, request.image_base64)
+        except (binascii.Error, ValueError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid image: {e}")
+        request.image_base64 = None  # Don't keep the inflated payload around
+        return stored.image_id
+    return None
 
 @app.post("/api/tickets/generate-response", response_model=GenerateResponseResponse)
 async def generate_response(request: GenerateResponseRequest):
@@ -138,13 +328,19 @@ async def generate_response(request: GenerateResponseRequest):
             detail="RAG engine not available. Please try again later."
         )
 
+    image_id = await resolve_image_id(request)
+
     try:
-        # Generate response using Agent
-        ops_response = rag_engine.generate_response(
-            ticket=request.ticket,
-            image_base64=request.image_base64,
-            regeneration_feedback=request.regeneration_feedback
-        )
+        # Wait for a slot (by ticket priority), then run the engine off the event loop.
+        # Degraded drafts (LLM circuit open) are local and fast: they don't queue behind LLM runs
+        slot = contextlib.nullcontext() if rag_engine.breaker.is_open else acquire_slot(request.ticket.priority)
+        async with slot:
+            ops_response = await run_in_threadpool(
+                rag_engine.generate_response,
+                ticket=request.ticket,
+                image_id=image_id,
+                regeneration_feedback=request.regeneration_feedback
+            )
         
         # Handle dict or object
         if isinstance(ops_response, dict):
@@ -167,11 +363,16 @@ async def generate_response(request: GenerateResponseRequest):
                 action_checklist=ops_response.action_checklist,
                 coal_alert=ops_response.coal_alert,
                 tool_calls=ops_response.tool_calls,
-                confidence_score=1.0,
+                confidence_score=0.3 if ops_response.degraded else 1.0,
                 sources=[],
-                reasoning=ops_response.thought_process
+                reasoning=ops_response.thought_process,
+                degraded=ops_response.degraded
             )
 
+    except HTTPException:
+        raise
+    except RateLimitShed as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(max(1, round(e.retry_after)))})
     except Exception as e:
         print(f"Error generating response: {e}")
         raise HTTPException(
@@ -191,18 +392,66 @@ async def generate_response_stream(request: GenerateResponseRequest):
             detail="RAG engine not available"
         )
 
-    async def event_generator():
+    image_id = await resolve_image_id(request)
+    # The run (not the connection) holds the scheduler slot: a dropped client keeps its place.
+    # Degraded drafts (LLM circuit open) skip the queue
+    lease = None if rag_engine.breaker.is_open else acquire_slot(request.ticket.priority)
+
+    async def produce(run: StreamRun):
         try:
+            if lease is not None:
+                if not lease.admitted:
+                    yield {'type': 'queued', 'priority': lease.priority, 'position': lease.position(), 'message': 'In coda, ticket con priorità più alta in lavorazione...'}
+                await lease.wait()
             async for event in rag_engine.generate_response_stream(
                 ticket=request.ticket,
-                image_base64=request.image_base64,
+                image_id=image_id,
                 regeneration_feedback=request.regeneration_feedback
             ):
-                # Format as SSE: "data: {...}\n\n"
-                yield f"data: {json.dumps(event)}\n\n"
-        except Exception as e:
-            print(f"SSE Error: {e}")
-            yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+                yield event
+        finally:
+            if lease is not None:
+                lease.release()
+
+    try:
+        run = stream_runs.start(request.ticket.id, produce)
+    except Exception:
+        if lease is not None:
+            lease.release()
+        raise
+    return sse_response(run, after_id=0)
+
+
+@app.get("/api/tickets/stream/{run_id}")
+async def resume_response_stream(run_id: str, request: Request, last_event_id: Optional[int] = Query(None, ge=0)):
+    """
+    Reconnect to a streamed run: replays the events after Last-Event-ID (header, or
+    ?last_event_id= for fetch clients) and then follows the live run. Never re-runs the pipeline.
+    """
+    run = stream_runs.get(run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="Stream run not found or expired")
+    header = request.headers.get("last-event-id", "")
+    after_id = last_event_id if last_event_id is not None else (int(header) if header.isdigit() else 0)
+    stream_runs.reconnected(run)
+    return sse_response(run, after_id=after_id)
+
+
+@app.get("/api/tickets/stream-runs/stats")
+async def stream_run_stats():
+    """Live/retained streamed runs and reconnect counters"""
+    return stream_runs.stats()
+
+
+def sse_response(run: StreamRun, after_id: int) -> StreamingResponse:
+    """SSE view of a run from `after_id` on: "id: N" + "data: {...}" per event, comments as heartbeat"""
+    async def event_generator():
+        yield format_sse({'type': 'run', 'run_id': run.run_id, 'resumed_from': after_id}, retry_ms=SSE_RETRY_MS)
+        async for event_id, event in run.events(after_id):
+            if event.get('type') == 'heartbeat':
+                yield ": heartbeat\n\n"
+            else:
+                yield format_sse(event, event_id=event_id)
 
     return StreamingResponse(
         event_generator(),
@@ -210,19 +459,20 @@ async def generate_response_stream(request: GenerateResponseRequest):
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
-            "X-Accel-Buffering": "no"
+            "X-Accel-Buffering": "no",
+            "X-Run-Id": run.run_id
         }
     )
 
 @app.get("/")
-async def root():
+async def root(request: Request):
     """Redirect to frontend"""
-    return FileResponse(str(frontend_dir / "index.html"))
+    return index_page.response(request)
 
 @app.get("/index.html")
-async def frontend():
+async def frontend(request: Request):
     """Serve frontend"""
-    return FileResponse(str(frontend_dir / "index.html"))
+    return index_page.response(request)
 
 @app.get("/api")
 async def api_root():
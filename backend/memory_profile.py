@@ -0,0 +1,243 @@
+"""
+Opt-in memory accounting for a long-running server (MEMORY_PROFILING=off|rss|tracemalloc).
+
+- rss: a background thread samples the process RSS every `sample_seconds` (trend over
+  the last hours) and every generate run records its RSS delta.
+- tracemalloc: on top of that, Python allocations are traced (`frames` deep): runs also
+  record their traced-memory delta, and top_sites() compares a snapshot with the
+  baseline (taken at start or with reset_baseline()) to show where memory grew.
+
+Per-run deltas are process-wide: with concurrent runs they include each other's
+allocations, so read them as averages per path, not as exact per-request costs.
+tracemalloc slows allocations down noticeably: use it to investigate, not all season.
+"""
+import gc
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, List, Optional, Tuple
+
+MODES = ("off", "rss", "tracemalloc")
+
+# Allocation sites of the profiler itself and of the import machinery
+IGNORED_FILES = ("<frozen importlib._bootstrap>", "<frozen importlib._bootstrap_external>", "<unknown>",
+                 tracemalloc.__file__, __file__)
+
+
+def rss_bytes() -> Optional[int]:
+    """Current resident set size (Linux /proc; None elsewhere)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # bytes on macOS, KiB on Linux
+
+
+def linear_slope(points: List[Tuple[float, float]]) -> float:
+    """Least-squares slope of (x, y) points (0 with fewer than two distinct x)"""
+    if len(points) < 2:
+        return 0.0
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    var = sum((x - mean_x) ** 2 for x, _ in points)
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var if var else 0.0
+
+
+def _mb(value: Optional[float]) -> Optional[float]:
+    return round(value / (1024 * 1024), 2) if value is not None else None
+
+
+class MemoryProfiler:
+    def __init__(self, mode: str = "off", sample_seconds: float = 30.0, max_samples: int = 2880,
+                 frames: int = 10, history: int = 200):
+        if mode not in MODES:
+            raise ValueError(f"MEMORY_PROFILING must be one of {MODES}")
+        self.mode = mode
+        self.sample_seconds = sample_seconds
+        self.frames = frames
+        self._lock = threading.Lock()
+        self._samples: Deque[Tuple[float, Optional[int], Optional[int]]] = deque(maxlen=max_samples)  # (at, rss, traced)
+        self._runs: Deque[dict] = deque(maxlen=history)
+        self._by_path: Dict[str, dict] = {}
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._baseline_at: Optional[float] = None
+        if self.tracing and not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        if self.tracing:
+            self.reset_baseline()
+        if self.enabled:
+            threading.Thread(target=self._run_sampler, name="memory-sampler", daemon=True).start()
+
+    @classmethod
+    def from_env(cls) -> "MemoryProfiler":
+        return cls(
+            mode=os.getenv("MEMORY_PROFILING", "off").lower(),
+            sample_seconds=float(os.getenv("MEMORY_SAMPLE_SECONDS", "30")),
+            max_samples=int(os.getenv("MEMORY_MAX_SAMPLES", "2880")),  # 24h at 30s
+            frames=int(os.getenv("MEMORY_TRACEMALLOC_FRAMES", "10")),
+            history=int(os.getenv("MEMORY_RUN_HISTORY", "200")),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    @property
+    def tracing(self) -> bool:
+        return self.mode == "tracemalloc"
+
+    def _traced(self) -> Optional[int]:
+        return tracemalloc.get_traced_memory()[0] if self.tracing else None
+
+    # ====== SAMPLING ======
+
+    def sample(self) -> Tuple[float, Optional[int], Optional[int]]:
+        point = (time.time(), rss_bytes(), self._traced())
+        with self._lock:
+            self._samples.append(point)
+        return point
+
+    def _run_sampler(self):
+        while True:
+            self.sample()
+            time.sleep(self.sample_seconds)
+
+    # ====== PER-RUN DELTAS ======
+
+    def start(self, run) -> "RunMemory":
+        """Start measuring a generate run: call stop() on the result when the run ends"""
+        return RunMemory(self, run)
+
+    @contextmanager
+    def track(self, run):
+        measure = self.start(run)
+        try:
+            yield
+        finally:
+            measure.stop()
+
+    def _record(self, entry: dict):
+        with self._lock:
+            self._runs.append(entry)
+            key = f"{entry['path']}{'@stream' if entry['stream'] else ''}"
+            agg = self._by_path.setdefault(key, {"runs": 0, "rss_delta": 0, "traced_delta": 0, "max_rss_delta": 0})
+            agg["runs"] += 1
+            agg["rss_delta"] += entry["rss_delta"] or 0
+            agg["traced_delta"] += entry["traced_delta"] or 0
+            agg["max_rss_delta"] = max(agg["max_rss_delta"], entry["rss_delta"] or 0)
+
+    # ====== ALLOCATION SITES ======
+
+    def reset_baseline(self):
+        """New reference snapshot for top_sites() (e.g. once warm, or before a load test)"""
+        if not self.tracing:
+            return
+        gc.collect()
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, f) for f in IGNORED_FILES])
+        with self._lock:
+            self._baseline, self._baseline_at = snapshot, time.time()
+
+    def top_sites(self, limit: int = 20, group_by: str = "lineno") -> List[dict]:
+        """Allocation sites that grew the most since the baseline (group_by: lineno | filename | traceback)"""
+        if not self.tracing:
+            return []
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, f) for f in IGNORED_FILES])
+        with self._lock:
+            baseline = self._baseline
+        stats = snapshot.compare_to(baseline, group_by) if baseline is not None else snapshot.statistics(group_by)
+        sites = []
+        for stat in stats[:limit]:
+            frames = stat.traceback.format(limit=self.frames if group_by == "traceback" else 1)
+            sites.append({
+                "site": frames[-1].strip() if group_by != "traceback" else [line.strip() for line in frames],
+                "size_mb": _mb(stat.size),
+                "size_diff_mb": _mb(getattr(stat, "size_diff", None)),
+                "count": stat.count,
+                "count_diff": getattr(stat, "count_diff", None),
+            })
+        return sites
+
+    # ====== REPORT ======
+
+    def trend(self) -> dict:
+        """RSS growth over the sampled window, in MB per hour (least squares)"""
+        with self._lock:
+            points = [(at, rss) for at, rss, _ in self._samples if rss is not None]
+        if len(points) < 2:
+            return {"samples": len(points), "rss_mb_per_hour": None}
+        slope = linear_slope(points)
+        return {
+            "samples": len(points),
+            "window_hours": round((points[-1][0] - points[0][0]) / 3600, 2),
+            "rss_first_mb": _mb(points[0][1]),
+            "rss_last_mb": _mb(points[-1][1]),
+            "rss_mb_per_hour": round(slope * 3600 / (1024 * 1024), 3),
+        }
+
+    def describe(self, top: int = 0, group_by: str = "lineno") -> dict:
+        traced, traced_peak = tracemalloc.get_traced_memory() if self.tracing else (None, None)
+        with self._lock:
+            by_path = {
+                key: {
+                    "runs": agg["runs"],
+                    "avg_rss_delta_kb": round(agg["rss_delta"] / agg["runs"] / 1024, 1),
+                    "max_rss_delta_kb": round(agg["max_rss_delta"] / 1024, 1),
+                    "avg_traced_delta_kb": round(agg["traced_delta"] / agg["runs"] / 1024, 1) if self.tracing else None,
+                }
+                for key, agg in self._by_path.items()
+            }
+            recent = list(self._runs)[-20:]
+        report = {
+            "mode": self.mode,
+            "rss_mb": _mb(rss_bytes()),
+            "peak_rss_mb": _mb(peak_rss_bytes()),
+            "traced_mb": _mb(traced),
+            "traced_peak_mb": _mb(traced_peak),
+            "gc": {"counts": gc.get_count(), "garbage": len(gc.garbage)},
+            "threads": threading.active_count(),
+            "trend": self.trend(),
+            "runs_by_path": by_path,
+            "recent_runs": recent,
+        }
+        if top and self.tracing:
+            report["baseline_age_seconds"] = round(time.time() - self._baseline_at, 1) if self._baseline_at else None
+            report["top_sites"] = self.top_sites(top, group_by)
+        return report
+
+
+class RunMemory:
+    """RSS (and traced) delta of one generate run, aggregated per path (agent, prefetched, degraded...)"""
+
+    def __init__(self, profiler: MemoryProfiler, run):
+        self.profiler = profiler
+        self.run = run
+        self.enabled = profiler.enabled
+        if self.enabled:
+            self.rss, self.traced, self.started = rss_bytes(), profiler._traced(), time.perf_counter()
+
+    def stop(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        run, rss, traced = self.run, rss_bytes(), self.profiler._traced()
+        self.profiler._record({
+            "run_id": run.run_id,
+            "ticket_id": run.ticket.id if run.ticket else None,
+            "path": run.path,
+            "stream": run.stream,
+            "outcome": run.outcome,
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "rss_delta": rss - self.rss if None not in (rss, self.rss) else None,
+            "traced_delta": traced - self.traced if traced is not None else None,
+            "tool_calls": len(run.tool_calls),
+        })
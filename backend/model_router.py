@@ -0,0 +1,191 @@
+"""
+Model routing per agent role and ticket class, with per-route latency/cost metrics.
+
+Roles: master, sql_expert, history_expert, parser (JSON extraction of the master's
+answer), synthesis (single-call answer over prefetched evidence).
+
+Routes are configured with MODEL_ROUTES as comma separated `role[@class]=model` rules,
+where class is a Ticket.priority or Ticket.category. Without rules every role uses
+DEFAULT_MODEL; e.g. a small model for tool-driven SQL and JSON extraction and the strong
+one only where the customer-facing answer of a critical ticket is written:
+
+    MODEL_ROUTES=sql_expert=gpt-4.1-nano,parser=gpt-4.1-nano,master@critical=gpt-4.1,synthesis@critical=gpt-4.1
+
+The most specific rule wins: role@priority, role@category, role, *@priority,
+*@category, then DEFAULT_MODEL.
+"""
+import json
+import os
+import threading
+from collections import deque
+from typing import Callable, Dict, Optional, Tuple
+
+from pydantic import BaseModel
+
+from models import Ticket
+
+ROLES = ("master", "sql_expert", "history_expert", "parser", "synthesis")
+DEFAULT_MODEL = "gpt-4.1-mini"
+
+
+class ModelPrice(BaseModel):
+    """USD per 1M tokens"""
+    input: float
+    cached_input: float
+    output: float
+
+
+# Override/extend with MODEL_PRICES='{"model": {"input": ..., "cached_input": ..., "output": ...}}'
+DEFAULT_PRICES = {
+    "gpt-4.1": ModelPrice(input=2.00, cached_input=0.50, output=8.00),
+    "gpt-4.1-mini": ModelPrice(input=0.40, cached_input=0.10, output=1.60),
+    "gpt-4.1-nano": ModelPrice(input=0.10, cached_input=0.025, output=0.40),
+    "gpt-4o": ModelPrice(input=2.50, cached_input=1.25, output=10.00),
+    "gpt-4o-mini": ModelPrice(input=0.15, cached_input=0.075, output=0.60),
+}
+
+
+def parse_routes(value: str) -> Dict[str, str]:
+    """'sql_expert=gpt-4.1-nano,master@critical=gpt-4.1' -> {'sql_expert': ..., 'master@critical': ...}"""
+    routes = {}
+    for part in value.split(","):
+        key, _, model = part.partition("=")
+        if key.strip() and model.strip():
+            routes[key.strip()] = model.strip()
+    return routes
+
+
+def _percentile(samples, q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class RouteMetrics:
+    def __init__(self, model: str, sample_window: int = 500):
+        self.model = model
+        self.calls = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+        self.latencies: deque = deque(maxlen=sample_window)
+
+    def to_dict(self) -> dict:
+        latencies = list(self.latencies)
+        return {
+            "model": self.model,
+            "calls": self.calls,
+            "errors": self.errors,
+            "latency_p50": round(_percentile(latencies, 0.50), 3),
+            "latency_p95": round(_percentile(latencies, 0.95), 3),
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cache_hit_ratio": round(self.cached_tokens / self.prompt_tokens, 4) if self.prompt_tokens else 0.0,
+            "completion_tokens": self.completion_tokens,
+            "cost_usd": round(self.cost_usd, 6),
+            "cost_per_call_usd": round(self.cost_usd / self.calls, 6) if self.calls else 0.0,
+        }
+
+
+class ModelRouter:
+    def __init__(
+        self,
+        client_factory: Callable[[str, str], object],
+        routes: Optional[Dict[str, str]] = None,
+        default_model: str = DEFAULT_MODEL,
+        prices: Optional[Dict[str, ModelPrice]] = None,
+    ):
+        self.client_factory = client_factory  # (model, route label) -> Client
+        self.routes = routes or {}
+        self.default_model = default_model
+        self.prices = {**DEFAULT_PRICES, **(prices or {})}
+        self._clients: Dict[Tuple[str, str], object] = {}
+        self._metrics: Dict[str, RouteMetrics] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, client_factory: Callable[[str, str], object]) -> "ModelRouter":
+        prices = {
+            model: ModelPrice(**price)
+            for model, price in json.loads(os.getenv("MODEL_PRICES", "{}")).items()
+        }
+        return cls(
+            client_factory=client_factory,
+            routes=parse_routes(os.getenv("MODEL_ROUTES", "")),
+            default_model=os.getenv("DEFAULT_MODEL", DEFAULT_MODEL),
+            prices=prices,
+        )
+
+    # ====== ROUTING ======
+
+    def resolve(self, role: str, ticket: Optional[Ticket] = None) -> Tuple[str, str]:
+        """(model, route label) for an agent role handling `ticket`"""
+        classes = [ticket.priority, ticket.category] if ticket is not None else []
+        for key in [f"{role}@{c}" for c in classes] + [role] + [f"*@{c}" for c in classes]:
+            if key in self.routes:
+                return self.routes[key], key
+        return self.default_model, f"{role} (default)"
+
+    def model_for(self, role: str, ticket: Optional[Ticket] = None) -> str:
+        return self.resolve(role, ticket)[0]
+
+    def client_for(self, role: str, ticket: Optional[Ticket] = None):
+        """Client bound to the routed model; metrics are kept per role + ticket priority"""
+        model, _ = self.resolve(role, ticket)
+        label = f"{role}@{ticket.priority}" if ticket is not None else role
+        key = (label, model)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self.client_factory(model, label)
+                self._clients[key] = client
+        return client
+
+    # ====== METRICS ======
+
+    def cost(self, model: str, prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> float:
+        price = self.prices.get(model)
+        if price is None:
+            return 0.0
+        uncached = max(0, prompt_tokens - cached_tokens)
+        return (uncached * price.input + cached_tokens * price.cached_input + completion_tokens * price.output) / 1_000_000
+
+    def record(self, label: str, model: str, latency_seconds: float, response=None, error: bool = False):
+        """Meter one LLM call (called by RoutedOpenAIClient)"""
+        prompt = getattr(response, "prompt_tokens_used", 0) or 0
+        cached = getattr(response, "cached_tokens_used", 0) or 0
+        completion = getattr(response, "completion_tokens_used", 0) or 0
+        with self._lock:
+            metrics = self._metrics.get(f"{label}:{model}")
+            if metrics is None:
+                metrics = self._metrics[f"{label}:{model}"] = RouteMetrics(model)
+            metrics.calls += 1
+            metrics.errors += int(error)
+            metrics.latencies.append(latency_seconds)
+            metrics.prompt_tokens += prompt
+            metrics.cached_tokens += cached
+            metrics.completion_tokens += completion
+            metrics.cost_usd += self.cost(model, prompt, cached, completion)
+
+    def stats(self) -> dict:
+        with self._lock:
+            routes = {key: m.to_dict() for key, m in sorted(self._metrics.items())}
+        prompt = sum(r["prompt_tokens"] for r in routes.values())
+        cached = sum(r["cached_tokens"] for r in routes.values())
+        saved = sum(
+            self.cost(r["model"], r["cached_tokens"], 0, 0) - self.cost(r["model"], r["cached_tokens"], r["cached_tokens"], 0)
+            for r in routes.values()
+        )
+        return {
+            "default_model": self.default_model,
+            "rules": self.routes,
+            "routes": routes,
+            "prompt_tokens": prompt,
+            "cached_tokens": cached,
+            "cache_hit_ratio": round(cached / prompt, 4) if prompt else 0.0,
+            "cache_savings_usd": round(saved, 6),
+            "total_cost_usd": round(sum(r["cost_usd"] for r in routes.values()), 6),
+        }
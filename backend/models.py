@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from pydantic.json_schema import SkipJsonSchema
 from typing import List, Optional
 from datetime import datetime
 
@@ -38,7 +39,8 @@ class ToolCall(BaseModel):
 
 class GenerateResponseRequest(BaseModel):
     ticket: Ticket
-    image_base64: Optional[str] = None
+    image_id: Optional[str] = None  # Hash returned by POST /api/images
+    image_base64: Optional[str] = None  # Legacy: prefer uploading to /api/images
     tone: Optional[str] = "professional"
     regeneration_feedback: Optional[str] = None  # Feedback per rigenerazione
 
@@ -50,6 +52,8 @@ class OpsResponse(BaseModel):
     coal_alert: bool
     final_response: str
     tool_calls: List[ToolCall] = []
+    # Set by the degraded (LLM-free) pipeline; kept out of the JSON schema the LLM sees
+    degraded: SkipJsonSchema[bool] = False
 
 class GenerateResponseResponse(BaseModel):
     # Mapping fields from OpsResponse to frontend response
@@ -62,10 +66,22 @@ class GenerateResponseResponse(BaseModel):
     confidence_score: float = 1.0 # Default High for Agent
     sources: List[Source] = []
     reasoning: str = "Agentic Reasoning"
+    degraded: bool = False  # Draft built without LLM (provider slow/unavailable)
 
 
+class ImageUploadResponse(BaseModel):
+    image_id: str  # SHA-256 of the stored (normalized) image
+    content_type: str
+    size_bytes: int
+    width: Optional[int] = None
+    height: Optional[int] = None
+
 class ExampleTicketsResponse(BaseModel):
     tickets: List[Ticket]
+    total: int = 0
+    offset: int = 0
+    limit: int = 50
+    next_offset: Optional[int] = None  # None = last page
 
 class HealthResponse(BaseModel):
     status: str
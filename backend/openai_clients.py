@@ -0,0 +1,260 @@
+"""
+OpenAI client/embedder extensions used by the RAG engine.
+"""
+import asyncio
+import hashlib
+import time
+from array import array
+from typing import Callable, List, Optional
+
+import httpx
+import openai
+from datapizza.clients.openai import OpenAIClient
+from datapizza.embedders.openai import OpenAIEmbedder
+
+from cassettes import AsyncCassetteTransport, CassetteDeck, CassetteTransport
+from http_pool import SharedHttpPool
+from shared_cache import SharedCache
+from rate_limiter import AsyncGovernedTransport, GovernedTransport, RateLimitGovernor
+
+
+def governed_http_clients(
+    governor: Optional[RateLimitGovernor],
+    cassettes: Optional[CassetteDeck] = None,
+    http_pool: Optional[SharedHttpPool] = None,
+    kind: str = "llm",
+):
+    """(sync, async) httpx clients whose transports go through the rate-limit governor.
+
+    With a shared pool the connections (and keep-alive, HTTP/2, DNS cache) come from it,
+    with the timeouts of `kind` ("llm" or "embeddings"). With an active cassette deck
+    (record/replay) the cassette transport wraps the governed one, so replayed calls never
+    reach the governor or the network.
+    """
+    taped = cassettes is not None and cassettes.settings.mode != "off"
+    if governor is None and not taped and http_pool is None:
+        return None, None
+    if http_pool is not None:
+        # Hedged copies (embeddings) reserve their own budget from the same governor
+        transport, async_transport = http_pool.transport(kind, governor), http_pool.async_transport(kind, governor)
+    else:
+        transport, async_transport = httpx.HTTPTransport(), httpx.AsyncHTTPTransport()
+    if governor is not None:
+        transport = GovernedTransport(governor, transport)
+        async_transport = AsyncGovernedTransport(governor, async_transport)
+    if taped:
+        transport = CassetteTransport(transport, cassettes)
+        async_transport = AsyncCassetteTransport(async_transport, cassettes)
+    options = {"timeout": http_pool.timeout(kind)} if http_pool is not None else {}
+    return httpx.Client(transport=transport, **options), httpx.AsyncClient(transport=async_transport, **options)
+
+
+class GovernedOpenAIClient(OpenAIClient):
+    """OpenAIClient whose calls (sync and async) are paced by a RateLimitGovernor.
+
+    The governor's transport owns retries (jittered, Retry-After aware), so the SDK's own
+    retry loop is disabled to avoid retrying twice.
+    """
+
+    def __init__(
+        self,
+        *args,
+        governor: Optional[RateLimitGovernor] = None,
+        http_clients=None,
+        cassettes: Optional[CassetteDeck] = None,
+        http_pool: Optional[SharedHttpPool] = None,
+        **kwargs,
+    ):
+        self.governor = governor
+        # Routed clients share the (sync, async) httpx clients of the engine's main client
+        self._http_client, self._async_http_client = http_clients or governed_http_clients(governor, cassettes, http_pool, "llm")
+        if governor is not None:
+            kwargs.setdefault("max_retries", 0)
+        if http_pool is not None:
+            # datapizza passes timeout=None (no timeout at all) to the SDK unless one is given
+            kwargs.setdefault("timeout", http_pool.timeout("llm"))
+        if self._http_client is not None:
+            kwargs.setdefault("http_client", self._http_client)
+        super().__init__(*args, **kwargs)
+
+    def _set_a_client(self):
+        if not self.a_client:
+            self.a_client = openai.AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                organization=self.organization,
+                project=self.project,
+                webhook_secret=self.webhook_secret,
+                websocket_base_url=self.websocket_base_url,
+                timeout=self.timeout,
+                max_retries=self.max_retries,
+                default_headers=self.default_headers,
+                default_query=self.default_query,
+                http_client=self._async_http_client,
+            )
+
+
+class RoutedOpenAIClient(GovernedOpenAIClient):
+    """Client for one model route: every call reports latency and token usage to `meter`.
+
+    meter(route, model, latency_seconds, response=None, error=False) - see ModelRouter.record
+
+    Requests carry a per-role `prompt_cache_key`: calls of the same role share the same static
+    system prompt, so routing them together keeps OpenAI's prefix cache warm across tickets.
+    """
+
+    def __init__(self, *args, route: str, meter: Callable, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.route = route
+        self.meter = meter
+        self.prompt_cache_key = f"northpole-{route.split('@')[0]}"
+
+    def _done(self, started: float, response):
+        latency = time.perf_counter() - started
+        self.meter(self.route, self.model_name, latency, response)
+        prompt = getattr(response, "prompt_tokens_used", 0) or 0
+        cached = getattr(response, "cached_tokens_used", 0) or 0
+        print(f"💾 [{self.route}] {self.model_name}: {cached}/{prompt} prompt tokens from cache, {latency:.2f}s")
+
+    def _metered(self, call, *args, **kwargs):
+        kwargs.setdefault("prompt_cache_key", self.prompt_cache_key)
+        started = time.perf_counter()
+        try:
+            response = call(*args, **kwargs)
+        except Exception:
+            self.meter(self.route, self.model_name, time.perf_counter() - started, error=True)
+            raise
+        self._done(started, response)
+        return response
+
+    async def _a_metered(self, call, *args, **kwargs):
+        kwargs.setdefault("prompt_cache_key", self.prompt_cache_key)
+        started = time.perf_counter()
+        try:
+            response = await call(*args, **kwargs)
+        except Exception:
+            self.meter(self.route, self.model_name, time.perf_counter() - started, error=True)
+            raise
+        self._done(started, response)
+        return response
+
+    def _invoke(self, *args, **kwargs):
+        return self._metered(super()._invoke, *args, **kwargs)
+
+    async def _a_invoke(self, *args, **kwargs):
+        return await self._a_metered(super()._a_invoke, *args, **kwargs)
+
+    def _structured_response(self, *args, **kwargs):
+        return self._metered(super()._structured_response, *args, **kwargs)
+
+    async def _a_structured_response(self, *args, **kwargs):
+        return await self._a_metered(super()._a_structured_response, *args, **kwargs)
+
+
+class NorthPoleEmbedder(OpenAIEmbedder):
+    """OpenAIEmbedder that can request reduced-dimension embeddings.
+
+    text-embedding-3-* models accept a `dimensions` parameter: the returned vector
+    is a shortened (and re-normalized) version of the full one, which lets us trade
+    a little recall for a much smaller vector index.
+
+    With a cache, vectors are looked up by (model, dimensions, text) first and only the
+    missing texts are sent to the API; with a shared cache a text embedded by one worker
+    is a hit for all of them.
+    """
+
+    def __init__(
+        self,
+        *,
+        api_key: str,
+        model_name: Optional[str] = None,
+        base_url: Optional[str] = None,
+        dimensions: Optional[int] = None,
+        governor: Optional[RateLimitGovernor] = None,
+        cassettes: Optional[CassetteDeck] = None,
+        http_pool: Optional[SharedHttpPool] = None,
+        cache: Optional[SharedCache] = None,
+        cache_ttl_seconds: Optional[float] = None,
+    ):
+        super().__init__(api_key=api_key, model_name=model_name, base_url=base_url)
+        self.dimensions = dimensions
+        self.governor = governor
+        self.cache = cache
+        self.cache_ttl_seconds = cache_ttl_seconds
+        # Same connections as the LLM clients, shorter timeouts and (optionally) hedged requests
+        self._http_client, self._async_http_client = governed_http_clients(governor, cassettes, http_pool, "embeddings")
+
+    def _set_client(self):
+        if not self.client:
+            self.client = openai.OpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                max_retries=0 if self.governor else openai.DEFAULT_MAX_RETRIES,
+                http_client=self._http_client,
+            )
+
+    def _set_a_client(self):
+        if not self.a_client:
+            self.a_client = openai.AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                max_retries=0 if self.governor else openai.DEFAULT_MAX_RETRIES,
+                http_client=self._async_http_client,
+            )
+
+    def _create_kwargs(self, model_name: Optional[str]) -> dict:
+        model = model_name or self.model_name
+        if not model:
+            raise ValueError("Model name is required.")
+        kwargs = {"model": model}
+        if self.dimensions:
+            kwargs["dimensions"] = self.dimensions
+        return kwargs
+
+    # ====== EMBEDDING CACHE ======
+
+    def _cache_keys(self, texts: List[str], kwargs: dict) -> List[str]:
+        prefix = f"{kwargs['model']}:{kwargs.get('dimensions') or ''}:"
+        return [hashlib.sha256((prefix + text).encode("utf-8")).hexdigest() for text in texts]
+
+    def _cached(self, keys: List[str]) -> dict:
+        if self.cache is None:
+            return {}
+        # Stored as float64: a cached vector is bit-identical to the one the API returned
+        return {key: array("d", value).tolist() for key, value in self.cache.get_many("embeddings", keys).items()}
+
+    def _store(self, keys: List[str], vectors: List[List[float]]):
+        if self.cache is None:
+            return
+        for key, vector in zip(keys, vectors):
+            self.cache.set("embeddings", key, array("d", vector).tobytes(), self.cache_ttl_seconds)
+
+    def embed(self, text, model_name: Optional[str] = None):
+        texts = [text] if isinstance(text, str) else text
+        kwargs = self._create_kwargs(model_name)
+        keys = self._cache_keys(texts, kwargs)
+        found = self._cached(keys)
+        missing = [i for i, key in enumerate(keys) if key not in found]
+        if missing:
+            response = self._get_client().embeddings.create(input=[texts[i] for i in missing], **kwargs)
+            vectors = [embedding.embedding for embedding in response.data]
+            self._store([keys[i] for i in missing], vectors)
+            found.update(zip((keys[i] for i in missing), vectors))
+        embeddings = [found[key] for key in keys]
+        return embeddings[0] if isinstance(text, str) else embeddings
+
+    async def a_embed(self, text, model_name: Optional[str] = None):
+        texts = [text] if isinstance(text, str) else text
+        kwargs = self._create_kwargs(model_name)
+        keys = self._cache_keys(texts, kwargs)
+        # SQLite lookups/writes (busy timeout, periodic eviction) stay off the event loop
+        found = await asyncio.to_thread(self._cached, keys) if self.cache is not None else {}
+        missing = [i for i, key in enumerate(keys) if key not in found]
+        if missing:
+            response = await self._get_a_client().embeddings.create(input=[texts[i] for i in missing], **kwargs)
+            vectors = [embedding.embedding for embedding in response.data]
+            if self.cache is not None:
+                await asyncio.to_thread(self._store, [keys[i] for i in missing], vectors)
+            found.update(zip((keys[i] for i in missing), vectors))
+        embeddings = [found[key] for key in keys]
+        return embeddings[0] if isinstance(text, str) else embeddings
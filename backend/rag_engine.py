@@ -3,73 +3,386 @@ RAG Engine con Multi-Agent Pattern (Best Practices datapizza-ai)
 """
 import os
 import json
-from typing import Optional, List
+import asyncio
+import hashlib
+import time
+import uuid
+import contextvars
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Optional, List
 
 
 
 from datapizza.agents import Agent
-from datapizza.tools import tool
+from datapizza.tools import Tool, tool
 from datapizza.tracing import ContextTracing
-from datapizza.clients.openai import OpenAIClient
-from datapizza.embedders.openai import OpenAIEmbedder
 from datapizza.vectorstores.qdrant import QdrantVectorstore
-from datapizza.core.vectorstore import VectorConfig
 from datapizza.type import Chunk, DenseEmbedding
 from datapizza.tools.SQLDatabase import SQLDatabase
+from qdrant_client import models as qmodels
+from sqlalchemy import inspect as sql_inspect, text as sql_text
 from models import Ticket, OpsResponse, ToolCall
+from openai_clients import GovernedOpenAIClient, RoutedOpenAIClient, NorthPoleEmbedder
+from http_pool import SharedHttpPool
+from model_router import ModelRouter
+from rate_limiter import RateLimitGovernor, RateLimitShed, is_shed_error, retry_after_seconds
+from vector_settings import CollectionSettings, EMBEDDING_MODEL, EMBEDDING_MAX_DIMENSIONS
+from collection_versions import CollectionVersions, alias_of
+from evidence_cache import EvidenceCache, TicketEvidence, ticket_key
+from shared_cache import SharedCache
+from cassettes import CassetteDeck, bind
+from run_ledger import LedgerLLMCall, LedgerToolCall, RunLedger, RunRecord
+from entity_extraction import EntityExtractor, canonical_queries, format_query
+from child_dossier import ChildDossier, DOSSIER_BY_IDS_SQL, dossier_query
+from startup import timed_checks
+from circuit_breaker import CircuitBreaker
+from degraded_mode import PastTicketIndex, build_degraded_response
+from agent_controller import AgentController, StepBudgets
+from memory_profile import MemoryProfiler
 
 # ====== DATAPIZZA LOGGING BEST PRACTICES ======
 os.environ.setdefault("DATAPIZZA_LOG_LEVEL", "INFO")
 os.environ.setdefault("DATAPIZZA_AGENT_LOG_LEVEL", "DEBUG")  # Debug for agents
 os.environ.setdefault("DATAPIZZA_TRACE_CLIENT_IO", "TRUE")  # Log client I/O
 
+# ====== PAYLOAD INDEXES (filtered search on past tickets) ======
+# Campi del payload indicizzati in Qdrant: permettono di restringere la ricerca
+# ANN alla sola partizione rilevante (categoria, priorità, esito, data...)
+TICKET_PAYLOAD_INDEXES = {
+    "category": qmodels.PayloadSchemaType.KEYWORD,
+    "priority": qmodels.PayloadSchemaType.KEYWORD,
+    "resolution": qmodels.PayloadSchemaType.KEYWORD,
+    "satisfaction": qmodels.PayloadSchemaType.INTEGER,
+    "resolved_at": qmodels.PayloadSchemaType.DATETIME,
+}
+
+# Note prepended to past tickets found only after dropping the payload filters
+FILTER_FALLBACK_NOTE = "(Nessun ticket con i filtri richiesti - risultati senza filtri)\n"
+
+# ====== SPECULATIVE PREFETCH ======
+PREFETCH_TTL_SECONDS = float(os.getenv("PREFETCH_TTL_SECONDS", "120"))
+PREFETCH_WAIT_SECONDS = float(os.getenv("PREFETCH_WAIT_SECONDS", "10"))
+EMBEDDING_CACHE_TTL_SECONDS = float(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", "86400"))
+
+# ====== DEGRADED MODE (see degraded_mode.py / circuit_breaker.py) ======
+PAST_TICKETS_PATH = os.getenv(
+    "PAST_TICKETS_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "past_tickets.json")
+)
+
+# ====== STARTUP CHECKS ======
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "30"))
+READINESS_TIMEOUT_SECONDS = float(os.getenv("READINESS_TIMEOUT_SECONDS", "3"))
+
+
+# ====== TASK INSTRUCTIONS (static head of the user message, see _build_task_input) ======
+AGENT_INSTRUCTIONS = """ISTRUZIONI:
+1. CHIAMA sql_expert per cercare dati rilevanti nel database
+2. CHIAMA history_expert per consultare manuali E ticket passati
+3. Sintetizza tutto in una risposta JSON"""
+
+DB_FACTS_INSTRUCTIONS = """ISTRUZIONI:
+1. NON chiamare sql_expert: i dati del database sono già nella sezione DATI DATABASE qui sotto
+2. CHIAMA history_expert per consultare manuali E ticket passati
+3. Sintetizza tutto in una risposta JSON"""
+
+SYNTHESIS_INSTRUCTIONS = """ISTRUZIONI:
+Sintetizza le evidenze raccolte qui sotto in una risposta JSON"""
+
+
+_active_run: contextvars.ContextVar[Optional["RunContext"]] = contextvars.ContextVar("run", default=None)
+# Runs still referenced somewhere (memory accounting: should drop back to the in-flight ones)
+_live_runs: "weakref.WeakSet[RunContext]" = weakref.WeakSet()
+
+
+class RunContext:
+    """State of one generate request: ticket, tool calls trace, (when streaming) the SSE queue
+    and the timings/usage that end up in the run ledger"""
+
+    def __init__(self, ticket: Optional[Ticket] = None, event_queue=None, stream: bool = False):
+        self.ticket = ticket
+        self.tool_calls: List[ToolCall] = []
+        self.event_queue = event_queue
+        # Run ledger
+        self.run_id = uuid.uuid4().hex
+        self.stream = stream
+        self.path = "agent"
+        self.outcome = "success"
+        self.error: Optional[str] = None
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.ledger_tools: List[LedgerToolCall] = []
+        self.llm_calls: List[LedgerLLMCall] = []
+        self._tool_started: Dict[str, List[float]] = {}
+        _live_runs.add(self)
+
+    @staticmethod
+    def current() -> Optional["RunContext"]:
+        return _active_run.get()
+
+    @contextmanager
+    def activate(self):
+        """Make this the run that LLM calls made by the current thread are charged to"""
+        token = _active_run.set(self)
+        try:
+            yield self
+        finally:
+            _active_run.reset(token)
+
+    def push(self, event: dict):
+        """Push event to streaming queue if available"""
+        print(f"📤 [PUSH_EVENT] {event.get('type', 'unknown')} - {event.get('tool_name', 'N/A')}")
+        self._time_tool(event)
+        if self.event_queue is not None:
+            self.event_queue.put(event)
+
+    def _time_tool(self, event: dict):
+        name = event.get("tool_name")
+        if event.get("type") == "tool_start":
+            self._tool_started.setdefault(name, []).append(time.perf_counter())
+        elif event.get("type") == "tool_complete":
+            started = self._tool_started.get(name)
+            self.ledger_tools.append(LedgerToolCall(
+                tool_name=name,
+                tool_input=str(event.get("tool_input", "")),
+                status=event.get("status", "success"),
+                duration_ms=(time.perf_counter() - started.pop()) * 1000 if started else None,
+                cached=bool(event.get("cached")),
+            ))
+
+    def record_llm_call(self, route: str, model: str, latency_seconds: float, response=None, error: bool = False):
+        self.llm_calls.append(LedgerLLMCall(
+            route=route,
+            model=model,
+            latency_ms=round(latency_seconds * 1000, 2),
+            prompt_tokens=getattr(response, "prompt_tokens_used", 0) or 0,
+            completion_tokens=getattr(response, "completion_tokens_used", 0) or 0,
+            cached_tokens=getattr(response, "cached_tokens_used", 0) or 0,
+            error=error,
+        ))
+
+    def fail(self, error: Exception):
+        self.outcome = "shed" if isinstance(error, RateLimitShed) or is_shed_error(error) else "error"
+        self.error = str(error)[:500]
+
+    def to_record(self) -> RunRecord:
+        ticket = self.ticket
+        return RunRecord(
+            run_id=self.run_id,
+            ticket_id=ticket.id if ticket else "",
+            ticket_hash=ticket_key(ticket) if ticket else "",
+            priority=ticket.priority if ticket else None,
+            category=ticket.category if ticket else None,
+            path=self.path,
+            stream=self.stream,
+            outcome=self.outcome,
+            error=self.error,
+            started_at=self.started_at,
+            duration_ms=(time.perf_counter() - self._started) * 1000,
+            tool_calls=self.ledger_tools,
+            llm_calls=self.llm_calls,
+        )
+
 
 class RAGEngine:
-    def __init__(self):
+    def __init__(self, collection_settings: Optional[CollectionSettings] = None):
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             print("⚠️ Warning: OPENAI_API_KEY not found.")
             api_key = "placeholder"
 
-        # Initialize OpenAI Client (shared across agents)
-        self.client = OpenAIClient(api_key=api_key, model="gpt-4.1-mini")
-        
-        # Tool calls tracker - reset per request
-        self.tool_calls_log: List[ToolCall] = []
-        
-        # Event queue for streaming (set during streaming requests)
-        self._event_queue = None
+        # RPM/TPM token buckets shared by every LLM and embedding call of this process
+        self.governor = RateLimitGovernor.from_env()
+
+        # Record/replay of whole ticket runs (CASSETTE_MODE=record|replay, see cassettes.py)
+        self.cassettes = CassetteDeck()
+
+        # One keep-alive (HTTP/2) connection pool for every LLM and embedding call (see http_pool.py)
+        self.http_pool = SharedHttpPool.from_env()
+
+        # Embeddings and prefetched evidence, shared by all workers with SHARED_CACHE_PATH (see shared_cache.py).
+        # Recording/replaying must see every embedding call and evidence collection: no cache then
+        self.shared_cache = SharedCache.from_env()
+        engine_cache = self.shared_cache if self.cassettes.settings.mode == "off" else None
+
+        # Initialize OpenAI Client (default model, owns the governed httpx clients)
+        self.client = GovernedOpenAIClient(
+            api_key=api_key,
+            model="gpt-4.1-mini",
+            governor=self.governor,
+            cassettes=self.cassettes,
+            http_pool=self.http_pool
+        )
+
+        # Per-role/per-priority models (MODEL_ROUTES), with latency and cost metrics per route
+        self.router = ModelRouter.from_env(
+            lambda model, route: RoutedOpenAIClient(
+                api_key=api_key,
+                model=model,
+                governor=self.governor,
+                http_clients=(self.client._http_client, self.client._async_http_client),
+                http_pool=self.http_pool,
+                route=route,
+                meter=self._meter,
+            )
+        )
         
+        # Tool calls log and SSE queue live in a per-request RunContext (see _build_agents),
+        # which is appended to the run ledger when the request ends
+        self.ledger = RunLedger.from_env()
+        # Per-ticket max_steps learned from the ledger, memoized duplicate tool calls and
+        # early stop of sub-agents with sufficient evidence (see agent_controller.py)
+        self.step_budgets = StepBudgets.from_env(self.ledger, replaying=self.cassettes.replaying)
+
+        # LLM slow or failing -> degraded drafts built from local data only
+        self.breaker = CircuitBreaker.from_env()
+        self.past_ticket_index = PastTicketIndex(PAST_TICKETS_PATH)
+
         # ====== 1. OFFICIAL SQL DATABASE TOOL (Best Practice) ======
         self.db_tool = SQLDatabase(db_uri="sqlite:///northpole.db")
+        # Deterministic fast path: ids/names/cities/gifts -> canonical queries (no LLM)
+        self.entity_extractor = EntityExtractor(self.db_tool.engine)
+        # children_log + stock/sector of the requested gift, one precomputed row per child
+        self.child_dossier = ChildDossier(self.db_tool.engine)
+        if not self.cassettes.replaying:
+            try:
+                if self.child_dossier.install():
+                    print("🗂️ Child dossier rebuilt")
+            except Exception as e:
+                print(f"⚠️ Child dossier not available: {e}")
         
         # ====== 2. QDRANT VECTOR STORE FOR RAG ======
+        # Quantization / on-disk / HNSW / dimensions (see vector_settings.py)
+        self.collection_settings = collection_settings or CollectionSettings.from_env()
+        self.vector_name = EMBEDDING_MODEL
         self.vectorstore = self._initialize_qdrant()
-        self.embedder = OpenAIEmbedder(
+        self.embedder = NorthPoleEmbedder(
             api_key=api_key,
-            model_name="text-embedding-3-small"
+            model_name=EMBEDDING_MODEL,
+            dimensions=(
+                self.collection_settings.dimensions
+                if self.collection_settings.dimensions != EMBEDDING_MAX_DIMENSIONS else None
+            ),
+            governor=self.governor,
+            cassettes=self.cassettes,
+            http_pool=self.http_pool,
+            cache=engine_cache,
+            cache_ttl_seconds=EMBEDDING_CACHE_TTL_SECONDS
         )
+        # Aliases of the served versions (`northpole_tickets_v{n}`), see collection_versions.py
         self.kb_collection = "northpole_manuals"
         self.tickets_collection = "northpole_tickets"
+
+        # Per-ticket evidence collected in background when a ticket is opened
+        self.evidence_cache = EvidenceCache(ttl_seconds=PREFETCH_TTL_SECONDS, shared=engine_cache)
+        # Sync collection fans out to 3 calls per ticket (DB lookup, manuals, past tickets)
+        self.evidence_executor = ThreadPoolExecutor(
+            max_workers=3 * int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "4")), thread_name_prefix="evidence"
+        )
+        
+        # ====== 3. PROMPTS (agents are built per request, see _build_agents) ======
+        # System prompts are fully static and byte-identical across requests (schema serialized
+        # with sorted keys): OpenAI caches the longest shared prefix, so everything that changes
+        # per ticket goes in the user message built by _build_task_input, after the instructions
+        schema_json = json.dumps(OpsResponse.model_json_schema(), ensure_ascii=False, sort_keys=True, indent=2)
+
+        # Shared by the master agent and the synthesis-only path (prefetched evidence)
+        ops_fields_spec = """SPECIFICHE CAMPI (LEGGI ATTENTAMENTE):
+- thought_process: Il tuo ragionamento interno (NON visibile al cliente)
+- sql_query_used: Le query SQL eseguite
+- action_checklist: Lista di 2-3 azioni concrete da fare internamente (es. "Aggiornare inventario", "Notificare elfi")
+- coal_alert: True se naughty_score > 50
+- final_response: ⚠️ IMPORTANTISSIMO ⚠️ Questa è la RISPOSTA EMAIL DA INVIARE AL CLIENTE. 
+  Deve essere cortese, professionale, e rispondere direttamente alla richiesta del ticket.
+  Esempio: "Gentile [nome], grazie per averci contattato. [risposta al problema]... Cordiali saluti, Il Team del Polo Nord"
+  NON deve essere un'analisi interna, ma la vera risposta da copiare/incollare e mandare al cliente!"""
+        
+        self.master_prompt = f"""Sei l'assistente AI dell'Ufficio Reclami Polo Nord.
+Gestisci i ticket di supporto e generi risposte da inviare ai clienti.
+
+REGOLA FONDAMENTALE - Per OGNI richiesta DEVI:
+1. Chiamare `sql_expert` per ottenere dati dal database (bambini, inventario, statistiche),
+   TRANNE quando il ticket contiene già la sezione "DATI DATABASE" (estratti automaticamente)
+2. Chiamare `history_expert` per consultare manuali e storico dei problemi
+3. Sintetizzare le risposte in un unico report JSON.
+
+{ops_fields_spec}
+
+⚠️ NON rispondere MAI senza aver consultato `history_expert` e senza dati dal database (forniti o tramite `sql_expert`).
+
+LOGICA COAL ALERT:
+- Se un bambino ha `naughty_score` > 50, imposta `coal_alert` a True
+
+LA TUA RISPOSTA FINALE DEVE ESSERE UN OGGETTO JSON VALIDO:
+{schema_json}
+
+Rispondi SEMPRE in italiano."""
+
+        # Synthesis-only prompt: evidence already collected by the prefetch
+        self.synthesis_prompt = f"""Sei l'assistente AI dell'Ufficio Reclami Polo Nord.
+Gestisci i ticket di supporto e generi risposte da inviare ai clienti.
+
+I dati del database, i manuali e i ticket passati sono GIÀ stati raccolti e ti vengono forniti
+insieme al ticket: usali come unica fonte, non inventare dati che non compaiono nelle evidenze.
+
+{ops_fields_spec}
+
+LOGICA COAL ALERT:
+- Se un bambino ha `naughty_score` > 50, imposta `coal_alert` a True
+
+Rispondi SEMPRE in italiano."""
+
+        # Parser of the master's free text: the static instructions are the system prompt,
+        # the text to parse is the whole (variable) input
+        self.parser_prompt = """You are a JSON parser.
+Extract the operational response from the text you receive and format it strictly according to the schema.
+Ignore any conversational filler before or after the JSON.
+
+IMPORTANT: You MUST populate 'action_checklist' with specific actionable steps inferred from the text if they are not explicitly listed."""
+
+        # Opt-in RSS/tracemalloc accounting (MEMORY_PROFILING, see memory_profile.py), started
+        # last so that the tracemalloc baseline is the fully built engine
+        self.memory = MemoryProfiler.from_env()
         
+    def _meter(self, route: str, model: str, latency_seconds: float, response=None, error: bool = False):
+        """Per-route metrics, plus the call in the ledger record of the run it belongs to"""
+        self.router.record(route, model, latency_seconds, response, error)
+        self.breaker.record(latency_seconds, error)
+        run = RunContext.current()
+        if run is not None:
+            run.record_llm_call(route, model, latency_seconds, response, error)
+
+    def _build_agents(self, run: "RunContext"):
+        """Master + sub-agents for one request, with tools bound to its RunContext.
+
+        Agents are cheap to build and not shareable across concurrent requests (datapizza
+        serializes runs of the same instance), so every request gets its own.
+        """
         # Reference to self for closures
         engine_self = self
+        _push_event = run.push
+        controller = AgentController(self.step_budgets, run.ticket)
 
-        # ====== HELPER: Push event to streaming queue ======
-        def _push_event(event: dict):
-            """Push event to streaming queue if available"""
-            print(f"📤 [PUSH_EVENT] {event.get('type', 'unknown')} - {event.get('tool_name', 'N/A')}")
-            if engine_self._event_queue is not None:
-                engine_self._event_queue.put(event)
-                print(f"   ✅ Event pushed to queue")
-            else:
-                print(f"   ⚠️ No event queue available!")
+        def _replay(tool_name: str, tool_input: str) -> Optional[str]:
+            """Memoized result of an identical call earlier in this run, traced as a cached call"""
+            result = controller.recall(tool_name, tool_input)
+            if result is not None:
+                _push_event({"type": "tool_start", "tool_name": tool_name, "tool_input": tool_input[:200]})
+                _push_event({"type": "tool_complete", "tool_name": tool_name, "tool_input": tool_input[:200], "tool_output": result[:500], "status": "success", "cached": True})
+                run.tool_calls.append(ToolCall(tool_name=tool_name, tool_input=tool_input, tool_output=result[:500], status="success"))
+            return result
 
-        # ====== 3. DEFINE TOOLS WITH TRACING ======
+        # ====== DEFINE TOOLS WITH TRACING ======
         @tool
         def search_knowledge_base(query: str) -> str:
             """Cerca nei manuali tecnici e nei protocolli degli elfi per procedure o riparazioni."""
             print(f"\n💡 [TOOL] search_knowledge_base: {query}")
+            replayed = _replay("search_knowledge_base", query)
+            if replayed is not None:
+                return replayed
             
             # Push START event
             _push_event({
@@ -94,50 +407,80 @@ class RAGEngine:
                 "status": status
             })
             
-            engine_self.tool_calls_log.append(ToolCall(
+            run.tool_calls.append(ToolCall(
                 tool_name="search_knowledge_base",
                 tool_input=query,
                 tool_output=str(result)[:500],
                 status=status
             ))
+            controller.remember("search_knowledge_base", query, result, status)
             print(f"   ➡️ Found: {len(str(result))} chars")
             return result
 
         @tool
-        def search_past_tickets(query: str) -> str:
-            """Cerca nei ticket passati per vedere come sono stati risolti problemi simili."""
-            print(f"\n🔍 [TOOL] search_past_tickets: {query}")
-            _push_event({"type": "tool_start", "tool_name": "search_past_tickets", "tool_input": query[:200]})
+        def search_past_tickets(
+            query: str,
+            category: str = "",
+            priority: str = "",
+            resolution: str = "",
+            min_satisfaction: int = 0,
+            resolved_after: str = "",
+            resolved_before: str = "",
+        ) -> str:
+            """Cerca nei ticket passati per vedere come sono stati risolti problemi simili.
+            Filtri opzionali (lasciali vuoti se non servono): category e priority
+            (valori separati da virgola), resolution, min_satisfaction (1-5),
+            resolved_after / resolved_before (date ISO, es. 2024-12-01)."""
+            filters = {
+                "category": category,
+                "priority": priority,
+                "resolution": resolution,
+                "min_satisfaction": min_satisfaction,
+                "resolved_after": resolved_after,
+                "resolved_before": resolved_before,
+            }
+            active_filters = {k: v for k, v in filters.items() if v}
+            tool_input = query if not active_filters else f"{query} {json.dumps(active_filters, ensure_ascii=False)}"
+            print(f"\n🔍 [TOOL] search_past_tickets: {tool_input}")
+            replayed = _replay("search_past_tickets", tool_input)
+            if replayed is not None:
+                return replayed
+            _push_event({"type": "tool_start", "tool_name": "search_past_tickets", "tool_input": tool_input[:200]})
             
             try:
-                result = engine_self.search_past_tickets(query)
+                result = engine_self.search_past_tickets(query, **active_filters)
                 status = "error" if "Error" in result else "success"
             except Exception as e:
                 result = f"Error executing tool: {str(e)}"
                 status = "error"
             
-            _push_event({"type": "tool_complete", "tool_name": "search_past_tickets", "tool_input": query[:200], "tool_output": str(result)[:500], "status": status})
-            engine_self.tool_calls_log.append(ToolCall(tool_name="search_past_tickets", tool_input=query, tool_output=str(result)[:500], status=status))
+            _push_event({"type": "tool_complete", "tool_name": "search_past_tickets", "tool_input": tool_input[:200], "tool_output": str(result)[:500], "status": status})
+            run.tool_calls.append(ToolCall(tool_name="search_past_tickets", tool_input=tool_input, tool_output=str(result)[:500], status=status))
+            controller.remember("search_past_tickets", tool_input, result, status)
             print(f"   ➡️ Found: {len(str(result))} chars")
             return result
 
-        # ====== 4. CREATE SQL TOOL WRAPPERS WITH LOGGING ======
+        # ====== SQL TOOL WRAPPERS WITH LOGGING ======
         
         @tool
         def list_tables() -> str:
             """Lista tutte le tabelle disponibili nel database."""
             print(f"\n🗄️ [SQL TOOL] list_tables")
+            replayed = _replay("list_tables", "")
+            if replayed is not None:
+                return replayed
             _push_event({"type": "tool_start", "tool_name": "list_tables", "tool_input": ""})
             
             try:
-                result = engine_self.db_tool.list_tables()
+                result = engine_self.cassettes.call("sql", ["list_tables"], lambda: str(engine_self.db_tool.list_tables()))
                 status = "success"
             except Exception as e:
                  result = f"Error: {str(e)}"
                  status = "error"
             
             _push_event({"type": "tool_complete", "tool_name": "list_tables", "tool_input": "", "tool_output": str(result)[:500], "status": status})
-            engine_self.tool_calls_log.append(ToolCall(tool_name="list_tables", tool_input="", tool_output=str(result)[:500], status=status))
+            run.tool_calls.append(ToolCall(tool_name="list_tables", tool_input="", tool_output=str(result)[:500], status=status))
+            controller.remember("list_tables", "", str(result), status)
             print(f"   ➡️ Tables: {result}")
             return str(result)
         
@@ -145,125 +488,222 @@ class RAGEngine:
         def get_table_schema(table_name: str) -> str:
             """Ottieni lo schema di una tabella del database."""
             print(f"\n🗄️ [SQL TOOL] get_table_schema: {table_name}")
+            replayed = _replay("get_table_schema", table_name)
+            if replayed is not None:
+                return replayed
             _push_event({"type": "tool_start", "tool_name": "get_table_schema", "tool_input": table_name})
             
             try:
-                result = engine_self.db_tool.get_table_schema(table_name)
+                result = engine_self.cassettes.call("sql", ["get_table_schema", table_name], lambda: str(engine_self.db_tool.get_table_schema(table_name)))
                 status = "success"
             except Exception as e:
                 result = f"Error: {str(e)}"
                 status = "error"
             
             _push_event({"type": "tool_complete", "tool_name": "get_table_schema", "tool_input": table_name, "tool_output": str(result)[:500], "status": status})
-            engine_self.tool_calls_log.append(ToolCall(tool_name="get_table_schema", tool_input=table_name, tool_output=str(result)[:500], status=status))
+            run.tool_calls.append(ToolCall(tool_name="get_table_schema", tool_input=table_name, tool_output=str(result)[:500], status=status))
+            controller.remember("get_table_schema", table_name, str(result), status)
             print(f"   ➡️ Schema: {str(result)[:200]}...")
             return str(result)
         
         @tool
         def run_sql_query(query: str) -> str:
-            """Esegui una query SQL sul database (tabelle: children_log, inventory)."""
+            """Esegui una query SQL sul database (tabelle: children_log, inventory, child_dossier)."""
             print(f"\n🗄️ [SQL TOOL] run_sql_query: {query}")
+            replayed = _replay("run_sql_query", query)
+            if replayed is not None:
+                return replayed
             _push_event({"type": "tool_start", "tool_name": "run_sql_query", "tool_input": query[:200]})
             
             try:
-                result = engine_self.db_tool.run_sql_query(query)
+                result = engine_self.cassettes.call("sql", ["run_sql_query", query], lambda: str(engine_self.db_tool.run_sql_query(query)))
                 status = "error" if "Error" in str(result) else "success"
             except Exception as e:
                 result = f"Error: {str(e)}"
                 status = "error"
             
             _push_event({"type": "tool_complete", "tool_name": "run_sql_query", "tool_input": query[:200], "tool_output": str(result)[:500], "status": status})
-            engine_self.tool_calls_log.append(ToolCall(tool_name="run_sql_query", tool_input=query, tool_output=str(result)[:500], status=status))
+            run.tool_calls.append(ToolCall(tool_name="run_sql_query", tool_input=query, tool_output=str(result)[:500], status=status))
+            controller.remember("run_sql_query", query, str(result), status)
             print(f"   ➡️ Result: {str(result)[:200]}...")
             return str(result)
 
-        # ====== 5. CREATE SPECIALIZED AGENTS ======
+        @tool
+        def lookup_child_dossier(child: str) -> str:
+            """Scheda completa di un bambino in una sola chiamata: naughty_score, status, regalo richiesto
+            e stock_level/warehouse_sector dell'articolo di inventario corrispondente.
+            `child` è l'ID (es. CH-8847 o 8847) o il nome (anche parziale)."""
+            print(f"\n🗂️ [SQL TOOL] lookup_child_dossier: {child}")
+            replayed = _replay("lookup_child_dossier", child)
+            if replayed is not None:
+                return replayed
+            _push_event({"type": "tool_start", "tool_name": "lookup_child_dossier", "tool_input": child[:200]})
+
+            try:
+                rows = engine_self.lookup_child_dossier(child)
+                result = json.dumps(rows, ensure_ascii=False, default=str) if rows else f"Nessun bambino trovato per '{child}'"
+                status = "success"
+            except Exception as e:
+                result = f"Error: {str(e)}"
+                status = "error"
+
+            _push_event({"type": "tool_complete", "tool_name": "lookup_child_dossier", "tool_input": child[:200], "tool_output": str(result)[:500], "status": status})
+            run.tool_calls.append(ToolCall(tool_name="lookup_child_dossier", tool_input=child, tool_output=str(result)[:500], status=status))
+            controller.remember("lookup_child_dossier", child, str(result), status)
+            print(f"   ➡️ Result: {str(result)[:200]}...")
+            return str(result)
+
+        # ====== SPECIALIZED AGENTS ======
         
         # SQL Expert Agent
-        self.sql_agent = Agent(
+        sql_agent = Agent(
             name="sql_expert",
-            client=self.client,
+            client=self.router.client_for("sql_expert", run.ticket),
             system_prompt="""Sei un esperto SQL del database del Polo Nord.
 
 SCHEMA DATABASE:
 - Tabella `children_log`: id, name, city, naughty_score, last_incident, gift_requested, status
 - Tabella `inventory`: id, item_name, quantity, category
+- Tabella `child_dossier`: una riga per bambino con i dati di children_log e stock_level/warehouse_sector
+  dell'articolo di inventario che corrisponde al regalo richiesto (nomi normalizzati)
 
 REGOLE:
+- Per domande su un bambino specifico usa PRIMA `lookup_child_dossier` (una sola chiamata invece di più query)
 - Usa `list_tables` per vedere le tabelle disponibili
 - Usa `get_table_schema` prima di scrivere query complesse
 - Usa `run_sql_query` per eseguire le query
 - Gli ID sono INTEGER, non stringhe come 'CH-8847'
 - DEVI SEMPRE eseguire almeno una query prima di rispondere
 - Rispondi in modo conciso con i dati trovati""",
-            tools=[list_tables, get_table_schema, run_sql_query],
-            max_steps=4  # Limite anti-loop
+            tools=[lookup_child_dossier, list_tables, get_table_schema, run_sql_query],
+            max_steps=controller.max_steps["sql_expert"],  # Limite anti-loop, per classe di ticket
+            hooks=controller
         )
 
         # RAG/Manual Expert Agent
-        self.rag_agent = Agent(
+        rag_agent = Agent(
             name="history_expert",
-            client=self.client,
+            client=self.router.client_for("history_expert", run.ticket),
             system_prompt="""Sei un esperto di memoria storica del Polo Nord.
 
 Il tuo compito è consultare DUE fonti di informazione:
 1. `search_knowledge_base`: manuali tecnici e procedure ufficiali
 2. `search_past_tickets`: ticket passati risolti per trovare precedenti simili
+   (se conosci categoria o priorità usa i filtri per restringere la ricerca)
 
 Quando ricevi una domanda:
 1. CONSULTA ENTRAMBE le fonti se necessario
 2. Sintetizza le informazioni combinando teoria (manuali) e pratica (ticket passati)
 3. Cita se la soluzione viene da un manuale o da un vecchio ticket ("Come visto nel ticket NP-XXX...")""",
             tools=[search_knowledge_base, search_past_tickets],
-            max_steps=4  # Limite anti-loop
+            max_steps=controller.max_steps["history_expert"],  # Limite anti-loop, per classe di ticket
+            hooks=controller
         )
 
-        # ====== 5. MASTER AGENT WITH can_call ======
-        schema_json = OpsResponse.model_json_schema()
-        
-        self.master_agent = Agent(
+        # ====== MASTER AGENT (sub-agents as tools) ======
+        master_agent = Agent(
             name="UfficioReclamiAI",
-            client=self.client,
-            system_prompt=f"""Sei l'assistente AI dell'Ufficio Reclami Polo Nord.
-Gestisci i ticket di supporto e generi risposte da inviare ai clienti.
+            client=self.router.client_for("master", run.ticket),
+            system_prompt=self.master_prompt,
+            tools=[self._agent_as_tool(sql_agent, controller), self._agent_as_tool(rag_agent, controller)],
+            max_steps=controller.max_steps["master"],  # Limite più alto per master agent (chiama sub-agents)
+            hooks=controller
+        )
+        return master_agent, sql_agent
 
-REGOLA FONDAMENTALE - Per OGNI richiesta DEVI:
-1. Chiamare `sql_expert` per ottenere dati dal database (bambini, inventario, statistiche)
-2. Chiamare `history_expert` per consultare manuali e storico dei problemi
-3. Sintetizzare le risposte in un unico report JSON.
+    @staticmethod
+    def _agent_as_tool(agent: Agent, controller: AgentController) -> Tool:
+        """Sub-agent exposed as a sync tool.
 
-SPECIFICHE CAMPI (LEGGI ATTENTAMENTE):
-- thought_process: Il tuo ragionamento interno (NON visibile al cliente)
-- sql_query_used: Le query SQL eseguite
-- action_checklist: Lista di 2-3 azioni concrete da fare internamente (es. "Aggiornare inventario", "Notificare elfi")
-- coal_alert: True se naughty_score > 50
-- final_response: ⚠️ IMPORTANTISSIMO ⚠️ Questa è la RISPOSTA EMAIL DA INVIARE AL CLIENTE. 
-  Deve essere cortese, professionale, e rispondere direttamente alla richiesta del ticket.
-  Esempio: "Gentile [nome], grazie per averci contattato. [risposta al problema]... Cordiali saluti, Il Team del Polo Nord"
-  NON deve essere un'analisi interna, ma la vera risposta da copiare/incollare e mandare al cliente!
+        Unlike Agent.can_call (a coroutine run on datapizza's single background loop), the
+        sub-agent runs in the caller's worker thread: concurrent requests don't queue up
+        behind each other's tools on that loop. The same task asked twice in a run is
+        answered from the controller's memo.
+        """
+        def invoke_agent(input_task: str) -> str:
+            replayed = controller.recall(agent.name, input_task)
+            if replayed is not None:
+                return replayed
+            answer = controller.answer(agent.name, agent.run(input_task))
+            controller.remember(agent.name, input_task, answer, "success" if answer else "error")
+            return answer
 
-⚠️ NON rispondere MAI senza aver consultato ENTRAMBI gli esperti.
+        return Tool(func=invoke_agent, name=agent.name, description=agent.description or agent.name)
 
-LOGICA COAL ALERT:
-- Se un bambino ha `naughty_score` > 50, imposta `coal_alert` a True
+    # ====== WARM-UP & READINESS (see startup.py) ======
 
-LA TUA RISPOSTA FINALE DEVE ESSERE UN OGGETTO JSON VALIDO:
-{schema_json}
+    def warm_up(self) -> Dict[str, dict]:
+        """Open every dependency before taking traffic, in parallel: DB connection, schema
+        metadata and entity vocabulary, Qdrant connection, OpenAI HTTP pools (model lookup
+        plus a one-word embedding). Returns {dependency: {"ok", "latency_ms", ...}}"""
+        checks = {
+            "database": self._warm_database,
+            "qdrant": self._check_qdrant,
+        }
+        # Replayed runs never reach OpenAI (and the cassette transport refuses calls outside a run)
+        if not self.cassettes.replaying:
+            checks["openai"] = lambda: self.client._get_client().models.retrieve(self.client.model_name).id
+            checks["embeddings"] = lambda: f"{len(self.embedder.embed('warm-up'))} dimensions"
+        return timed_checks(checks, timeout=WARMUP_TIMEOUT_SECONDS)
 
-Rispondi SEMPRE in italiano.""",
-            max_steps=6  # Limite più alto per master agent (chiama sub-agents)
-        )
-        
-        # Enable Multi-Agent Communication
-        self.master_agent.can_call(self.sql_agent)
-        self.master_agent.can_call(self.rag_agent)
+    def check_dependencies(self) -> Dict[str, dict]:
+        """Cheap per-dependency probes for the readiness endpoint"""
+        return timed_checks({
+            "database": self._check_database,
+            "qdrant": self._check_qdrant,
+        }, timeout=READINESS_TIMEOUT_SECONDS)
+
+    def _check_database(self):
+        with self.db_tool.engine.connect() as conn:
+            conn.execute(sql_text("SELECT 1"))
+
+    def _warm_database(self) -> str:
+        inspector = sql_inspect(self.db_tool.engine)
+        tables = inspector.get_table_names()
+        for table in tables:
+            inspector.get_columns(table)
+        # Names/cities/gifts for the deterministic fast path (otherwise loaded by the first ticket)
+        self.entity_extractor.refresh()
+        return f"{len(tables)} tables"
+
+    def _check_qdrant(self) -> str:
+        collections = self.vectorstore.get_client().get_collections().collections
+        return f"{len(collections)} collections"
+
+    def collection_versions(self) -> CollectionVersions:
+        return CollectionVersions(self.vectorstore.get_client(), self.vector_name)
+
+    def describe_collections(self) -> List[dict]:
+        """Alias -> served version (and the ones kept for rollback) for each RAG collection"""
+        versions = self.collection_versions()
+        return [versions.describe(alias) for alias in (self.kb_collection, self.tickets_collection)]
+
+    def memory_gauges(self) -> Dict[str, object]:
+        """Per-request objects still held by the engine: a leak shows up as a count that keeps growing"""
+        runs = list(_live_runs)
+        gauges = {
+            "live_runs": len(runs),
+            "live_run_tool_calls": sum(len(run.tool_calls) for run in runs),
+            "stream_threads": sum(1 for t in threading.enumerate() if t.name.startswith("stream-run")),
+            "evidence_cache": self.evidence_cache.stats(),
+            "ledger_pending": self.ledger.stats()["pending"],
+        }
+        if self.qdrant_in_memory:
+            # Points of the in-process Qdrant live in this process' heap
+            client = self.vectorstore.get_client()
+            gauges["qdrant_in_memory_points"] = {
+                c.name: client.count(collection_name=c.name).count for c in client.get_collections().collections
+            }
+        return gauges
 
     def _initialize_qdrant(self):
         """Initialize Qdrant vector store (in-memory or remote)"""
         qdrant_url = os.getenv("QDRANT_URL")
         qdrant_api_key = os.getenv("QDRANT_API_KEY")
         
-        if not qdrant_url:
+        # Replayed runs read search results from the cassette: no Qdrant server needed
+        self.qdrant_in_memory = not qdrant_url or self.cassettes.replaying
+        if self.qdrant_in_memory:
             return QdrantVectorstore(location=":memory:")
         
         host = qdrant_url.replace("https://", "").replace("http://", "")
@@ -277,103 +717,563 @@ Rispondi SEMPRE in italiano.""",
         )
 
     def _ensure_collection_exists(self, collection_name: str):
-        """Create collection if it doesn't exist"""
+        """Create collection (with the configured quantization/HNSW settings) if it doesn't exist"""
+        settings = self.collection_settings
         try:
-            collections = self.vectorstore.get_collections()
-            if collection_name not in collections:
-                print(f"📦 Creating collection '{collection_name}'...")
-                self.vectorstore.create_collection(
-                    collection_name=collection_name,
-                    vector_config=[VectorConfig(
-                        name="text-embedding-3-small",
-                        dimensions=1536
-                    )]
-                )
-                return True
-            return False
+            client = self.vectorstore.get_client()
+            if client.collection_exists(collection_name):
+                self._ensure_payload_indexes(collection_name)
+                return False
+            print(f"📦 Creating collection '{collection_name}' ({settings.describe()})...")
+            client.create_collection(
+                collection_name=collection_name,
+                vectors_config={self.vector_name: settings.vector_params()},
+                on_disk_payload=settings.on_disk_payload or None
+            )
+            self._ensure_payload_indexes(collection_name)
+            return True
         except Exception as e:
             print(f"Error with collection: {e}")
+            return False
+
+    def _ensure_payload_indexes(self, collection_name: str):
+        """Create the payload indexes used by filtered ticket search (idempotent)"""
+        if alias_of(collection_name) != self.tickets_collection:
+            return
+        if self.vectorstore.kwargs.get("location") == ":memory:":
+            return  # Local Qdrant filters by scanning, payload indexes have no effect
+        client = self.vectorstore.get_client()
+        for field_name, field_schema in TICKET_PAYLOAD_INDEXES.items():
             try:
-                self.vectorstore.create_collection(
+                client.create_payload_index(
                     collection_name=collection_name,
-                    vector_config=[VectorConfig(
-                        name="text-embedding-3-small",
-                        dimensions=1536
-                    )]
+                    field_name=field_name,
+                    field_schema=field_schema
                 )
-                return True
-            except:
-                return False
+            except Exception as e:
+                print(f"⚠️ Payload index '{field_name}' not created: {e}")
+
+    @staticmethod
+    def ticket_chunk_text(ticket: dict) -> str:
+        """Rich text representation of a past ticket used for embedding"""
+        return (
+            f"TICKET ID: {ticket.get('id')}\n"
+            f"SUBJECT: {ticket.get('subject')}\n"
+            f"ISSUE: {ticket.get('message')}\n"
+            f"RESOLUTION: {ticket.get('response')}\n"
+            f"TAGS: {', '.join(ticket.get('tags', []))}"
+        )
+
+    @staticmethod
+    def ticket_chunk_metadata(ticket: dict) -> dict:
+        """Payload stored with each past ticket chunk (filterable fields included)"""
+        metadata = {
+            "source": "past_tickets_json",
+            "ticket_id": ticket.get('id'),
+            "category": ticket.get('category'),
+            "priority": ticket.get('priority'),
+            "resolution": ticket.get('resolution'),
+            "satisfaction": ticket.get('satisfaction'),
+            "resolved_at": ticket.get('resolved_at'),
+        }
+        return {k: v for k, v in metadata.items() if v is not None}
+
+    @staticmethod
+    def _build_ticket_filter(
+        category: Optional[str] = None,
+        priority: Optional[str] = None,
+        resolution: Optional[str] = None,
+        min_satisfaction: Optional[int] = None,
+        resolved_after: Optional[str] = None,
+        resolved_before: Optional[str] = None,
+    ) -> Optional[qmodels.Filter]:
+        """Translate search filters into a Qdrant payload filter (None = no filter)"""
+        conditions = []
+
+        # Keyword fields: a comma separated value matches any of the listed values
+        for key, value in (("category", category), ("priority", priority), ("resolution", resolution)):
+            if not value:
+                continue
+            values = [v.strip() for v in value.split(",") if v.strip()]
+            if len(values) == 1:
+                match = qmodels.MatchValue(value=values[0])
+            else:
+                match = qmodels.MatchAny(any=values)
+            conditions.append(qmodels.FieldCondition(key=key, match=match))
+
+        if min_satisfaction:
+            conditions.append(qmodels.FieldCondition(
+                key="satisfaction",
+                range=qmodels.Range(gte=min_satisfaction)
+            ))
+
+        if resolved_after or resolved_before:
+            conditions.append(qmodels.FieldCondition(
+                key="resolved_at",
+                range=qmodels.DatetimeRange(gte=resolved_after or None, lte=resolved_before or None)
+            ))
+
+        if not conditions:
+            return None
+        return qmodels.Filter(must=conditions)
 
     def search_manuals(self, query: str, top_k: int = 3) -> str:
         """Search vector db for relevant manual content"""
         try:
-            query_vector = self.embedder.embed(query)
-            results = self.vectorstore.search(
-                collection_name=self.kb_collection,
-                query_vector=query_vector,
-                k=top_k
-            )
-            if not results:
-                return "Nessuna informazione rilevante trovata nei manuali."
-            return "\n---\n".join([
-                f"[{r.metadata.get('source', 'unknown')}]: {r.text}" 
-                for r in results
-            ])
+            return self._search_manuals_by_vector(self.embedder.embed(query), top_k=top_k)
         except Exception as e:
             return f"Errore nella ricerca: {str(e)}"
 
-    def search_past_tickets(self, query: str, top_k: int = 3) -> str:
-        """Search vector db for relevant past tickets"""
+    def _search_manuals_by_vector(self, query_vector: List[float], top_k: int = 3) -> str:
+        return self.cassettes.call(
+            "qdrant",
+            [self.kb_collection, query_vector, top_k],
+            lambda: self._query_manuals(query_vector, top_k),
+        )
+
+    def _query_manuals(self, query_vector: List[float], top_k: int) -> str:
+        return self._format_manuals(self.vectorstore.search(**self._search_kwargs(self.kb_collection, query_vector, top_k)))
+
+    def _search_kwargs(self, collection_name: str, query_vector: List[float], top_k: int, query_filter=None) -> dict:
+        kwargs = dict(
+            collection_name=collection_name,
+            query_vector=query_vector,
+            k=top_k,
+            vector_name=self.vector_name,
+            search_params=self.collection_settings.search_params()
+        )
+        if query_filter is not None:
+            kwargs["query_filter"] = query_filter
+        return kwargs
+
+    @staticmethod
+    def _format_manuals(results) -> str:
+        if not results:
+            return "Nessuna informazione rilevante trovata nei manuali."
+        return "\n---\n".join([
+            f"[{r.metadata.get('source', 'unknown')}]: {r.text}" 
+            for r in results
+        ])
+
+    def search_past_tickets(
+        self,
+        query: str,
+        top_k: int = 3,
+        category: Optional[str] = None,
+        priority: Optional[str] = None,
+        resolution: Optional[str] = None,
+        min_satisfaction: Optional[int] = None,
+        resolved_after: Optional[str] = None,
+        resolved_before: Optional[str] = None,
+    ) -> str:
+        """Search vector db for relevant past tickets, optionally restricted by payload filters"""
         try:
-            query_vector = self.embedder.embed(query)
-            results = self.vectorstore.search(
-                collection_name=self.tickets_collection,
-                query_vector=query_vector,
-                k=top_k
+            return self._search_past_tickets_by_vector(
+                self.embedder.embed(query),
+                top_k=top_k,
+                category=category,
+                priority=priority,
+                resolution=resolution,
+                min_satisfaction=min_satisfaction,
+                resolved_after=resolved_after,
+                resolved_before=resolved_before,
+            )
+        except Exception as e:
+            return f"Errore nella ricerca ticket: {str(e)}"
+
+    def _search_past_tickets_by_vector(self, query_vector: List[float], top_k: int = 3, **filters) -> str:
+        return self.cassettes.call(
+            "qdrant",
+            [self.tickets_collection, query_vector, top_k, filters],
+            lambda: self._query_past_tickets(query_vector, top_k, **filters),
+        )
+
+    def _query_past_tickets(self, query_vector: List[float], top_k: int, **filters) -> str:
+        query_filter = self._build_ticket_filter(**filters)
+        results = self.vectorstore.search(**self._search_kwargs(self.tickets_collection, query_vector, top_k, query_filter))
+        filter_note = ""
+        if not results and query_filter is not None:
+            # Nothing in the requested partition: fall back to the full collection
+            results = self.vectorstore.search(**self._search_kwargs(self.tickets_collection, query_vector, top_k))
+            filter_note = FILTER_FALLBACK_NOTE
+        return self._format_past_tickets(results, filter_note)
+
+    @staticmethod
+    def _format_past_tickets(results, filter_note: str = "") -> str:
+        if not results:
+            return "Nessun ticket passato simile trovato."
+        
+        # Format results nicely
+        formatted_results = []
+        for r in results:
+            score = r.score if hasattr(r, 'score') else 0.0
+            formatted_results.append(
+                f"[Ticket Simile - Score {score:.2f}]:\n{r.text}"
             )
-            if not results:
-                return "Nessun ticket passato simile trovato."
             
-            # Format results nicely
-            formatted_results = []
-            for r in results:
-                score = r.score if hasattr(r, 'score') else 0.0
-                formatted_results.append(
-                    f"[Ticket Simile - Score {score:.2f}]:\n{r.text}"
-                )
-                
-            return "\n---\n".join(formatted_results)
+        return filter_note + "\n---\n".join(formatted_results)
+
+    # ====== ASYNC RETRIEVAL (asyncio serving path) ======
+    # Same searches on the async embedder/Qdrant clients: many retrievals share one event
+    # loop instead of blocking a thread each on the embedding + Qdrant round-trips.
+    # The async HTTP clients are bound to the serving loop: call these only from it.
+
+    async def a_search_manuals(self, query: str, top_k: int = 3) -> str:
+        """Async search_manuals"""
+        try:
+            return await self._a_search_manuals_by_vector(await self.embedder.a_embed(query), top_k=top_k)
+        except Exception as e:
+            return f"Errore nella ricerca: {str(e)}"
+
+    async def a_search_past_tickets(self, query: str, top_k: int = 3, **filters) -> str:
+        """Async search_past_tickets (same payload filters)"""
+        try:
+            return await self._a_search_past_tickets_by_vector(await self.embedder.a_embed(query), top_k=top_k, **filters)
         except Exception as e:
             return f"Errore nella ricerca ticket: {str(e)}"
 
-    def generate_response(self, ticket: Ticket, image_base64: Optional[str] = None, regeneration_feedback: Optional[str] = None) -> OpsResponse:
+    async def a_retrieve(self, queries: List[str], top_k: int = 3) -> Dict[str, Dict[str, str]]:
+        """Manuals + past tickets for every query, concurrently: one batched embedding call,
+        then all the searches at once. {query: {"manuals": ..., "past_tickets": ...}}"""
+        queries = list(dict.fromkeys(queries))
+        vectors = await self.embedder.a_embed(queries)
+        searches = []
+        for vector in vectors:
+            searches.append(self._a_search_manuals_by_vector(vector, top_k=top_k))
+            searches.append(self._a_search_past_tickets_by_vector(vector, top_k=top_k))
+        results = await asyncio.gather(*searches, return_exceptions=True)
+
+        def text(result, error_prefix):
+            return f"{error_prefix}: {result}" if isinstance(result, Exception) else result
+
+        return {
+            query: {
+                "manuals": text(results[2 * i], "Errore nella ricerca"),
+                "past_tickets": text(results[2 * i + 1], "Errore nella ricerca ticket"),
+            }
+            for i, query in enumerate(queries)
+        }
+
+    async def _a_search_manuals_by_vector(self, query_vector: List[float], top_k: int = 3) -> str:
+        async def query():
+            return self._format_manuals(await self._a_vector_search(**self._search_kwargs(self.kb_collection, query_vector, top_k)))
+
+        return await self.cassettes.a_call("qdrant", [self.kb_collection, query_vector, top_k], query)
+
+    async def _a_search_past_tickets_by_vector(self, query_vector: List[float], top_k: int = 3, **filters) -> str:
+        async def query():
+            query_filter = self._build_ticket_filter(**filters)
+            results = await self._a_vector_search(**self._search_kwargs(self.tickets_collection, query_vector, top_k, query_filter))
+            if not results and query_filter is not None:
+                results = await self._a_vector_search(**self._search_kwargs(self.tickets_collection, query_vector, top_k))
+                return self._format_past_tickets(results, FILTER_FALLBACK_NOTE)
+            return self._format_past_tickets(results)
+
+        # Same cassette key as the sync path for the same arguments
+        return await self.cassettes.a_call("qdrant", [self.tickets_collection, query_vector, top_k, filters], query)
+
+    async def _a_vector_search(self, **kwargs):
+        if self.vectorstore.kwargs.get("location") == ":memory:":
+            # An async client would open its own (empty) in-memory store: search the sync one
+            return await asyncio.to_thread(self.vectorstore.search, **kwargs)
+        return await self.vectorstore.a_search(**kwargs)
+
+    # ====== SPECULATIVE PREFETCH (evidence collected before "Genera") ======
+
+    def prefetch(self, ticket: Ticket) -> bool:
+        """Start collecting evidence for a ticket in background. False if already cached/in flight
+
+        Called from the event loop (the API), retrieval runs there on the async clients;
+        otherwise in the prefetch thread pool.
+        """
+        if self.cassettes.replaying:
+            return False  # Replayed runs get their prefetched evidence from the cassette
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return self.evidence_cache.start(ticket_key(ticket), lambda: self._collect_evidence(ticket))
+        return self.evidence_cache.start_async(ticket_key(ticket), lambda: self._a_collect_evidence(ticket), loop)
+
+    def _prefetched_evidence(self, ticket: Ticket, wait_seconds: float = PREFETCH_WAIT_SECONDS) -> Optional[TicketEvidence]:
+        return self.cassettes.call(
+            "evidence",
+            ticket_key(ticket),
+            lambda: self.evidence_cache.get(ticket_key(ticket), wait_seconds=wait_seconds),
+            encode=lambda evidence: evidence.to_dict() if evidence is not None else None,
+            decode=lambda data: TicketEvidence.from_dict(data) if data else None,
+        )
+
+    def _run_parameterized(self, sql: str, params: dict) -> List[dict]:
+        """Read-only parameterized query (never built from ticket text)"""
+        def query():
+            with self.db_tool.engine.connect() as conn:
+                return [dict(row._mapping) for row in conn.execute(sql_text(sql), params)]
+        return self.cassettes.call("sql", [sql, params], query, encode=lambda rows: json.loads(json.dumps(rows, default=str)))
+
+    def _sync_dossier(self):
+        """Apply pending children_log/inventory changes to the dossier (never while replaying)"""
+        if self.cassettes.replaying:
+            return
+        try:
+            self.child_dossier.sync()
+        except Exception as e:
+            print(f"⚠️ Child dossier sync failed: {e}")
+
+    def lookup_child_dossier(self, child: str) -> List[dict]:
+        """Dossier rows for a child id ("CH-8847", "8847") or (partial) name"""
+        self._sync_dossier()
+        return self._run_parameterized(*dossier_query(child))
+
+    def _lookup_db_facts(self, ticket: Ticket):
+        """Entities extracted from the ticket -> rows of the canonical queries (facts, [(query, rows)], entities)"""
+        entities = self.entity_extractor.extract(f"{ticket.subject}\n{ticket.message}")
+        children, inventory, lookups = {}, {}, []
+        for table, sql, params in canonical_queries(entities):
+            rows = self._run_parameterized(sql, params)
+            lookups.append((format_query(sql, params), rows))
+            target = children if table == "children_log" else inventory
+            for row in rows:
+                target[row.get("id", row.get("item_id"))] = row
+
+        # Stock/sector of the gifts requested by the identified children (even if not named in the ticket)
+        dossier = []
+        if children:
+            self._sync_dossier()
+            params = {f"id{i}": child_id for i, child_id in enumerate(sorted(children))}
+            sql = DOSSIER_BY_IDS_SQL.format(ids=", ".join(f":{k}" for k in params))
+            dossier = self._run_parameterized(sql, params)
+            lookups.append((format_query(sql, params), dossier))
+
+        facts = {}
+        # The dossier has the children_log columns plus the matched item: children_log only if it's behind
+        if children and len(dossier) < len(children):
+            facts["children_log"] = list(children.values())
+        if dossier:
+            facts["child_dossier"] = dossier
+        if inventory:
+            facts["inventory"] = list(inventory.values())
+        if facts:
+            missing = [i for i in entities.child_ids if i not in children]
+            if missing:
+                facts["child_ids_not_found"] = missing
+        return facts, lookups, entities
+
+    @staticmethod
+    def _lookup_tool_calls(ticket: Ticket, lookups, entities) -> List[ToolCall]:
+        """Trace of a DB lookup: the extraction, then each query with its own rows"""
+        calls = [ToolCall(tool_name="entity_extraction", tool_input=ticket.id, tool_output=entities.model_dump_json(), status="success")]
+        calls += [ToolCall(tool_name="run_sql_query", tool_input=query, tool_output=str(rows)[:500], status="success") for query, rows in lookups]
+        return calls
+
+    def _extract_db_facts(self, ticket: Ticket, run: RunContext) -> Optional[str]:
+        """Fast path ahead of sql_expert: DB facts as JSON, None when extraction finds nothing"""
+        run.push({"type": "tool_start", "tool_name": "entity_extraction", "tool_input": ticket.id})
+        try:
+            facts, lookups, entities = self._lookup_db_facts(ticket)
+        except Exception as e:
+            print(f"⚠️ Entity extraction failed, falling back to sql_expert: {e}")
+            run.push({"type": "tool_complete", "tool_name": "entity_extraction", "tool_input": ticket.id, "tool_output": str(e)[:500], "status": "error"})
+            return None
+
+        print(f"\n🔎 [FAST PATH] entities: {entities.model_dump()}")
+        db_facts = json.dumps(facts, indent=2, ensure_ascii=False, default=str) if facts else None
+        for tc in self._lookup_tool_calls(ticket, lookups, entities):
+            run.tool_calls.append(tc)
+            run.push({"type": "tool_complete", "tool_name": tc.tool_name, "tool_input": tc.tool_input[:200], "tool_output": tc.tool_output, "status": tc.status})
+        return db_facts
+
+    def _collect_evidence(self, ticket: Ticket) -> TicketEvidence:
+        """Embed once, search manuals + past tickets and look up DB facts, in parallel"""
+        started = time.perf_counter()
+        evidence = TicketEvidence(ticket.id)
+        query = f"{ticket.subject}\n{ticket.message}"
+
+        # DB lookup runs while the ticket is embedded; one vector serves both collections
+        db_future = self.evidence_executor.submit(bind(self._lookup_db_facts), ticket)
+
+        try:
+            query_vector = self.embedder.embed(query)
+            manuals_future = self.evidence_executor.submit(bind(self._search_manuals_by_vector), query_vector)
+            tickets_future = self.evidence_executor.submit(bind(self._search_past_tickets_by_vector), query_vector)
+            evidence.manuals = manuals_future.result()
+            evidence.past_tickets = tickets_future.result()
+            status = "success"
+        except Exception as e:
+            evidence.manuals = evidence.manuals or f"Errore nella ricerca: {str(e)}"
+            evidence.past_tickets = evidence.past_tickets or f"Errore nella ricerca ticket: {str(e)}"
+            status = "error"
+        self._add_search_evidence(evidence, query, status)
+
+        try:
+            self._add_db_evidence(evidence, ticket, *db_future.result())
+        except Exception as e:
+            print(f"⚠️ Prefetch DB lookup failed: {e}")
+
+        return self._evidence_done(evidence, started)
+
+    async def _a_collect_evidence(self, ticket: Ticket) -> TicketEvidence:
+        """Async _collect_evidence: both searches on the event loop, the SQLite lookup in a thread"""
+        started = time.perf_counter()
+        evidence = TicketEvidence(ticket.id)
+        query = f"{ticket.subject}\n{ticket.message}"
+        db_task = asyncio.ensure_future(asyncio.to_thread(self._lookup_db_facts, ticket))
+
+        try:
+            retrieved = (await self.a_retrieve([query]))[query]
+            evidence.manuals, evidence.past_tickets = retrieved["manuals"], retrieved["past_tickets"]
+            failed = any(text.startswith("Errore nella ricerca") for text in retrieved.values())
+            status = "error" if failed else "success"
+        except Exception as e:
+            evidence.manuals = f"Errore nella ricerca: {str(e)}"
+            evidence.past_tickets = f"Errore nella ricerca ticket: {str(e)}"
+            status = "error"
+        self._add_search_evidence(evidence, query, status)
+
+        try:
+            self._add_db_evidence(evidence, ticket, *(await db_task))
+        except Exception as e:
+            print(f"⚠️ Prefetch DB lookup failed: {e}")
+
+        return self._evidence_done(evidence, started)
+
+    @staticmethod
+    def _add_search_evidence(evidence: TicketEvidence, query: str, status: str):
+        evidence.tool_calls.append(ToolCall(tool_name="search_knowledge_base", tool_input=query[:200], tool_output=evidence.manuals[:500], status=status))
+        evidence.tool_calls.append(ToolCall(tool_name="search_past_tickets", tool_input=query[:200], tool_output=evidence.past_tickets[:500], status=status))
+
+    @classmethod
+    def _add_db_evidence(cls, evidence: TicketEvidence, ticket: Ticket, facts, lookups, entities):
+        evidence.sql_queries = [query for query, _ in lookups]
+        evidence.db_facts = json.dumps(facts, indent=2, ensure_ascii=False, default=str) if facts else ""
+        evidence.tool_calls += cls._lookup_tool_calls(ticket, lookups, entities)
+
+    @staticmethod
+    def _evidence_done(evidence: TicketEvidence, started: float) -> TicketEvidence:
+        evidence.duration_ms = (time.perf_counter() - started) * 1000
+        print(f"🔮 Prefetched evidence for {evidence.ticket_id} in {evidence.duration_ms:.0f} ms (db facts: {evidence.has_db_facts})")
+        return evidence
+
+    def _synthesize(self, ticket: Ticket, evidence: TicketEvidence, run: RunContext, image_base64: Optional[str] = None, regeneration_feedback: Optional[str] = None, image_id: Optional[str] = None) -> OpsResponse:
+        """Single structured LLM call over prefetched evidence (sql_expert only if the DB lookup found nothing)"""
+        run.path = "prefetched"
+        run.ledger_tools += [
+            LedgerToolCall(tool_name=tc.tool_name, tool_input=tc.tool_input, status=tc.status, cached=True)
+            for tc in evidence.tool_calls
+        ]
+        db_facts = None
+        sql_queries = list(evidence.sql_queries)
+        if not evidence.has_db_facts:
+            _, sql_agent = self._build_agents(run)
+            result = sql_agent.run(
+                f"Trova nel database i dati rilevanti per questo ticket:\nOggetto: {ticket.subject}\nMessaggio: {ticket.message}"
+            )
+            db_facts = result.text if hasattr(result, 'text') else str(result)
+            sql_queries += [tc.tool_input for tc in run.tool_calls if tc.tool_name == "run_sql_query"]
+
+        task_input = self._build_task_input(ticket, image_base64, regeneration_feedback, image_id=image_id, evidence=evidence, db_facts=db_facts)
+        structured_result = self.router.client_for("synthesis", ticket).structured_response(
+            input=task_input,
+            output_cls=OpsResponse,
+            system_prompt=self.synthesis_prompt
+        )
+        ops_data = structured_result.structured_data[0]
+        if sql_queries and (not ops_data.sql_query_used or ops_data.sql_query_used == "N/A"):
+            ops_data.sql_query_used = "\n".join(sql_queries)
+        ops_data.tool_calls = list(evidence.tool_calls) + run.tool_calls
+        return ops_data
+
+    def _degraded_response(self, ticket: Ticket, run: RunContext, reason: str, evidence: Optional[TicketEvidence] = None) -> OpsResponse:
+        """Draft from local data only: DB facts, closest past ticket and a template (no LLM, no embeddings)"""
+        run.path = "degraded"
+        print(f"\n🪫 Degraded mode for {ticket.id}: {reason}")
+        run.push({"type": "tool_start", "tool_name": "degraded_mode", "tool_input": reason[:200]})
+        tool_calls = list(evidence.tool_calls) if evidence is not None else []
+        if evidence is not None and evidence.has_db_facts:
+            facts, sql_queries = json.loads(evidence.db_facts), list(evidence.sql_queries)
+        else:
+            try:
+                facts, lookups, entities = self._lookup_db_facts(ticket)
+                sql_queries = [query for query, _ in lookups]
+                tool_calls += self._lookup_tool_calls(ticket, lookups, entities)
+            except Exception as e:
+                print(f"⚠️ Degraded mode DB lookup failed: {e}")
+                facts, sql_queries = {}, []
+
+        past_ticket = self.past_ticket_index.best_match(ticket)
+        ops_data = build_degraded_response(
+            ticket, facts, sql_queries, reason,
+            past_ticket=past_ticket,
+            past_tickets_text=evidence.past_tickets if evidence is not None else None,
+            tool_calls=tool_calls + run.tool_calls,
+        )
+        output = f"dati DB: {', '.join(facts) or 'nessuno'}; ticket simile: {past_ticket.get('id') if past_ticket else 'nessuno'}"
+        run.push({"type": "tool_complete", "tool_name": "degraded_mode", "tool_input": reason[:200], "tool_output": output, "status": "success"})
+        ops_data.tool_calls.append(ToolCall(tool_name="degraded_mode", tool_input=reason, tool_output=output, status="success"))
+        return ops_data
+
+    def _breaker_reason(self) -> str:
+        return f"circuit breaker {self.breaker.state}: {self.breaker.reason or 'LLM non disponibile'}"
+
+    @staticmethod
+    def _inline_image_id(image_base64: Optional[str]) -> Optional[str]:
+        """Content id of a legacy base64 image: the run (prompt, cassette) is keyed by it like an uploaded one"""
+        return hashlib.sha256(image_base64.encode("utf-8")).hexdigest() if image_base64 else None
+
+    def _cassette_run(self, ticket: Ticket, image_base64: Optional[str], regeneration_feedback: Optional[str], image_id: Optional[str], stream: bool):
+        """(name, meta) of the cassette for a generate request; the meta lets the replay re-issue it"""
+        name = self.cassettes.cassette_name(ticket.id, ticket_key(ticket), regeneration_feedback, image_id)
+        meta = {
+            "ticket": ticket.model_dump(mode="json"),
+            "regeneration_feedback": regeneration_feedback,
+            "image_id": image_id,
+            "has_image_base64": bool(image_base64),
+            "stream": stream,
+        }
+        return name, meta
+
+    def generate_response(self, ticket: Ticket, image_base64: Optional[str] = None, regeneration_feedback: Optional[str] = None, image_id: Optional[str] = None) -> OpsResponse:
         """Generate response using Multi-Agent Pattern with tracing"""
-        # Reset tool calls log
-        self.tool_calls_log = []
-        
-        # Construct input
-        task_input = f"""TICKET DA GESTIRE:
-Oggetto: {ticket.subject}
-Messaggio: {ticket.message}
+        image_id = image_id or self._inline_image_id(image_base64)
+        name, meta = self._cassette_run(ticket, image_base64, regeneration_feedback, image_id, stream=False)
+        run = RunContext(ticket)
+        with self.cassettes.session(name, meta) as cassette, run.activate(), self.memory.track(run):
+            try:
+                result = self._generate_response(run, image_base64, regeneration_feedback, image_id=image_id)
+            except Exception as e:
+                run.fail(e)
+                raise
+            finally:
+                self.ledger.append(run.to_record())
+            if cassette is not None:
+                cassette.meta["final_response"] = result.final_response  # Replays are diffed against it
+            return result
 
-ISTRUZIONI:
-1. CHIAMA sql_expert per cercare dati rilevanti nel database
-2. CHIAMA history_expert per consultare manuali E ticket passati
-3. Sintetizza tutto in una risposta JSON"""
+    def _generate_response(self, run: RunContext, image_base64: Optional[str] = None, regeneration_feedback: Optional[str] = None, image_id: Optional[str] = None) -> OpsResponse:
+        ticket = run.ticket
 
-        if image_base64:
-            task_input += "\n\n[Immagine allegata - analizzala per valutazione danni]"
-        
-        # Aggiungi feedback per rigenerazione se presente
-        if regeneration_feedback:
-            task_input += f"""
+        # Provider slow or failing: don't wait for it, answer from local data
+        if not self.breaker.allow():
+            return self._degraded_response(ticket, run, self._breaker_reason(), self._prefetched_evidence(ticket, wait_seconds=0))
 
-⚠️ FEEDBACK UTENTE PER RIGENERAZIONE:
-{regeneration_feedback}
+        # Evidence already collected by /api/tickets/prefetch: only the synthesis is left
+        evidence = self._prefetched_evidence(ticket)
+        if evidence is not None:
+            with ContextTracing().trace("ufficio_reclami_prefetched"):
+                try:
+                    print(f"\n⚡ Using prefetched evidence for {ticket.id}")
+                    return self._synthesize(ticket, evidence, run, image_base64, regeneration_feedback, image_id=image_id)
+                except Exception as e:
+                    if is_shed_error(e):
+                        raise RateLimitShed(str(e), retry_after=retry_after_seconds(e.response.headers) or 5.0)
+                    print(f"⚠️ Synthesis from prefetched evidence failed, running full pipeline: {e}")
+                    run.tool_calls = []
+                    run.path = "fallback"
+        
+        # Fast path: DB facts from the entities in the ticket (sql_expert only if nothing is found)
+        db_facts = self._extract_db_facts(ticket, run)
 
-IMPORTANTE: Rigenera la risposta tenendo conto di questo feedback specifico.
-Mantieni le stesse fonti di dati ma modifica il tono, lo stile o il contenuto come richiesto."""
+        # Construct input
+        task_input = self._build_task_input(ticket, image_base64, regeneration_feedback, image_id=image_id, db_facts=db_facts)
 
         # Run with ContextTracing (Best Practice)
         with ContextTracing().trace("ufficio_reclami_multi_agent"):
@@ -383,7 +1283,8 @@ Mantieni le stesse fonti di dati ma modifica il tono, lo stile o il contenuto co
                 print("="*60)
                 
                 # Run master agent (will call sub-agents via can_call)
-                result = self.master_agent.run(task_input)
+                master_agent, _ = self._build_agents(run)
+                result = master_agent.run(task_input)
                 
                 response_text = result.text if hasattr(result, 'text') else str(result)
                 
@@ -393,27 +1294,17 @@ Mantieni le stesse fonti di dati ma modifica il tono, lo stile o il contenuto co
                 # Parse JSON response
                 # Use Structured Response for robust parsing
                 try:
-                    parsing_instruction = f"""
-                    You are a JSON parser. 
-                    Extract the operational response from the following text and format it strictly according to the schema.
-                    Ignore any conversational filler before or after the JSON.
-                    
-                    IMPORTANT: You MUST populate 'action_checklist' with specific actionable steps inferred from the text if they are not explicitly listed.
-                    
-                    TEXT TO PARSE:
-                    {response_text}
-                    """
-                    
-                    structured_result = self.client.structured_response(
-                        input=parsing_instruction,
-                        output_cls=OpsResponse
+                    structured_result = self.router.client_for("parser", ticket).structured_response(
+                        input=response_text,
+                        output_cls=OpsResponse,
+                        system_prompt=self.parser_prompt
                     )
                     
                     # Get the parsed object
                     ops_data = structured_result.structured_data[0]
                     
                     # Inject tracked tool calls
-                    ops_data.tool_calls = self.tool_calls_log
+                    ops_data.tool_calls = run.tool_calls
                     
                     return ops_data
 
@@ -431,32 +1322,60 @@ Mantieni le stesse fonti di dati ma modifica il tono, lo stile o il contenuto co
                             json_str = match.group(0)
                     
                     data = json.loads(json_str)
-                    data['tool_calls'] = [tc.model_dump() for tc in self.tool_calls_log]
+                    data['tool_calls'] = [tc.model_dump() for tc in run.tool_calls]
                     return OpsResponse(**data)
                     
             except Exception as e:
+                if is_shed_error(e):
+                    # Over the rate-limit budget: let the caller retry later instead of a bogus answer
+                    raise RateLimitShed(str(e), retry_after=retry_after_seconds(e.response.headers) or 5.0)
                 print(f"❌ Multi-Agent Error: {e}")
+                run.fail(e)
+                try:
+                    return self._degraded_response(ticket, run, f"errore LLM: {str(e)[:200]}")
+                except Exception as degraded_error:
+                    print(f"❌ Degraded mode failed too: {degraded_error}")
                 return OpsResponse(
                     thought_process=f"Error: {str(e)}",
                     sql_query_used="N/A",
                     action_checklist=["Contact Admin"],
                     coal_alert=False,
                     final_response="Errore di sistema. Controllare i log.",
-                    tool_calls=self.tool_calls_log
+                    tool_calls=run.tool_calls
                 )
 
-    def _build_task_input(self, ticket: Ticket, image_base64: Optional[str] = None, regeneration_feedback: Optional[str] = None) -> str:
-        """Build the task input string for the agent"""
-        task_input = f"""TICKET DA GESTIRE:
+    def _build_task_input(self, ticket: Ticket, image_base64: Optional[str] = None, regeneration_feedback: Optional[str] = None, image_id: Optional[str] = None, evidence: Optional[TicketEvidence] = None, db_facts: Optional[str] = None) -> str:
+        """Build the task input string for the agent (or for the synthesis over prefetched evidence).
+
+        Static instructions come first and per-ticket content last, so consecutive requests
+        share the longest possible cached prefix.
+        """
+        if evidence is not None:
+            task_input = SYNTHESIS_INSTRUCTIONS
+        elif db_facts:
+            task_input = DB_FACTS_INSTRUCTIONS
+        else:
+            task_input = AGENT_INSTRUCTIONS
+
+        task_input += f"""
+
+TICKET DA GESTIRE:
+Categoria: {ticket.category} | Priorità: {ticket.priority}
 Oggetto: {ticket.subject}
 Messaggio: {ticket.message}
+"""
+        if evidence is not None:
+            task_input += f"""
+EVIDENZE RACCOLTE:
+{evidence.to_prompt(db_facts=db_facts)}"""
+        elif db_facts:
+            task_input += f"""
+DATI DATABASE (estratti automaticamente dal ticket):
+{db_facts}"""
 
-ISTRUZIONI:
-1. CHIAMA sql_expert per cercare dati rilevanti nel database
-2. CHIAMA history_expert per consultare manuali E ticket passati
-3. Sintetizza tutto in una risposta JSON"""
-
-        if image_base64:
+        if image_id:
+            task_input += f"\n\n[Immagine allegata (id: {image_id}) - analizzala per valutazione danni]"
+        elif image_base64:
             task_input += "\n\n[Immagine allegata - analizzala per valutazione danni]"
         
         if regeneration_feedback:
@@ -470,7 +1389,7 @@ Mantieni le stesse fonti di dati ma modifica il tono, lo stile o il contenuto co
         
         return task_input
 
-    async def generate_response_stream(self, ticket: Ticket, image_base64: Optional[str] = None, regeneration_feedback: Optional[str] = None):
+    async def generate_response_stream(self, ticket: Ticket, image_base64: Optional[str] = None, regeneration_feedback: Optional[str] = None, image_id: Optional[str] = None):
         """
         Async generator that yields SSE events as tools execute.
         Uses a queue-based approach with threading for true real-time streaming.
@@ -480,28 +1399,84 @@ Mantieni le stesse fonti di dati ma modifica il tono, lo stile o il contenuto co
         from queue import Queue
         import time
         
-        # Reset tool calls log
-        self.tool_calls_log = []
-        
-        # Queue for streaming events
+        # Queue for streaming events (tool wrappers push to it through the RunContext)
         event_queue = Queue()
-        self._event_queue = event_queue  # Enable tool wrappers to push directly
-        
-        # Build task input
-        task_input = self._build_task_input(ticket, image_base64, regeneration_feedback)
+        run = RunContext(ticket, event_queue, stream=True)
+
+        # Cassette of this run (record/replay): the worker thread runs with it active
+        image_id = image_id or self._inline_image_id(image_base64)
+        name, meta = self._cassette_run(ticket, image_base64, regeneration_feedback, image_id, stream=True)
+        cassette = self.cassettes.open(name, meta)
+        started_at = time.perf_counter()
+        memory = self.memory.start(run)
         
+
         print("\n" + "="*60)
         print("🏢 UFFICIO RECLAMI AI - Streaming Request")
         print("="*60)
         
+        llm_allowed = self.breaker.allow()
+        evidence = None  # Prefetched evidence, waited for in the worker thread (never on the event loop)
+
+        def run_degraded(reason: str):
+            """Local-only draft (breaker open or LLM pipeline failed)"""
+            event_queue.put({"type": "step", "step": 1, "message": "LLM non disponibile: bozza in modalità degradata..."})
+            ops_data = self._degraded_response(ticket, run, reason, evidence)
+            event_queue.put({
+                "type": "complete",
+                "response": {
+                    "suggested_response": ops_data.final_response,
+                    "thought_process": ops_data.thought_process,
+                    "sql_query_used": ops_data.sql_query_used,
+                    "action_checklist": ops_data.action_checklist,
+                    "coal_alert": ops_data.coal_alert,
+                    "degraded": True
+                }
+            })
+
+        def run_synthesis():
+            """Prefetched evidence: replay its tool calls, then a single synthesis step"""
+            try:
+                for tc in evidence.tool_calls:
+                    event_queue.put({"type": "tool_complete", "tool_name": tc.tool_name, "tool_input": tc.tool_input[:200], "tool_output": tc.tool_output, "status": tc.status, "cached": True})
+                event_queue.put({"type": "step", "step": 1, "message": f"Evidenze pre-caricate ({evidence.duration_ms:.0f} ms), sintesi in corso..."})
+                ops_data = self._synthesize(ticket, evidence, run, image_base64, regeneration_feedback, image_id=image_id)
+                event_queue.put({
+                    "type": "complete",
+                    "response": {
+                        "suggested_response": ops_data.final_response,
+                        "thought_process": ops_data.thought_process,
+                        "sql_query_used": ops_data.sql_query_used,
+                        "action_checklist": ops_data.action_checklist,
+                        "coal_alert": ops_data.coal_alert
+                    }
+                })
+            except Exception as e:
+                if is_shed_error(e):
+                    run.fail(e)
+                    event_queue.put({"type": "error", "message": "Limite di richieste OpenAI raggiunto, riprova tra qualche secondo"})
+                    event_queue.put(None)
+                    return
+                print(f"⚠️ Synthesis from prefetched evidence failed, running full pipeline: {e}")
+                run.tool_calls = []
+                run.path = "fallback"
+                run_agent()
+                return
+            event_queue.put(None)
+
         def run_agent():
             """Run agent in background thread, push events to queue"""
             try:
+                # Fast path first: extracted DB facts spare the sql_expert sub-agent
+                db_facts = self._extract_db_facts(ticket, run)
+                task_input = self._build_task_input(ticket, image_base64, regeneration_feedback, image_id=image_id, db_facts=db_facts)
+
                 # Use stream_invoke for step-by-step execution
                 step_index = 0
                 accumulated_text = ""
                 
-                for step in self.master_agent.stream_invoke(task_input):
+                master_agent, _ = self._build_agents(run)
+                for step in master_agent.stream_invoke(task_input):
                     step_index += 1
                     print(f"\n📍 Step {step_index}")
                     
@@ -513,7 +1488,7 @@ Mantieni le stesse fonti di dati ma modifica il tono, lo stile o il contenuto co
                     })
                     
                     # NOTE: tool_start and tool_complete events are pushed directly 
-                    # by the tool wrapper functions via _push_event(), so we don't 
+                    # by the tool wrapper functions via run.push(), so we don't 
                     # need to push them here again.
                     
                     # Check for text content (thoughts)
@@ -530,20 +1505,10 @@ Mantieni le stesse fonti di dati ma modifica il tono, lo stile o il contenuto co
                 
                 try:
                     # Use Structured Response for robust parsing of the accumulated stream
-                    parsing_instruction = f"""
-                    You are a JSON parser. 
-                    Extract the operational response from the following text and format it strictly according to the schema.
-                    Ignore any conversational filler before or after the JSON.
-                    
-                    IMPORTANT: You MUST populate 'action_checklist' with specific actionable steps inferred from the text if they are not explicitly listed.
-                    
-                    TEXT TO PARSE:
-                    {response_text}
-                    """
-                    
-                    structured_result = self.client.structured_response(
-                        input=parsing_instruction,
-                        output_cls=OpsResponse
+                    structured_result = self.router.client_for("parser", ticket).structured_response(
+                        input=response_text,
+                        output_cls=OpsResponse,
+                        system_prompt=self.parser_prompt
                     )
                     
                     ops_data = structured_result.structured_data[0]
@@ -599,34 +1564,75 @@ Mantieni le stesse fonti di dati ma modifica il tono, lo stile o il contenuto co
                     
             except Exception as e:
                 print(f"❌ Agent Error: {e}")
-                event_queue.put({"type": "error", "message": str(e)})
+                run.fail(e)
+                if is_shed_error(e):
+                    event_queue.put({"type": "error", "message": "Limite di richieste OpenAI raggiunto, riprova tra qualche secondo"})
+                else:
+                    try:
+                        run_degraded(f"errore LLM: {str(e)[:200]}")
+                    except Exception as degraded_error:
+                        print(f"❌ Degraded mode failed too: {degraded_error}")
+                        event_queue.put({"type": "error", "message": str(e)})
             finally:
                 event_queue.put(None)  # Signal completion
         
         # Yield initial connection event
         yield {"type": "connected", "message": "Connessione al Polo Nord stabilita"}
         
+        def worker():
+            nonlocal evidence
+            with run.activate():
+                # An in-flight prefetch may run on the event loop (async retrieval): waiting for it
+                # there would block it, and every other request, for the whole wait
+                try:
+                    evidence = self._prefetched_evidence(ticket, PREFETCH_WAIT_SECONDS if llm_allowed else 0)
+                except Exception as e:  # e.g. a strict replay without this call
+                    run.fail(e)
+                    event_queue.put({"type": "error", "message": str(e)})
+                    event_queue.put(None)
+                    return
+                if not llm_allowed:
+                    try:
+                        run_degraded(self._breaker_reason())
+                    except Exception as e:
+                        run.fail(e)
+                        event_queue.put({"type": "error", "message": str(e)})
+                    finally:
+                        event_queue.put(None)
+                    return
+                (run_synthesis if evidence is not None else run_agent)()
+
         # Start agent in background thread
-        agent_thread = threading.Thread(target=run_agent, daemon=True)
+        agent_thread = threading.Thread(target=self.cassettes.run_with, args=(cassette, worker), name=f"stream-run-{run.run_id[:8]}", daemon=True)
         agent_thread.start()
         
         # Stream events from queue
         loop = asyncio.get_event_loop()
-        while True:
-            # Non-blocking queue get using run_in_executor
-            event = await loop.run_in_executor(None, lambda: event_queue.get(timeout=60))
-            
-            if event is None:  # Completion signal
-                break
+        finished = False
+        try:
+            while True:
+                # Non-blocking queue get using run_in_executor
+                event = await loop.run_in_executor(None, lambda: event_queue.get(timeout=60))
                 
-            yield event
-            await asyncio.sleep(0.05)  # Small delay for smoother streaming
-        
-        # Cleanup
-        self._event_queue = None
+                if event is None:  # Completion signal
+                    finished = True
+                    break
+                if event.get("type") == "complete" and cassette is not None:
+                    cassette.meta["final_response"] = event["response"]["suggested_response"]
+                    
+                yield event
+                await asyncio.sleep(0.05)  # Small delay for smoother streaming
+        finally:
+            if not finished and run.outcome == "success":
+                run.outcome = "disconnected"
+            self.ledger.append(run.to_record())
+            memory.stop()
 
-    def index_manuals(self, knowledge_base_path: str = "data/knowledge_base"):
-        """Index all .txt files from knowledge_base folder into vector store"""
+        # Only complete runs are saved (a client that disconnects leaves no cassette)
+        self.cassettes.close(cassette, time.perf_counter() - started_at)
+
+    def index_manuals(self, knowledge_base_path: str = "data/knowledge_base", collection_name: Optional[str] = None):
+        """Index all .txt files from knowledge_base folder into vector store (default: the served alias)"""
         import uuid
         import pathlib
         
@@ -636,7 +1642,8 @@ Mantieni le stesse fonti di dati ma modifica il tono, lo stile o il contenuto co
             return
         
         # Ensure collection exists
-        self._ensure_collection_exists(self.kb_collection)
+        collection_name = collection_name or self.kb_collection
+        self._ensure_collection_exists(collection_name)
         
         chunks_to_add = []
         
@@ -662,7 +1669,7 @@ Mantieni le stesse fonti di dati ma modifica il tono, lo stile o il contenuto co
                             "section_index": i
                         },
                         embeddings=[DenseEmbedding(
-                            name="text-embedding-3-small",
+                            name=self.vector_name,
                             vector=embedding
                         )]
                     )
@@ -672,13 +1679,13 @@ Mantieni le stesse fonti di dati ma modifica il tono, lo stile o il contenuto co
         
         if chunks_to_add:
             print(f"📥 Adding {len(chunks_to_add)} chunks to vector store...")
-            self.vectorstore.add(chunks_to_add, collection_name=self.kb_collection)
+            self.vectorstore.add(chunks_to_add, collection_name=collection_name)
             print("✅ Indexing complete!")
         else:
             print("No chunks to add.")
 
-    def index_tickets(self, tickets_path: str = "data/past_tickets.json"):
-        """Index past tickets into vector store"""
+    def index_tickets(self, tickets_path: str = "data/past_tickets.json", collection_name: Optional[str] = None):
+        """Index past tickets into vector store (default: the served alias)"""
         import uuid
         import pathlib
         
@@ -688,7 +1695,8 @@ Mantieni le stesse fonti di dati ma modifica il tono, lo stile o il contenuto co
             return
 
         # Ensure collection
-        self._ensure_collection_exists(self.tickets_collection)
+        collection_name = collection_name or self.tickets_collection
+        self._ensure_collection_exists(collection_name)
 
         try:
             tickets_data = json.loads(tickets_file.read_text(encoding="utf-8"))
@@ -696,13 +1704,7 @@ Mantieni le stesse fonti di dati ma modifica il tono, lo stile o il contenuto co
 
             for ticket in tickets_data:
                 # Create a rich representation for embedding
-                text_content = (
-                    f"TICKET ID: {ticket.get('id')}\n"
-                    f"SUBJECT: {ticket.get('subject')}\n"
-                    f"ISSUE: {ticket.get('message')}\n"
-                    f"RESOLUTION: {ticket.get('response')}\n"
-                    f"TAGS: {', '.join(ticket.get('tags', []))}"
-                )
+                text_content = self.ticket_chunk_text(ticket)
                 
                 print(f"🎫 Processing Ticket: {ticket.get('id')}")
                 
@@ -710,21 +1712,17 @@ Mantieni le stesse fonti di dati ma modifica il tono, lo stile o il contenuto co
                 chunk = Chunk(
                     id=str(uuid.uuid4()),
                     text=text_content,
-                    metadata={
-                        "source": "past_tickets_json",
-                        "ticket_id": ticket.get('id'),
-                        "category": ticket.get('category')
-                    },
+                    metadata=self.ticket_chunk_metadata(ticket),
                     embeddings=[DenseEmbedding(
-                        name="text-embedding-3-small",
+                        name=self.vector_name,
                         vector=embedding
                     )]
                 )
                 chunks_to_add.append(chunk)
 
             if chunks_to_add:
-                print(f"📥 Adding {len(chunks_to_add)} tickets to '{self.tickets_collection}'...")
-                self.vectorstore.add(chunks_to_add, collection_name=self.tickets_collection)
+                print(f"📥 Adding {len(chunks_to_add)} tickets to '{collection_name}'...")
+                self.vectorstore.add(chunks_to_add, collection_name=collection_name)
                 print("✅ Ticket Indexing complete!")
 
         except Exception as e:
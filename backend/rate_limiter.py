@@ -0,0 +1,500 @@
+"""
+Process-wide (optionally cross-worker) rate-limit governor for OpenAI calls.
+
+Every LLM/embedding request goes through an httpx transport that:
+1. estimates its token cost from the request body (prompt + max output tokens);
+2. takes requests/tokens from per-model token buckets refilled at the configured
+   RPM/TPM, sleeping until the budget is there (or shedding with a local 429 when the
+   wait would exceed `max_wait_seconds`);
+3. settles the estimate with the real `usage` of the response and follows the
+   provider's x-ratelimit-remaining-* headers;
+4. retries 429/5xx with jittered exponential backoff, pausing every caller of that
+   model for the Retry-After the provider asked for.
+
+Buckets are in memory, or in a small SQLite file (`state_path`) when several uvicorn
+workers share the same quota: each reservation is one `BEGIN IMMEDIATE` transaction.
+
+Limits come from OPENAI_RATE_LIMITS, e.g. "gpt-4.1-mini=500:200000,text-embedding-3-small=3000:1000000"
+(model=RPM:TPM). Models without limits are not throttled (429s are still retried).
+"""
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+import httpx
+from pydantic import BaseModel
+
+try:
+    import tiktoken  # Optional: accurate token counts, otherwise ~4 chars per token
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _ENCODING = None
+
+GOVERNED_PATHS = ("/embeddings", "/responses", "/chat/completions")
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+SHED_HEADER = "x-ratelimit-shed"
+DEFAULT_OUTPUT_TOKENS = 1024  # Output budget counted when the request doesn't set one
+DURATION_RE = re.compile(r"([\d.]+)(ms|s|m|h)")
+
+
+class ModelLimit(BaseModel):
+    rpm: float
+    tpm: float
+
+
+class RateLimitShed(Exception):
+    """Raised when a call would wait longer than allowed for the rate-limit budget"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / 4)
+
+
+def _strings(value):
+    """All string leaves of a JSON payload (messages, input parts, tool schemas...)"""
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for v in value.values():
+            yield from _strings(v)
+    elif isinstance(value, list):
+        for v in value:
+            yield from _strings(v)
+
+
+def estimate_request_tokens(path: str, payload: dict) -> int:
+    """Tokens the provider will count against TPM for this request (prompt + max output)"""
+    if path.endswith("/embeddings"):
+        return sum(estimate_tokens(s) for s in _strings(payload.get("input", "")))
+    prompt = sum(
+        estimate_tokens(s)
+        for key in ("input", "messages", "instructions", "tools", "text", "response_format")
+        for s in _strings(payload.get(key, ""))
+    )
+    output = (
+        payload.get("max_output_tokens")
+        or payload.get("max_completion_tokens")
+        or payload.get("max_tokens")
+        or DEFAULT_OUTPUT_TOKENS
+    )
+    return prompt + int(output)
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """'20ms', '1.5s', '6m0s', '12' -> seconds"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    parts = DURATION_RE.findall(value)
+    return sum(float(n) * units[u] for n, u in parts) if parts else None
+
+
+def retry_after_seconds(headers: httpx.Headers) -> Optional[float]:
+    if headers.get("retry-after-ms"):
+        return float(headers["retry-after-ms"]) / 1000
+    return parse_duration(headers.get("retry-after")) or parse_duration(headers.get("x-ratelimit-reset-tokens"))
+
+
+def _usage_tokens(body: bytes) -> Optional[int]:
+    try:
+        usage = json.loads(body).get("usage") or {}
+    except (ValueError, AttributeError):
+        return None
+    if "total_tokens" in usage:
+        return int(usage["total_tokens"])
+    total = sum(int(usage.get(k) or 0) for k in ("input_tokens", "output_tokens", "prompt_tokens", "completion_tokens"))
+    return total or None
+
+
+class _Plan:
+    """What a single HTTP call costs: model bucket + estimated tokens"""
+
+    def __init__(self, model: str, tokens: int):
+        self.model = model
+        self.tokens = tokens
+
+
+# ====== BUCKET STORAGE ======
+
+class _MemoryBuckets:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state: Dict[str, list] = {}  # model -> [requests, tokens, updated_at, blocked_until]
+
+    def transact(self, model: str, limit: ModelLimit, update):
+        with self._lock:
+            state = self._state.get(model)
+            if state is None:
+                state = [None, None, time.time(), 0.0]
+            result, state = update(state)
+            self._state[model] = state
+            return result
+
+
+class _SQLiteBuckets:
+    """Bucket state shared by all workers through a SQLite file (one transaction per call)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_buckets ("
+                "model TEXT PRIMARY KEY, requests REAL, tokens REAL, updated_at REAL, blocked_until REAL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def transact(self, model: str, limit: ModelLimit, update):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT requests, tokens, updated_at, blocked_until FROM rate_buckets WHERE model = ?", (model,)
+            ).fetchone()
+            state = list(row) if row else [None, None, time.time(), 0.0]
+            result, state = update(state)
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_buckets (model, requests, tokens, updated_at, blocked_until) VALUES (?, ?, ?, ?, ?)",
+                (model, *state),
+            )
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+# ====== GOVERNOR ======
+
+class RateLimitGovernor:
+    def __init__(
+        self,
+        limits: Optional[Dict[str, ModelLimit]] = None,
+        max_wait_seconds: float = 30.0,
+        burst_seconds: float = 10.0,
+        max_retries: int = 4,
+        backoff_base_seconds: float = 0.5,
+        state_path: Optional[str] = None,
+    ):
+        self.limits = limits or {}
+        self.max_wait_seconds = max_wait_seconds
+        self.burst_seconds = burst_seconds  # Bucket capacity = this many seconds of quota
+        self.max_retries = max_retries
+        self.backoff_base_seconds = backoff_base_seconds
+        self._buckets = _SQLiteBuckets(state_path) if state_path else _MemoryBuckets()
+        self._metrics_lock = threading.Lock()
+        self._metrics: Dict[str, Dict[str, float]] = {}
+
+    @classmethod
+    def from_env(cls) -> "RateLimitGovernor":
+        limits = {}
+        for part in os.getenv("OPENAI_RATE_LIMITS", "").split(","):
+            model, _, values = part.partition("=")
+            rpm, _, tpm = values.partition(":")
+            if model.strip() and rpm.strip() and tpm.strip():
+                limits[model.strip()] = ModelLimit(rpm=float(rpm), tpm=float(tpm))
+        return cls(
+            limits=limits,
+            max_wait_seconds=float(os.getenv("OPENAI_RATE_LIMIT_MAX_WAIT", "30")),
+            burst_seconds=float(os.getenv("OPENAI_RATE_LIMIT_BURST_SECONDS", "10")),
+            max_retries=int(os.getenv("OPENAI_RATE_LIMIT_MAX_RETRIES", "4")),
+            state_path=os.getenv("OPENAI_RATE_LIMIT_STATE") or None,
+        )
+
+    # ====== METRICS ======
+
+    def _count(self, model: str, **values):
+        with self._metrics_lock:
+            metrics = self._metrics.setdefault(model, {
+                "granted": 0, "shed": 0, "waited": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0,
+                "throttled_429": 0, "retries": 0, "tokens_estimated": 0, "tokens_actual": 0,
+            })
+            for key, value in values.items():
+                if key == "wait_seconds_max":
+                    metrics[key] = max(metrics[key], value)
+                else:
+                    metrics[key] += value
+
+    @property
+    def shared_state(self) -> bool:
+        """Buckets in SQLite: every operation is a (possibly blocking) transaction"""
+        return isinstance(self._buckets, _SQLiteBuckets)
+
+    def stats(self) -> dict:
+        with self._metrics_lock:
+            metrics = {m: dict(v) for m, v in self._metrics.items()}
+        return {
+            "limits": {m: l.model_dump() for m, l in self.limits.items()},
+            "max_wait_seconds": self.max_wait_seconds,
+            "shared_state": self.shared_state,
+            "models": metrics,
+        }
+
+    # ====== BUCKETS ======
+
+    def plan(self, request: httpx.Request) -> Optional[_Plan]:
+        """Cost of an HTTP request, None for calls that are not rate limited"""
+        path = request.url.path
+        if request.method != "POST" or not path.endswith(GOVERNED_PATHS):
+            return None
+        try:
+            payload = json.loads(request.content or b"{}")
+        except (ValueError, httpx.RequestNotRead):
+            return None
+        model = payload.get("model")
+        if not model:
+            return None
+        return _Plan(model, estimate_request_tokens(path, payload))
+
+    def _refill(self, state: list, limit: ModelLimit, now: float):
+        cap_requests = max(1.0, limit.rpm * self.burst_seconds / 60)
+        cap_tokens = max(1.0, limit.tpm * self.burst_seconds / 60)
+        requests, tokens, updated_at, blocked_until = state
+        elapsed = max(0.0, now - updated_at)
+        requests = cap_requests if requests is None else min(cap_requests, requests + elapsed * limit.rpm / 60)
+        tokens = cap_tokens if tokens is None else min(cap_tokens, tokens + elapsed * limit.tpm / 60)
+        return [requests, tokens, now, blocked_until]
+
+    def reserve(self, plan: _Plan) -> float:
+        """Debit the buckets and return how long to sleep before sending. Raises RateLimitShed"""
+        limit = self.limits.get(plan.model)
+        if limit is None:
+            self._count(plan.model, granted=1, tokens_estimated=plan.tokens)
+            return 0.0
+
+        def update(state):
+            now = time.time()
+            requests, tokens, updated_at, blocked_until = self._refill(state, limit, now)
+            # Debt model: the balance may go negative, later callers queue behind it
+            wait = max(
+                (1 - requests) * 60 / limit.rpm,
+                (plan.tokens - tokens) * 60 / limit.tpm,
+                blocked_until - now,
+                0.0,
+            )
+            if wait > self.max_wait_seconds:
+                return -wait, [requests, tokens, updated_at, blocked_until]
+            return wait, [requests - 1, tokens - plan.tokens, updated_at, blocked_until]
+
+        wait = self._buckets.transact(plan.model, limit, update)
+        if wait < 0:
+            self._count(plan.model, shed=1)
+            raise RateLimitShed(f"Rate limit budget for {plan.model} exhausted (wait {-wait:.1f}s)", retry_after=-wait)
+        self._count(plan.model, granted=1, tokens_estimated=plan.tokens)
+        if wait > 0:
+            self._count(plan.model, waited=1, wait_seconds_total=wait, wait_seconds_max=wait)
+        return wait
+
+    def refund(self, plan: _Plan, requests: float = 1, tokens: Optional[float] = None):
+        """Give back budget for a call the provider didn't count (e.g. rejected with 429)"""
+        limit = self.limits.get(plan.model)
+        if limit is None:
+            return
+        tokens = plan.tokens if tokens is None else tokens
+
+        def update(state):
+            state = self._refill(state, limit, time.time())
+            state[0] += requests
+            state[1] += tokens
+            return None, state
+
+        self._buckets.transact(plan.model, limit, update)
+
+    def observe(self, plan: _Plan, response: httpx.Response, actual_tokens: Optional[int] = None):
+        """Settle the estimate with real usage and follow the provider's remaining-budget headers"""
+        if actual_tokens is not None:
+            self._count(plan.model, tokens_actual=actual_tokens)
+        limit = self.limits.get(plan.model)
+        if limit is None:
+            return
+        remaining_requests = response.headers.get("x-ratelimit-remaining-requests")
+        remaining_tokens = response.headers.get("x-ratelimit-remaining-tokens")
+
+        def update(state):
+            state = self._refill(state, limit, time.time())
+            if actual_tokens is not None:
+                state[1] += plan.tokens - actual_tokens
+            # The provider is the source of truth when it has less left than we think
+            if remaining_requests and remaining_requests.isdigit():
+                state[0] = min(state[0], float(remaining_requests))
+            if remaining_tokens and remaining_tokens.isdigit():
+                state[1] = min(state[1], float(remaining_tokens))
+            return None, state
+
+        self._buckets.transact(plan.model, limit, update)
+
+    def pause(self, model: str, seconds: float):
+        """Provider said 429: nobody calls this model before `seconds` from now"""
+        self._count(model, throttled_429=1)
+        limit = self.limits.get(model) or ModelLimit(rpm=1e9, tpm=1e12)
+
+        def update(state):
+            state = self._refill(state, limit, time.time())
+            state[3] = max(state[3], time.time() + seconds)
+            return None, state
+
+        self._buckets.transact(model, limit, update)
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Exponential backoff with jitter, never shorter than the provider's Retry-After"""
+        delay = self.backoff_base_seconds * (2 ** attempt)
+        return max(retry_after or 0.0, random.uniform(delay / 2, delay))
+
+    def shed_response(self, request: httpx.Request, error: RateLimitShed) -> httpx.Response:
+        """Local 429 (the SDK raises openai.RateLimitError) instead of sending a doomed call"""
+        return httpx.Response(
+            429,
+            headers={SHED_HEADER: "1", "retry-after": f"{error.retry_after:.1f}"},
+            json={"error": {"message": str(error), "type": "rate_limit_shed", "code": "rate_limit_shed"}},
+            request=request,
+        )
+
+
+def is_shed_error(error: Exception) -> bool:
+    """True for errors raised on a locally shed call (openai.RateLimitError on our 429)"""
+    response = getattr(error, "response", None)
+    return response is not None and response.headers.get(SHED_HEADER) == "1"
+
+
+# ====== HTTPX TRANSPORTS ======
+
+def _settle_tokens(response: httpx.Response) -> Optional[int]:
+    if "text/event-stream" in response.headers.get("content-type", ""):
+        return None
+    return _usage_tokens(response.content)
+
+
+class GovernedTransport(httpx.BaseTransport):
+    def __init__(self, governor: RateLimitGovernor, transport: Optional[httpx.BaseTransport] = None):
+        self.governor = governor
+        self._transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        governor = self.governor
+        plan = governor.plan(request)
+        attempt = 0
+        while True:
+            if plan is not None:
+                try:
+                    wait = governor.reserve(plan)
+                except RateLimitShed as e:
+                    return governor.shed_response(request, e)
+                if wait:
+                    time.sleep(wait)
+            try:
+                response = self._transport.handle_request(request)
+            except httpx.TransportError:
+                if attempt >= governor.max_retries:
+                    raise
+                if plan is not None:
+                    governor.refund(plan)
+                    governor._count(plan.model, retries=1)
+                time.sleep(governor.backoff(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code in RETRY_STATUSES and attempt < governor.max_retries:
+                retry_after = retry_after_seconds(response.headers)
+                response.read()
+                response.close()
+                if plan is not None:
+                    governor.refund(plan)
+                    governor._count(plan.model, retries=1)
+                    if response.status_code == 429:
+                        governor.pause(plan.model, retry_after or governor.backoff(attempt))
+                time.sleep(governor.backoff(attempt, retry_after))
+                attempt += 1
+                continue
+
+            if plan is not None and response.status_code < 400:
+                if "text/event-stream" not in response.headers.get("content-type", ""):
+                    response.read()
+                governor.observe(plan, response, _settle_tokens(response))
+            return response
+
+    def close(self):
+        self._transport.close()
+
+
+class AsyncGovernedTransport(httpx.AsyncBaseTransport):
+    def __init__(self, governor: RateLimitGovernor, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.governor = governor
+        self._transport = transport or httpx.AsyncHTTPTransport()
+
+    async def _buckets(self, operation, *args):
+        """Shared-state buckets are BEGIN IMMEDIATE transactions: run them in a worker thread"""
+        if self.governor.shared_state:
+            return await asyncio.to_thread(operation, *args)
+        return operation(*args)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        governor = self.governor
+        plan = governor.plan(request)
+        attempt = 0
+        while True:
+            if plan is not None:
+                try:
+                    wait = await self._buckets(governor.reserve, plan)
+                except RateLimitShed as e:
+                    return governor.shed_response(request, e)
+                if wait:
+                    await asyncio.sleep(wait)
+            try:
+                response = await self._transport.handle_async_request(request)
+            except httpx.TransportError:
+                if attempt >= governor.max_retries:
+                    raise
+                if plan is not None:
+                    await self._buckets(governor.refund, plan)
+                    governor._count(plan.model, retries=1)
+                await asyncio.sleep(governor.backoff(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code in RETRY_STATUSES and attempt < governor.max_retries:
+                retry_after = retry_after_seconds(response.headers)
+                await response.aread()
+                await response.aclose()
+                if plan is not None:
+                    await self._buckets(governor.refund, plan)
+                    governor._count(plan.model, retries=1)
+                    if response.status_code == 429:
+                        await self._buckets(governor.pause, plan.model, retry_after or governor.backoff(attempt))
+                await asyncio.sleep(governor.backoff(attempt, retry_after))
+                attempt += 1
+                continue
+
+            if plan is not None and response.status_code < 400:
+                if "text/event-stream" not in response.headers.get("content-type", ""):
+                    await response.aread()
+                await self._buckets(governor.observe, plan, response, _settle_tokens(response))
+            return response
+
+    async def aclose(self):
+        await self._transport.aclose()
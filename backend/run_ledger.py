@@ -0,0 +1,325 @@
+"""
+Persistent ledger of agent runs (SQLite), written in batches off the request path.
+
+Every generate request appends one RunRecord: ticket hash, path taken (prefetched
+synthesis / multi-agent / fallback), outcome, tool calls with their timings, and each
+LLM call (route, model, latency, tokens). append() only enqueues; a background thread
+flushes batches every `flush_seconds` or `batch_size` records. Query helpers cover
+the slowest runs, the most frequent tool sequences, cache opportunities, a capacity summary
+and the per-role LLM calls behind the agent step budgets (see agent_controller.py).
+"""
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    ticket_id TEXT,
+    ticket_hash TEXT,
+    priority TEXT,
+    category TEXT,
+    path TEXT,
+    stream INTEGER,
+    outcome TEXT,
+    error TEXT,
+    started_at REAL,
+    duration_ms REAL,
+    llm_calls INTEGER,
+    llm_ms REAL,
+    tool_ms REAL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    cached_tokens INTEGER,
+    models TEXT,
+    tool_sequence TEXT,
+    steps TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_runs_started ON runs(started_at);
+CREATE INDEX IF NOT EXISTS idx_runs_duration ON runs(duration_ms);
+CREATE INDEX IF NOT EXISTS idx_runs_ticket ON runs(ticket_hash);
+CREATE TABLE IF NOT EXISTS run_tool_calls (
+    run_id TEXT,
+    seq INTEGER,
+    tool_name TEXT,
+    input_hash TEXT,
+    input_preview TEXT,
+    duration_ms REAL,
+    status TEXT,
+    cached INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_tool_calls_run ON run_tool_calls(run_id);
+CREATE INDEX IF NOT EXISTS idx_tool_calls_input ON run_tool_calls(tool_name, input_hash);
+"""
+
+
+def input_hash(tool_name: str, tool_input: str) -> str:
+    """Same tool + same (whitespace/case-normalized) input -> same hash"""
+    normalized = " ".join((tool_input or "").split()).lower()
+    return hashlib.sha1(f"{tool_name}\n{normalized}".encode("utf-8")).hexdigest()[:16]
+
+
+def _percentile(samples, q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class LedgerToolCall(BaseModel):
+    tool_name: str
+    tool_input: str = ""
+    status: str = "success"
+    duration_ms: Optional[float] = None  # None for replayed (prefetched) calls
+    cached: bool = False
+
+
+class LedgerLLMCall(BaseModel):
+    route: str
+    model: str
+    latency_ms: float
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    error: bool = False
+
+
+class RunRecord(BaseModel):
+    run_id: str
+    ticket_id: str
+    ticket_hash: str
+    priority: Optional[str] = None
+    category: Optional[str] = None
+    path: str = "agent"  # prefetched | agent | fallback | degraded
+    stream: bool = False
+    outcome: str = "success"  # success | error | shed | disconnected
+    error: Optional[str] = None
+    started_at: float
+    duration_ms: float
+    tool_calls: List[LedgerToolCall] = []
+    llm_calls: List[LedgerLLMCall] = []
+
+
+class RunLedger:
+    def __init__(
+        self,
+        path: Optional[str] = "run_ledger.db",
+        batch_size: int = 50,
+        flush_seconds: float = 2.0,
+        max_pending: int = 10_000,
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue: "queue.Queue[Optional[RunRecord]]" = queue.Queue(maxsize=max_pending)
+        self._counters = {"appended": 0, "written": 0, "dropped": 0, "batches": 0, "write_errors": 0}
+        self._writer: Optional[threading.Thread] = None
+        if self.enabled:
+            with self._connect() as conn:
+                conn.executescript(SCHEMA)
+            self._writer = threading.Thread(target=self._run_writer, name="run-ledger", daemon=True)
+            self._writer.start()
+
+    @classmethod
+    def from_env(cls) -> "RunLedger":
+        return cls(
+            path=os.getenv("RUN_LEDGER_PATH", "run_ledger.db") or None,  # "" disables the ledger
+            batch_size=int(os.getenv("RUN_LEDGER_BATCH_SIZE", "50")),
+            flush_seconds=float(os.getenv("RUN_LEDGER_FLUSH_SECONDS", "2")),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")  # Readers (query API) don't block the writer
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    # ====== WRITE PATH ======
+
+    def append(self, record: RunRecord):
+        """Non-blocking: the record is written by the background thread (dropped if the backlog is full)"""
+        if not self.enabled:
+            return
+        try:
+            self._queue.put_nowait(record)
+            self._counters["appended"] += 1
+        except queue.Full:
+            self._counters["dropped"] += 1
+
+    def close(self, timeout: float = 10.0):
+        """Flush pending records and stop the writer (app shutdown)"""
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join(timeout)
+
+    def _run_writer(self):
+        conn = self._connect()
+        stopping = False
+        while not stopping:
+            batch: List[RunRecord] = []
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                try:
+                    record = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if record is None:
+                    stopping = True
+                    break
+                batch.append(record)
+            if batch:
+                try:
+                    self._write_batch(conn, batch)
+                    self._counters["written"] += len(batch)
+                    self._counters["batches"] += 1
+                except sqlite3.Error as e:
+                    self._counters["write_errors"] += 1
+                    print(f"⚠️ Run ledger write failed ({len(batch)} runs lost): {e}")
+        conn.close()
+
+    @staticmethod
+    def _write_batch(conn: sqlite3.Connection, batch: List[RunRecord]):
+        runs, tool_rows = [], []
+        for r in batch:
+            llm_ok = [c for c in r.llm_calls if not c.error]
+            steps = [c.model_dump() for c in r.llm_calls]
+            runs.append((
+                r.run_id, r.ticket_id, r.ticket_hash, r.priority, r.category, r.path, int(r.stream),
+                r.outcome, r.error, r.started_at, round(r.duration_ms, 2),
+                len(r.llm_calls), round(sum(c.latency_ms for c in r.llm_calls), 2),
+                round(sum(t.duration_ms or 0.0 for t in r.tool_calls), 2),
+                sum(c.prompt_tokens for c in llm_ok), sum(c.completion_tokens for c in llm_ok),
+                sum(c.cached_tokens for c in llm_ok),
+                ",".join(sorted({c.model for c in r.llm_calls})),
+                " > ".join(t.tool_name for t in r.tool_calls),
+                json.dumps(steps, separators=(",", ":")),
+            ))
+            for seq, t in enumerate(r.tool_calls):
+                tool_rows.append((
+                    r.run_id, seq, t.tool_name, input_hash(t.tool_name, t.tool_input),
+                    (t.tool_input or "")[:120], t.duration_ms, t.status, int(t.cached),
+                ))
+        with conn:
+            conn.executemany(f"INSERT OR REPLACE INTO runs VALUES ({', '.join('?' * 20)})", runs)
+            conn.executemany("INSERT INTO run_tool_calls VALUES (?, ?, ?, ?, ?, ?, ?, ?)", tool_rows)
+
+    # ====== QUERY API ======
+
+    def _query(self, sql: str, params: tuple = ()) -> List[dict]:
+        if not self.enabled:
+            return []
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute(sql, params)]
+
+    @staticmethod
+    def _since(hours: Optional[float]) -> float:
+        return time.time() - hours * 3600 if hours else 0.0
+
+    def slowest_runs(self, limit: int = 20, since_hours: Optional[float] = None, path: Optional[str] = None) -> List[dict]:
+        sql = """SELECT run_id, ticket_id, priority, category, path, stream, outcome, error, started_at,
+                        duration_ms, llm_calls, llm_ms, tool_ms, prompt_tokens, completion_tokens,
+                        cached_tokens, models, tool_sequence, steps
+                 FROM runs WHERE started_at >= ?"""
+        params: tuple = (self._since(since_hours),)
+        if path:
+            sql += " AND path = ?"
+            params += (path,)
+        rows = self._query(sql + " ORDER BY duration_ms DESC LIMIT ?", params + (limit,))
+        for row in rows:
+            row["steps"] = json.loads(row["steps"] or "[]")
+        return rows
+
+    def tool_sequences(self, limit: int = 20, since_hours: Optional[float] = None) -> List[dict]:
+        """Most frequent tool call sequences and what they cost"""
+        return self._query(
+            """SELECT tool_sequence, COUNT(*) AS runs, ROUND(AVG(duration_ms), 1) AS avg_duration_ms,
+                      ROUND(AVG(tool_ms), 1) AS avg_tool_ms, ROUND(AVG(llm_calls), 2) AS avg_llm_calls,
+                      ROUND(AVG(prompt_tokens + completion_tokens), 0) AS avg_tokens
+               FROM runs WHERE started_at >= ?
+               GROUP BY tool_sequence ORDER BY runs DESC LIMIT ?""",
+            (self._since(since_hours), limit),
+        )
+
+    def cache_opportunities(self, limit: int = 20, since_hours: Optional[float] = None) -> dict:
+        """Work repeated across runs: identical tool calls, regenerated tickets, prompt cache misses"""
+        since = self._since(since_hours)
+        repeated_tools = self._query(
+            """SELECT t.tool_name, t.input_hash, MIN(t.input_preview) AS input_preview,
+                      COUNT(*) AS calls, COUNT(DISTINCT t.run_id) AS runs,
+                      ROUND(SUM(t.duration_ms), 1) AS total_ms,
+                      ROUND(SUM(t.duration_ms) - SUM(t.duration_ms) / COUNT(*), 1) AS saveable_ms
+               FROM run_tool_calls t JOIN runs r ON r.run_id = t.run_id
+               WHERE t.cached = 0 AND r.started_at >= ?
+               GROUP BY t.tool_name, t.input_hash HAVING COUNT(*) > 1
+               ORDER BY saveable_ms DESC LIMIT ?""",
+            (since, limit),
+        )
+        repeated_tickets = self._query(
+            """SELECT ticket_hash, MIN(ticket_id) AS ticket_id, COUNT(*) AS runs,
+                      ROUND(SUM(duration_ms), 1) AS total_ms, SUM(path = 'prefetched') AS prefetched_runs
+               FROM runs WHERE started_at >= ?
+               GROUP BY ticket_hash HAVING COUNT(*) > 1 ORDER BY total_ms DESC LIMIT ?""",
+            (since, limit),
+        )
+        prompt_cache = self._query(
+            """SELECT models, COUNT(*) AS runs, SUM(prompt_tokens) AS prompt_tokens, SUM(cached_tokens) AS cached_tokens,
+                      ROUND(1.0 * SUM(cached_tokens) / MAX(SUM(prompt_tokens), 1), 4) AS cache_hit_ratio
+               FROM runs WHERE started_at >= ? GROUP BY models ORDER BY prompt_tokens DESC""",
+            (since,),
+        )
+        return {"repeated_tool_calls": repeated_tools, "repeated_tickets": repeated_tickets, "prompt_cache": prompt_cache}
+
+    def llm_calls_by_role(self, since_hours: Optional[float] = None) -> List[dict]:
+        """Per successful multi-agent run: category and LLM calls per agent role (step budget history)"""
+        rows = self._query(
+            """SELECT category, steps FROM runs
+               WHERE started_at >= ? AND outcome = 'success' AND path IN ('agent', 'fallback')""",
+            (self._since(since_hours),),
+        )
+        # Route labels are `role@priority` (see ModelRouter.client_for)
+        return [
+            {"category": row["category"], "calls": dict(Counter(step["route"].split("@")[0] for step in json.loads(row["steps"] or "[]")))}
+            for row in rows
+        ]
+
+    def summary(self, since_hours: Optional[float] = 24) -> dict:
+        """Per path/priority volume, latency percentiles, error rate and tokens (capacity planning)"""
+        rows = self._query(
+            """SELECT path, priority, outcome, started_at, duration_ms, llm_calls, prompt_tokens, completion_tokens
+               FROM runs WHERE started_at >= ?""",
+            (self._since(since_hours),),
+        )
+        groups: Dict[str, List[dict]] = {}
+        for row in rows:
+            groups.setdefault(f"{row['path']}@{row['priority']}", []).append(row)
+        span_hours = since_hours or max(
+            (max(r["started_at"] for r in rows) - min(r["started_at"] for r in rows)) / 3600 if rows else 0, 1 / 60
+        )
+        result = {}
+        for key, group in sorted(groups.items()):
+            durations = [r["duration_ms"] for r in group]
+            result[key] = {
+                "runs": len(group),
+                "runs_per_hour": round(len(group) / span_hours, 2),
+                "errors": sum(1 for r in group if r["outcome"] != "success"),
+                "duration_p50_ms": round(_percentile(durations, 0.50), 1),
+                "duration_p95_ms": round(_percentile(durations, 0.95), 1),
+                "avg_llm_calls": round(sum(r["llm_calls"] for r in group) / len(group), 2),
+                "avg_tokens": round(sum(r["prompt_tokens"] + r["completion_tokens"] for r in group) / len(group)),
+            }
+        return {"since_hours": since_hours, "runs": len(rows), "groups": result, "ledger": self.stats()}
+
+    def stats(self) -> dict:
+        return {"path": self.path, "pending": self._queue.qsize(), **self._counters}
@@ -0,0 +1,271 @@
+"""
+Priority-aware admission scheduler in front of RAGEngine.
+
+Every generate request asks for a slot with its Ticket.priority. Slots are handed out by:
+- per-priority reservations: `reservations["critical"] = 1` keeps one slot free for critical
+  tickets even when the medium backlog could fill every slot;
+- weighted fair sharing (stride scheduling) among the queues that can be served, so a
+  critical backlog gets `weights` times more slots than a medium one but never all of them;
+- aging: for every `aging_seconds` the head of a queue waits, the queue is credited one
+  stride of its class (as if served once less) and the request is promoted one class (its
+  stride then advances by the weight of the promoted class), so medium tickets cannot starve
+  behind a steady stream of critical ones.
+
+Queue-time metrics per priority (p50/p95/max and SLO attainment) are exposed by stats().
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from pydantic import BaseModel
+
+PRIORITIES = ("critical", "high", "medium")
+DEFAULT_PRIORITY = "medium"
+
+
+def _parse_map(value: str, cast=float) -> Dict[str, float]:
+    """'critical=8,high=3,medium=1' -> {'critical': 8, 'high': 3, 'medium': 1}"""
+    result = {}
+    for part in value.split(","):
+        key, _, raw = part.partition("=")
+        if key.strip() and raw.strip():
+            result[key.strip()] = cast(raw.strip())
+    return result
+
+
+def _percentile(samples, q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class SchedulerSettings(BaseModel):
+    max_concurrency: int = 4
+    max_queue: int = 200  # Waiting requests (all priorities) before shedding with 503
+    weights: Dict[str, float] = {"critical": 8, "high": 3, "medium": 1}
+    reservations: Dict[str, int] = {"critical": 1}
+    aging_seconds: float = 30.0
+    slo_seconds: Dict[str, float] = {"critical": 5, "high": 30, "medium": 120}
+
+    @classmethod
+    def from_env(cls) -> "SchedulerSettings":
+        defaults = cls()
+        return cls(
+            max_concurrency=int(os.getenv("SCHEDULER_MAX_CONCURRENCY", defaults.max_concurrency)),
+            max_queue=int(os.getenv("SCHEDULER_MAX_QUEUE", defaults.max_queue)),
+            weights={**defaults.weights, **_parse_map(os.getenv("SCHEDULER_WEIGHTS", ""))},
+            reservations=(
+                _parse_map(os.environ["SCHEDULER_RESERVATIONS"], int)
+                if "SCHEDULER_RESERVATIONS" in os.environ else defaults.reservations
+            ),
+            aging_seconds=float(os.getenv("SCHEDULER_AGING_SECONDS", defaults.aging_seconds)),
+            slo_seconds={**defaults.slo_seconds, **_parse_map(os.getenv("SCHEDULER_SLO_SECONDS", ""))},
+        )
+
+
+class SchedulerQueueFull(Exception):
+    pass
+
+
+class Lease:
+    """A request's place in the scheduler: wait() for the slot, release() when done"""
+
+    def __init__(self, scheduler: "PriorityScheduler", priority: str):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self._granted = asyncio.get_running_loop().create_future()
+        self._released = False
+
+    @property
+    def admitted(self) -> bool:
+        return self.started_at is not None
+
+    @property
+    def queue_seconds(self) -> float:
+        return (self.started_at or time.monotonic()) - self.enqueued_at
+
+    def position(self) -> int:
+        """Requests waiting ahead of this one in its own queue (0 = next of its class)"""
+        queue = self.scheduler._queues[self.priority]
+        try:
+            return list(queue).index(self)
+        except ValueError:
+            return 0
+
+    async def wait(self):
+        try:
+            await asyncio.shield(self._granted)
+        except asyncio.CancelledError:
+            # Client gone while queued (or right after being admitted)
+            self.release()
+            raise
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self.scheduler._release(self)
+
+    async def __aenter__(self):
+        await self.wait()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+class PriorityScheduler:
+    def __init__(self, settings: Optional[SchedulerSettings] = None, sample_window: int = 500):
+        self.settings = settings or SchedulerSettings.from_env()
+        self._queues: Dict[str, Deque[Lease]] = {p: deque() for p in PRIORITIES}
+        self._running: Dict[str, int] = {p: 0 for p in PRIORITIES}
+        self._pass: Dict[str, float] = {p: 0.0 for p in PRIORITIES}  # Stride scheduling virtual time
+        self._queue_times: Dict[str, Deque[float]] = {p: deque(maxlen=sample_window) for p in PRIORITIES}
+        self._service_times: Dict[str, Deque[float]] = {p: deque(maxlen=sample_window) for p in PRIORITIES}
+        self._counters: Dict[str, Dict[str, int]] = {
+            p: {"admitted": 0, "completed": 0, "shed": 0, "cancelled": 0, "aged": 0} for p in PRIORITIES
+        }
+
+    # ====== PUBLIC API ======
+
+    def acquire(self, priority: Optional[str]) -> Lease:
+        """Enqueue a request (admitted immediately if a slot is free). Raises SchedulerQueueFull"""
+        priority = priority if priority in self._queues else DEFAULT_PRIORITY
+        if self.is_full:
+            self._counters[priority]["shed"] += 1
+            raise SchedulerQueueFull(f"Scheduler queue full ({self.settings.max_queue} waiting)")
+
+        lease = Lease(self, priority)
+        queue = self._queues[priority]
+        if not queue:
+            # An idle queue must not bank credit while it was empty
+            active = [self._pass[p] for p in PRIORITIES if self._queues[p]]
+            if active:
+                self._pass[priority] = max(self._pass[priority], min(active))
+        queue.append(lease)
+        self._dispatch()
+        return lease
+
+    def slot(self, priority: Optional[str]) -> Lease:
+        """`async with scheduler.slot(ticket.priority): ...`"""
+        return self.acquire(priority)
+
+    @property
+    def is_full(self) -> bool:
+        return self.queued >= self.settings.max_queue
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    @property
+    def running(self) -> int:
+        return sum(self._running.values())
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        priorities = {}
+        for p in PRIORITIES:
+            queue_times = list(self._queue_times[p])
+            slo = self.settings.slo_seconds.get(p)
+            priorities[p] = {
+                "queued": len(self._queues[p]),
+                "running": self._running[p],
+                "reserved_slots": self.settings.reservations.get(p, 0),
+                "weight": self.settings.weights.get(p, 1),
+                **self._counters[p],
+                "oldest_wait_seconds": round(now - self._queues[p][0].enqueued_at, 3) if self._queues[p] else 0.0,
+                "queue_time_p50": round(_percentile(queue_times, 0.50), 3),
+                "queue_time_p95": round(_percentile(queue_times, 0.95), 3),
+                "queue_time_max": round(max(queue_times), 3) if queue_times else 0.0,
+                "service_time_p50": round(_percentile(list(self._service_times[p]), 0.50), 3),
+                "slo_seconds": slo,
+                "slo_met_ratio": (
+                    round(sum(1 for t in queue_times if t <= slo) / len(queue_times), 4)
+                    if queue_times and slo is not None else None
+                ),
+            }
+        return {
+            "max_concurrency": self.settings.max_concurrency,
+            "running": self.running,
+            "queued": self.queued,
+            "aging_seconds": self.settings.aging_seconds,
+            "priorities": priorities,
+        }
+
+    # ====== DISPATCH ======
+
+    def _effective_rank(self, lease: Lease, now: float) -> int:
+        """0 = critical; waiting promotes one class every aging_seconds"""
+        rank = PRIORITIES.index(lease.priority)
+        if self.settings.aging_seconds > 0:
+            rank -= int((now - lease.enqueued_at) // self.settings.aging_seconds)
+        return max(rank, 0)
+
+    def _aged_pass(self, priority: str, lease: Lease, now: float) -> float:
+        """Stride pass of a queue, minus one stride of its class per aging_seconds its head has waited"""
+        aged = self._pass[priority]
+        if self.settings.aging_seconds > 0:
+            periods = (now - lease.enqueued_at) // self.settings.aging_seconds
+            aged -= periods / (self.settings.weights.get(priority, 1) or 1)
+        return aged
+
+    def _can_start(self, priority: str) -> bool:
+        """Free slot for `priority`, without eating into other priorities' unused reservations"""
+        free = self.settings.max_concurrency - self.running
+        if free <= 0:
+            return False
+        if self._running[priority] < self.settings.reservations.get(priority, 0):
+            return True
+        held_back = sum(
+            max(0, self.settings.reservations.get(p, 0) - self._running[p])
+            for p in PRIORITIES if p != priority
+        )
+        return free > held_back
+
+    def _dispatch(self):
+        while True:
+            now = time.monotonic()
+            candidates = []
+            for p in PRIORITIES:
+                queue = self._queues[p]
+                # Drop leases whose client went away before being admitted
+                while queue and queue[0]._released:
+                    queue.popleft()
+                if queue and self._can_start(p):
+                    rank = self._effective_rank(queue[0], now)
+                    candidates.append((self._aged_pass(p, queue[0], now), rank, queue[0].enqueued_at, p))
+            if not candidates:
+                return
+
+            _, rank, _, priority = min(candidates)
+            lease = self._queues[priority].popleft()
+            # Stride: the served queue advances by 1/weight of its (aged) class
+            weight = self.settings.weights.get(PRIORITIES[rank], 1) or 1
+            self._pass[priority] += 1.0 / weight
+            if rank < PRIORITIES.index(priority):
+                self._counters[priority]["aged"] += 1
+
+            lease.started_at = now
+            self._running[priority] += 1
+            self._counters[priority]["admitted"] += 1
+            self._queue_times[priority].append(lease.queue_seconds)
+            lease._granted.set_result(None)
+
+    def _release(self, lease: Lease):
+        if lease.admitted:
+            self._running[lease.priority] -= 1
+            self._counters[lease.priority]["completed"] += 1
+            self._service_times[lease.priority].append(time.monotonic() - lease.started_at)
+        else:
+            self._counters[lease.priority]["cancelled"] += 1
+            try:
+                self._queues[lease.priority].remove(lease)
+            except ValueError:
+                pass
+        self._dispatch()
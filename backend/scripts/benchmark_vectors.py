@@ -0,0 +1,186 @@
+"""
+Recall vs memory benchmark for the Qdrant collection settings.
+
+Builds one temporary collection per settings profile, runs the same queries on
+each of them and compares recall@k (against exact full-precision search) with the
+estimated RAM per million vectors.
+
+Usage:
+    python backend/scripts/benchmark_vectors.py                 # real ticket/manual embeddings
+    python backend/scripts/benchmark_vectors.py --synthetic 20000
+
+Quantization and HNSW settings are only honoured by a Qdrant server (QDRANT_URL):
+with the in-memory store every profile runs as exact full-precision search.
+"""
+import argparse
+import os
+import pathlib
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import numpy as np
+from qdrant_client import models as qmodels
+
+from rag_engine import RAGEngine
+from vector_settings import CollectionSettings, EMBEDDING_MAX_DIMENSIONS
+
+PROFILES = {
+    "baseline": CollectionSettings(),
+    "scalar": CollectionSettings(quantization="scalar"),
+    "scalar_on_disk": CollectionSettings(quantization="scalar", on_disk=True),
+    "binary_on_disk": CollectionSettings(quantization="binary", on_disk=True, oversampling=3.0),
+    "binary_512_on_disk": CollectionSettings(dimensions=512, quantization="binary", on_disk=True, oversampling=3.0),
+    "scalar_512_on_disk": CollectionSettings(dimensions=512, quantization="scalar", on_disk=True),
+}
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def load_real_vectors(engine: RAGEngine) -> tuple[np.ndarray, np.ndarray]:
+    """Embed knowledge base paragraphs + past tickets (documents) and ticket subjects (queries)"""
+    import json
+
+    texts = []
+    for txt_file in pathlib.Path(root_dir, "data", "knowledge_base").glob("*.txt"):
+        texts += [p.strip() for p in txt_file.read_text(encoding="utf-8").split("\n\n") if len(p.strip()) >= 20]
+    tickets = json.loads(pathlib.Path(root_dir, "data", "past_tickets.json").read_text(encoding="utf-8"))
+    texts += [RAGEngine.ticket_chunk_text(t) for t in tickets]
+    queries = [t["subject"] for t in tickets] + [t["message"][:200] for t in tickets]
+
+    # Always embed at full size: reduced profiles are derived by truncation
+    engine.embedder.dimensions = None
+    docs = np.array(engine.embedder.embed(texts), dtype=np.float32)
+    qs = np.array(engine.embedder.embed(queries), dtype=np.float32)
+    return docs, qs
+
+
+def make_synthetic_vectors(n_docs: int, n_queries: int, seed: int = 42) -> tuple[np.ndarray, np.ndarray]:
+    """Clustered random vectors (tickets cluster by topic, pure noise would flatter quantization).
+
+    Synthetic vectors are not Matryoshka-trained: recall of the reduced-dimension
+    profiles is only meaningful on real embeddings.
+    """
+    rng = np.random.default_rng(seed)
+    n_clusters = max(8, n_docs // 200)
+    centers = rng.normal(size=(n_clusters, EMBEDDING_MAX_DIMENSIONS)).astype(np.float32)
+    labels = rng.integers(0, n_clusters, size=n_docs)
+    docs = centers[labels] + 0.6 * rng.normal(size=(n_docs, EMBEDDING_MAX_DIMENSIONS)).astype(np.float32)
+    picked = rng.integers(0, n_docs, size=n_queries)
+    queries = docs[picked] + 0.4 * rng.normal(size=(n_queries, EMBEDDING_MAX_DIMENSIONS)).astype(np.float32)
+    return _normalize(docs), _normalize(queries)
+
+
+def reduce_dimensions(matrix: np.ndarray, dims: int) -> np.ndarray:
+    """Matryoshka-style truncation + re-normalization (what `dimensions=` does server side)"""
+    if dims >= matrix.shape[1]:
+        return matrix
+    return _normalize(matrix[:, :dims].copy())
+
+
+def ground_truth(docs: np.ndarray, queries: np.ndarray, k: int) -> list[set]:
+    scores = _normalize(queries) @ _normalize(docs).T
+    return [set(np.argsort(-row)[:k].tolist()) for row in scores]
+
+
+def run_profile(engine: RAGEngine, name: str, settings: CollectionSettings, docs: np.ndarray,
+                queries: np.ndarray, truth: list[set], k: int) -> dict:
+    client = engine.vectorstore.get_client()
+    collection = f"bench_{name}_{uuid.uuid4().hex[:6]}"
+    engine.collection_settings = settings
+    engine._ensure_collection_exists(collection)
+
+    try:
+        doc_vectors = reduce_dimensions(docs, settings.dimensions)
+        query_vectors = reduce_dimensions(queries, settings.dimensions)
+        for start in range(0, len(doc_vectors), 256):
+            batch = doc_vectors[start:start + 256]
+            client.upsert(
+                collection_name=collection,
+                points=[
+                    qmodels.PointStruct(id=start + i, vector={engine.vector_name: v.tolist()}, payload={})
+                    for i, v in enumerate(batch)
+                ],
+                wait=True
+            )
+
+        hits = 0
+        latencies = []
+        for q, expected in zip(query_vectors, truth):
+            started = time.perf_counter()
+            result = client.query_points(
+                collection_name=collection,
+                query=q.tolist(),
+                using=engine.vector_name,
+                limit=k,
+                search_params=settings.search_params()
+            )
+            latencies.append((time.perf_counter() - started) * 1000)
+            hits += len(expected & {p.id for p in result.points})
+
+        per_vector = settings.estimate_bytes_per_vector()
+        return {
+            "profile": name,
+            "settings": settings.describe(),
+            "recall": hits / (len(truth) * k),
+            "ram_per_million_mb": per_vector["ram"] * 1_000_000 / 2**20,
+            "disk_per_million_mb": per_vector["disk"] * 1_000_000 / 2**20,
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+        }
+    finally:
+        client.delete_collection(collection)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall vs memory benchmark for Qdrant collection settings")
+    parser.add_argument("--synthetic", type=int, default=0, help="Use N synthetic vectors instead of the real corpus")
+    parser.add_argument("--queries", type=int, default=200, help="Number of synthetic queries")
+    parser.add_argument("-k", type=int, default=3, help="top_k used by the RAG tools")
+    parser.add_argument("--profiles", default=",".join(PROFILES), help="Comma separated profile names")
+    args = parser.parse_args()
+
+    print("=" * 50)
+    print("QDRANT RECALL vs MEMORY BENCHMARK")
+    print("=" * 50)
+
+    engine = RAGEngine()
+    if not os.getenv("QDRANT_URL"):
+        print("⚠️  QDRANT_URL not set: in-memory Qdrant ignores quantization/HNSW, recall will be exact.")
+
+    if args.synthetic:
+        docs, queries = make_synthetic_vectors(args.synthetic, args.queries)
+    else:
+        docs, queries = load_real_vectors(engine)
+    print(f"📊 {len(docs)} documents, {len(queries)} queries, k={args.k}\n")
+
+    truth = ground_truth(docs, queries, args.k)
+    rows = []
+    for name in [p.strip() for p in args.profiles.split(",") if p.strip()]:
+        print(f"   ⏱️  {name}...")
+        rows.append(run_profile(engine, name, PROFILES[name], docs, queries, truth, args.k))
+
+    baseline_ram = PROFILES["baseline"].estimate_bytes_per_vector()["ram"]
+    print(f"\n{'profile':<22}{'recall@k':>10}{'RAM/1M':>12}{'disk/1M':>12}{'x tickets':>11}{'p50 ms':>9}{'p95 ms':>9}")
+    for row in rows:
+        ram_per_vector = row["ram_per_million_mb"] * 2**20 / 1_000_000
+        capacity = baseline_ram / ram_per_vector if ram_per_vector else float("inf")
+        print(
+            f"{row['profile']:<22}{row['recall']:>10.3f}{row['ram_per_million_mb']:>10.0f}MB"
+            f"{row['disk_per_million_mb']:>10.0f}MB{capacity:>10.1f}x{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}"
+        )
+    print("\n'x tickets' = how many more points fit in the same RAM compared to the baseline.")
+
+
+if __name__ == "__main__":
+    main()
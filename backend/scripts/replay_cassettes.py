@@ -0,0 +1,127 @@
+"""
+Replay recorded ticket runs (cassettes) as an offline benchmark / regression test.
+
+Record real traffic first (CASSETTE_MODE=record CASSETTE_DIR=cassettes uvicorn main:app ...),
+then replay it with no network:
+
+    python backend/scripts/replay_cassettes.py --dir cassettes --latency zero
+    python backend/scripts/replay_cassettes.py --latency original --concurrency 4 --stream
+
+With --latency zero the wall time of a run is our own overhead (prompt building,
+parsing, SSE plumbing, serialization); with original timings it approximates the
+production latency of the recorded mix. Exits with 1 on cassette misses, errors or
+answers that differ from the recorded ones (usable as a CI gate).
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+
+def _percentile(samples, q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def replay_one(engine, cassette, stream: bool) -> dict:
+    from models import Ticket
+
+    meta = cassette.meta
+    ticket = Ticket(**meta["ticket"])
+    # Base64 images were recorded by their content id: the same id re-issues the same requests
+    kwargs = {
+        "regeneration_feedback": meta.get("regeneration_feedback"),
+        "image_id": meta.get("image_id"),
+    }
+    started = time.perf_counter()
+    answer, error = None, None
+    try:
+        if stream:
+            async def consume():
+                final, failure = None, None
+                async for event in engine.generate_response_stream(ticket, **kwargs):
+                    if event.get("type") == "complete":
+                        final = event["response"]["suggested_response"]
+                    elif event.get("type") == "error":
+                        failure = event.get("message")
+                return final, failure
+            answer, error = asyncio.run(consume())
+        else:
+            answer = engine.generate_response(ticket, **kwargs).final_response
+    except Exception as e:
+        error = str(e)
+    return {
+        "name": cassette.name,
+        "wall": time.perf_counter() - started,
+        "recorded_run": meta.get("run_seconds", 0.0),
+        "recorded_calls": cassette.recorded_seconds,
+        "error": error,
+        "changed": error is None and "final_response" in meta and answer != meta["final_response"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded ticket runs without network")
+    parser.add_argument("--dir", default=os.getenv("CASSETTE_DIR", "cassettes"), help="Cassette directory")
+    parser.add_argument("--latency", default="zero", help="zero | original | scale factor (e.g. 0.5)")
+    parser.add_argument("--stream", action="store_true", help="Replay through generate_response_stream")
+    parser.add_argument("--concurrency", type=int, default=1, help="Runs replayed in parallel")
+    parser.add_argument("--repeat", type=int, default=1, help="Replay the whole set N times")
+    parser.add_argument("--strict", action="store_true", help="Fail on any request that differs from the recording")
+    args = parser.parse_args()
+
+    # The engine reads its cassette settings from the environment
+    os.environ["CASSETTE_MODE"] = "replay"
+    os.environ["CASSETTE_DIR"] = args.dir
+    os.environ["CASSETTE_LATENCY"] = args.latency
+    os.environ["CASSETTE_STRICT"] = "true" if args.strict else "false"
+
+    from cassettes import Cassette
+    from rag_engine import RAGEngine
+
+    paths = sorted(Path(args.dir).glob("*.json.gz"))
+    if not paths:
+        print(f"❌ No cassettes in {args.dir}")
+        sys.exit(1)
+    cassettes = [Cassette.load(p) for p in paths] * args.repeat
+
+    print("=" * 50)
+    print("CASSETTE REPLAY")
+    print("=" * 50)
+    print(f"📼 {len(paths)} cassettes x{args.repeat}, latency={args.latency}, concurrency={args.concurrency}, stream={args.stream}\n")
+
+    engine = RAGEngine()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda c: replay_one(engine, c, args.stream), cassettes))
+    total = time.perf_counter() - started
+
+    print(f"\n{'cassette':<28}{'wall ms':>10}{'recorded ms':>13}{'LLM/IO ms':>11}  status")
+    for r in results:
+        status = f"ERROR: {r['error'][:60]}" if r["error"] else ("CHANGED" if r["changed"] else "ok")
+        print(f"{r['name']:<28}{r['wall'] * 1000:>10.1f}{r['recorded_run'] * 1000:>13.1f}{r['recorded_calls'] * 1000:>11.1f}  {status}")
+
+    walls = [r["wall"] * 1000 for r in results if not r["error"]]
+    stats = engine.cassettes.stats()
+    print(f"\nwall p50 {_percentile(walls, 0.5):.1f} ms | p95 {_percentile(walls, 0.95):.1f} ms | "
+          f"{len(results) / total:.2f} runs/s")
+    print(f"misses {stats['misses']} | inexact matches {stats['fuzzy_hits']} | missing cassettes {stats['missing']}")
+    if args.latency == "zero":
+        print("(latency=zero: wall time is the engine's own overhead)")
+
+    failed = sum(1 for r in results if r["error"] or r["changed"]) + stats["misses"]
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,9 @@ import sys
 # Add backend to path to allow running from root or backend/scripts
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from ticket_inbox import INBOX_TABLE_SQL, INBOX_INDEX_SQL
+from child_dossier import ChildDossier
+
 def setup_db():
     print("=" * 50)
     print("NORTH POLE DATABASE SETUP")
@@ -24,6 +27,7 @@ def setup_db():
     print("\n🗑️  Dropping existing tables...")
     cursor.execute("DROP TABLE IF EXISTS children_log")
     cursor.execute("DROP TABLE IF EXISTS inventory")
+    # NB: ticket_inbox is NOT dropped, it holds real incoming tickets
 
     # 2. CREATE SCHEMA
     print("🏗️  Creating schema...")
@@ -51,6 +55,10 @@ def setup_db():
     )
     ''')
     
+    # ticket_inbox (open tickets shown in the console, examples live in data/example_tickets.json)
+    cursor.execute(INBOX_TABLE_SQL)
+    cursor.execute(INBOX_INDEX_SQL)
+    
     # 3. POPULATE DATA
     print("📥 Populating data...")
     
@@ -162,8 +170,16 @@ def setup_db():
     print(f"   - Children Count: {cursor.fetchone()[0]}")
     cursor.execute("SELECT COUNT(*) FROM inventory")
     print(f"   - Inventory Count: {cursor.fetchone()[0]}")
+    cursor.execute("SELECT COUNT(*) FROM ticket_inbox WHERE status = 'open'")
+    print(f"   - Open Inbox Tickets: {cursor.fetchone()[0]}")
     
     conn.close()
+
+    # 5. CHILD DOSSIER (children_log + matched inventory item, kept in sync by triggers)
+    from sqlalchemy import create_engine
+    print("\n🗂️  Building child dossier...")
+    ChildDossier(create_engine(f"sqlite:///{db_path}")).install()
+    print("   - Dossier ready (updated incrementally on children_log/inventory changes)")
     print("\n✅ Database setup complete!")
 
 if __name__ == "__main__":
@@ -1,7 +1,18 @@
 """
 Script to setup the RAG Vector Store.
-Indexes both knowledge base manuals and past tickets.
+Indexes both knowledge base manuals (.txt, .md, .html, .pdf) and past tickets.
+
+Every run builds a new version of each collection (`northpole_manuals_v{n}`,
+`northpole_tickets_v{n}`) while the server keeps answering from the current one,
+validates it (point count + recall smoke test) and then swaps the alias the
+RAG engine queries atomically. Safe to run against a live deployment.
+
+Usage:
+    python backend/scripts/setup_rag.py                    # re-index both collections
+    python backend/scripts/setup_rag.py --only tickets --keep 2
+    python backend/scripts/setup_rag.py --rollback         # serve the previous versions again
 """
+import argparse
 import os
 import sys
 import json
@@ -19,112 +30,145 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from rag_engine import RAGEngine
-from datapizza.type import Chunk, DenseEmbedding
+from collection_versions import ReindexValidationError
+from ingestion import KnowledgeBaseIngestor
+from datapizza.type import Chunk
 from datapizza.embedders import ChunkEmbedder
-from datapizza.modules.splitters import RecursiveSplitter
-from datapizza.modules.parsers.text_parser import parse_text
+
+def load_manual_batches(ingestor: KnowledgeBaseIngestor):
+    """Manual chunks in batches, streamed while the process pool is still splitting other files"""
+    kb_dir = pathlib.Path(root_dir, "data", "knowledge_base")
+    if not kb_dir.exists():
+        print(f"❌ Knowledge base path not found: {kb_dir}")
+        return
+    print(f"   📄 {len(ingestor.discover(kb_dir))} files, {ingestor.workers} workers")
+    yield from ingestor.iter_chunk_batches(kb_dir)
+
+
+def load_ticket_chunks() -> list:
+    tickets_path = os.path.join(root_dir, "data", "past_tickets.json")
+    if not os.path.exists(tickets_path):
+        print(f"❌ Tickets file not found: {tickets_path}")
+        return []
+
+    with open(tickets_path, 'r', encoding='utf-8') as f:
+        tickets_data = json.load(f)
+
+    # Create rich representation + filterable payload (category, priority, ...)
+    return [
+        Chunk(
+            id=str(uuid.uuid4()),
+            text=RAGEngine.ticket_chunk_text(ticket),
+            metadata=RAGEngine.ticket_chunk_metadata(ticket)
+        )
+        for ticket in tickets_data
+    ]
+
+
+def reindex(engine: RAGEngine, alias: str, batches, chunk_embedder, args) -> bool:
+    """Build `{alias}_v{n+1}` from the chunk batches, validate it, then swap the alias onto it.
+
+    False if nothing was swapped.
+    """
+    versions = engine.collection_versions()
+    target = versions.next_name(alias)
+    print(f"   📦 Building '{target}' (serving: {versions.resolve(alias) or 'nothing'})")
+    engine._ensure_collection_exists(target)
+
+    added = 0
+    for batch in batches:
+        if not batch:
+            continue
+        print(f"   🧠 Embedding {len(batch)} chunks (batch)...")
+        embedded = chunk_embedder.embed(batch)
+        engine.vectorstore.add(embedded, collection_name=target)
+        added += len(embedded)
+    if not added:
+        print(f"   ⚠️ No content for '{alias}': not swapped.")
+        engine.vectorstore.get_client().delete_collection(target)
+        return False
+
+    try:
+        report = versions.validate(
+            target,
+            expected_points=added,
+            min_recall=args.min_recall,
+            search_params=engine.collection_settings.search_params()
+        )
+    except ReindexValidationError as e:
+        # The alias still points at the previous version: the server never sees the broken one
+        print(f"   ❌ {e} - '{alias}' not swapped ('{target}' kept for inspection)")
+        return False
+    print(f"   🔎 Smoke test: {report['points']} points, recall@{report['k']} = {report['recall']}")
+
+    previous = versions.swap(alias, target)
+    print(f"   🔀 '{alias}' -> '{target}'" + (f" (was '{previous}')" if previous else ""))
+    dropped = versions.prune(alias, keep=args.keep)
+    if dropped:
+        print(f"   🗑️  Dropped old versions: {', '.join(dropped)}")
+    return True
+
+
+def rollback(engine: RAGEngine, aliases: list):
+    versions = engine.collection_versions()
+    for alias in aliases:
+        target = versions.rollback(alias)
+        print(f"   🔀 '{alias}' -> '{target}'" if target else f"   ⚠️ No previous version of '{alias}'")
+
 
 def setup_rag():
+    parser = argparse.ArgumentParser(description="Build, validate and swap in new versions of the RAG collections")
+    parser.add_argument("--only", choices=["manuals", "tickets"], help="Re-index a single collection")
+    parser.add_argument("--keep", type=int, default=1, help="Previous versions kept for rollback")
+    parser.add_argument("--min-recall", type=float, default=float(os.getenv("REINDEX_MIN_RECALL", "0.9")),
+                        help="Minimum self-recall@3 of the smoke test required to swap")
+    parser.add_argument("--rollback", action="store_true", help="Serve the previous versions again and exit")
+    args = parser.parse_args()
+
     print("=" * 50)
     print("NORTH POLE RAG SETUP")
     print("=" * 50)
     
     print("\n🔧 Initializing RAG Engine...")
     engine = RAGEngine()
+    print(f"   ⚙️  Collection settings: {engine.collection_settings.describe()}")
+    if engine.vectorstore.kwargs.get("location") == ":memory:":
+        print("   ⚠️ QDRANT_URL not set: the in-memory store only lives as long as this script")
+
+    aliases = {"manuals": engine.kb_collection, "tickets": engine.tickets_collection}
+    if args.only:
+        aliases = {args.only: aliases[args.only]}
+
+    if args.rollback:
+        print("\n⏪ Rolling back...")
+        rollback(engine, list(aliases.values()))
+        return
     
     # Initialize helpers for better ingestion
-    chunk_embedder = ChunkEmbedder(client=engine.embedder)
-    splitter = RecursiveSplitter(max_char=1000, overlap=100)
+    chunk_embedder = ChunkEmbedder(client=engine.embedder, embedding_name=engine.vector_name)
+    # Parsing/splitting in a process pool, cached by content hash + splitter settings
+    ingestor = KnowledgeBaseIngestor.from_env(
+        default_cache_path=os.path.join(root_dir, "data", "chunk_cache.db"), max_char=1000, overlap=100
+    )
     
     # 1. INDEX KNOWLEDGE BASE
-    print("\n📚 Indexing Knowledge Base...")
-    kb_path = os.path.join(root_dir, "data", "knowledge_base")
-    kb_dir = pathlib.Path(kb_path)
-    
-    if not kb_dir.exists():
-        print(f"❌ Knowledge base path not found: {kb_path}")
-    else:
-        # Ensure collection
-        engine._ensure_collection_exists(engine.kb_collection)
-        all_kb_chunks = []
-        
-        for txt_file in kb_dir.glob("*.txt"):
-            print(f"   📄 Processing: {txt_file.name}")
-            content = txt_file.read_text(encoding="utf-8")
-            
-            # Use TextParser + RecursiveSplitter for robust chunking
-            doc_node = parse_text(content, metadata={"source": txt_file.name})
-            chunks = splitter.split(doc_node)
-            
-            # Convert to Datapizza Chunk objects
-            for i, c in enumerate(chunks):
-                # Ensure we have a string content
-                text = c.text if hasattr(c, 'text') else str(c)
-                chunk_obj = Chunk(
-                    id=str(uuid.uuid4()),
-                    text=text,
-                    metadata={"source": txt_file.name, "chunk_index": i}
-                )
-                all_kb_chunks.append(chunk_obj)
-        
-        if all_kb_chunks:
-            print(f"   🧠 Embedding {len(all_kb_chunks)} chunks (batch)...")
-            # Batch embedding using ChunkEmbedder
-            embedded_chunks = chunk_embedder.embed(all_kb_chunks)
-            
-            # Add to vectorstore (fix: manually map embeddings if needed or if add supports chunks with embeddings directly)
-            # QdrantVectorstore.add expects chunks with embeddings
-            engine.vectorstore.add(embedded_chunks, collection_name=engine.kb_collection)
-            print(f"   ✅ Added {len(embedded_chunks)} manual chunks.")
-        else:
-            print("   ⚠️ No knowledge base content found.")
+    if "manuals" in aliases:
+        print("\n📚 Indexing Knowledge Base...")
+        reindex(engine, engine.kb_collection, load_manual_batches(ingestor), chunk_embedder, args)
+        stats = ingestor.describe()
+        print(f"   🗂️  {stats['files']} files: {stats['cached']} from chunk cache, {stats['split']} split, {stats['failed']} failed")
 
     # 2. INDEX PAST TICKETS
-    print("\n🎫 Indexing Past Tickets...")
-    tickets_path = os.path.join(root_dir, "data", "past_tickets.json")
-    
-    if not os.path.exists(tickets_path):
-        print(f"❌ Tickets file not found: {tickets_path}")
-    else:
-        engine._ensure_collection_exists(engine.tickets_collection)
-        
+    if "tickets" in aliases:
+        print("\n🎫 Indexing Past Tickets...")
         try:
-            with open(tickets_path, 'r', encoding='utf-8') as f:
-                tickets_data = json.load(f)
-            
-            all_ticket_chunks = []
-            
-            for ticket in tickets_data:
-                # Create rich representation
-                text_content = (
-                    f"TICKET ID: {ticket.get('id')}\n"
-                    f"SUBJECT: {ticket.get('subject')}\n"
-                    f"ISSUE: {ticket.get('message')}\n"
-                    f"RESOLUTION: {ticket.get('response')}\n"
-                    f"TAGS: {', '.join(ticket.get('tags', []))}"
-                )
-                
-                chunk_obj = Chunk(
-                    id=str(uuid.uuid4()),
-                    text=text_content,
-                    metadata={
-                        "source": "past_tickets_json",
-                        "ticket_id": ticket.get('id'),
-                        "category": ticket.get('category')
-                    }
-                )
-                all_ticket_chunks.append(chunk_obj)
-            
-            if all_ticket_chunks:
-                print(f"   🧠 Embedding {len(all_ticket_chunks)} tickets (batch)...")
-                embedded_ticket_chunks = chunk_embedder.embed(all_ticket_chunks)
-                engine.vectorstore.add(embedded_ticket_chunks, collection_name=engine.tickets_collection)
-                print(f"   ✅ Added {len(embedded_ticket_chunks)} tickets.")
-            
+            reindex(engine, engine.tickets_collection, [load_ticket_chunks()], chunk_embedder, args)
         except Exception as e:
             print(f"❌ Error indexing tickets: {e}")
 
     print("\n✅ RAG Setup complete!")
+    for description in engine.describe_collections():
+        print(f"   {description['alias']} -> {description['serving']}")
 
     # Test Search
     print("\n🔎 Verification Search (Manuals): 'sleeve'")
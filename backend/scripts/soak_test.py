@@ -0,0 +1,224 @@
+"""
+Soak test: tens of thousands of tickets through both generate endpoints, offline, failing
+when memory keeps growing.
+
+    python backend/scripts/soak_test.py --tickets 20000 --concurrency 8
+    python backend/scripts/soak_test.py --fake replay --dir cassettes --tickets 50000
+    python backend/scripts/soak_test.py --tickets 5000 --tracemalloc   # + top allocation sites
+
+The app runs in-process (FastAPI TestClient, startup included) with offline fakes, so no
+OpenAI or Qdrant server is needed:
+
+- degraded (default): DEGRADED_MODE=always, every ticket takes the LLM-free pipeline (entity
+  extraction, child dossier, past ticket match, template email). It exercises everything
+  around the LLM: request parsing, base64 images, scheduler, SSE stream runs and their
+  threads, run ledger, in-memory Qdrant. Ticket ids are made unique per request.
+- replay: recorded cassettes (see replay_cassettes.py) replay the full multi-agent runs with
+  zero latency; tickets are the recorded ones, unchanged (cassettes are found by ticket).
+
+RSS is sampled (after a gc) every --sample-every tickets. After --warmup tickets the test
+fails (exit 1) if RSS grew more than --max-growth-mb, if the growth over the second half of
+the run is still above --max-slope-kb per 1000 tickets (it did not level off), or if more
+than --max-error-rate of the requests failed.
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+
+# 1x1 PNG: enough to go through base64 decoding + image store on every Nth request
+TINY_PNG_BASE64 = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII="
+
+
+def _mb(value: float) -> float:
+    return round(value / (1024 * 1024), 1)
+
+
+def configure_environment(args, workdir: str):
+    """Offline settings; must run before main/rag_engine are imported"""
+    os.environ.setdefault("OPENAI_API_KEY", "soak-test")
+    os.environ["QDRANT_URL"] = ""  # in-memory Qdrant (set, so that load_dotenv() keeps it empty)
+    os.environ["STARTUP_WARMUP"] = "false"
+    os.environ["RUN_LEDGER_PATH"] = os.path.join(workdir, "run_ledger.db")
+    os.environ["IMAGE_STORE_DIR"] = os.path.join(workdir, "image_store")
+    os.environ["MEMORY_PROFILING"] = "tracemalloc" if args.tracemalloc else "rss"
+    os.environ["MEMORY_SAMPLE_SECONDS"] = "5"
+    if args.fake == "degraded":
+        os.environ["DEGRADED_MODE"] = "always"
+        os.environ["CASSETTE_MODE"] = "off"
+        # Anything that still tries to reach OpenAI fails fast instead of going to the network
+        os.environ["OPENAI_BASE_URL"] = "http://127.0.0.1:9/v1"
+    else:
+        os.environ["DEGRADED_MODE"] = "off"
+        os.environ["CASSETTE_MODE"] = "replay"
+        os.environ["CASSETTE_DIR"] = args.dir
+        os.environ["CASSETTE_LATENCY"] = "zero"
+
+
+def load_tickets(args) -> list:
+    if args.fake == "replay":
+        from cassettes import Cassette
+        paths = sorted(Path(args.dir).glob("*.json.gz"))
+        return [Cassette.load(p).meta["ticket"] for p in paths]
+    return json.loads((ROOT_DIR / "data" / "example_tickets.json").read_text(encoding="utf-8"))
+
+
+def rss_now() -> int:
+    from memory_profile import peak_rss_bytes, rss_bytes
+    gc.collect()
+    return rss_bytes() or peak_rss_bytes()
+
+
+def request_body(args, tickets: list, i: int) -> dict:
+    ticket = dict(tickets[i % len(tickets)])
+    if args.fake == "degraded":
+        ticket["id"] = f"{ticket['id']}-soak{i}"
+    body = {"ticket": ticket}
+    if args.fake == "degraded" and args.image_every and i % args.image_every == 0:
+        body["image_base64"] = TINY_PNG_BASE64
+    return body
+
+
+def send(client, args, tickets: list, i: int) -> bool:
+    """One ticket: even ones to generate-response, odd ones to the SSE stream (read to the end)"""
+    body = request_body(args, tickets, i)
+    if i % 2 == 0:
+        response = client.post("/api/tickets/generate-response", json=body)
+        return response.status_code == 200 and bool(response.json().get("suggested_response"))
+    completed = False
+    with client.stream("POST", "/api/tickets/generate-response-stream", json=body) as response:
+        if response.status_code != 200:
+            return False
+        for line in response.iter_lines():
+            if line.startswith("data: ") and '"type": "complete"' in line:
+                completed = True
+    return completed
+
+
+def wait_ready(client, timeout: float = 120.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if client.get("/api/health/ready").status_code == 200:
+            return
+        time.sleep(0.5)
+    raise RuntimeError("RAG engine not ready (see /api/health/ready)")
+
+
+def verdict(args, samples: list, errors: int, total: int) -> list:
+    """Failure reasons (empty: passed)"""
+    from memory_profile import linear_slope
+
+    failures = []
+    settled = [(n, rss) for n, rss in samples if n >= args.warmup]
+    if len(settled) >= 2:
+        growth = settled[-1][1] - settled[0][1]
+        if growth > args.max_growth_mb * 1024 * 1024:
+            failures.append(f"RSS grew {_mb(growth)} MB after warm-up (max {args.max_growth_mb} MB)")
+        second_half = [(n, rss) for n, rss in settled if n >= (settled[0][0] + settled[-1][0]) / 2]
+        slope_kb = linear_slope(second_half) * 1000 / 1024
+        if slope_kb > args.max_slope_kb:
+            failures.append(f"RSS still growing {slope_kb:.1f} KB / 1000 tickets in the second half (max {args.max_slope_kb})")
+    else:
+        failures.append("Not enough samples after warm-up: raise --tickets or lower --warmup/--sample-every")
+    if total and errors / total > args.max_error_rate:
+        failures.append(f"{errors}/{total} requests failed (max rate {args.max_error_rate})")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Long-running offline soak test of both generate endpoints")
+    parser.add_argument("--fake", choices=("degraded", "replay"), default="degraded", help="Offline fake for the LLM side")
+    parser.add_argument("--dir", default=os.getenv("CASSETTE_DIR", "cassettes"), help="Cassette directory (--fake replay)")
+    parser.add_argument("--tickets", type=int, default=20000, help="Tickets to send (half per endpoint)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight")
+    parser.add_argument("--warmup", type=int, default=2000, help="Tickets before the memory baseline")
+    parser.add_argument("--sample-every", type=int, default=500, help="RSS sample interval, in tickets")
+    parser.add_argument("--image-every", type=int, default=50, help="Attach a base64 image every N tickets (0 = never)")
+    parser.add_argument("--max-growth-mb", type=float, default=64.0, help="Max RSS growth after warm-up")
+    parser.add_argument("--max-slope-kb", type=float, default=256.0, help="Max RSS growth per 1000 tickets in the second half")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="Max share of failed requests")
+    parser.add_argument("--tracemalloc", action="store_true", help="Trace allocations and print the top growing sites")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="northpole-soak-")
+    configure_environment(args, workdir)
+    os.chdir(ROOT_DIR)  # northpole.db, data/
+
+    from fastapi.testclient import TestClient
+    import main as server
+
+    tickets = load_tickets(args)
+    if not tickets:
+        print(f"❌ No tickets (no cassettes in {args.dir}?)")
+        sys.exit(1)
+
+    print("=" * 50)
+    print("SOAK TEST")
+    print("=" * 50)
+    print(f"🧪 {args.tickets} tickets, fake={args.fake}, concurrency={args.concurrency}, workdir={workdir}\n")
+
+    samples, errors, done = [], 0, 0
+    lock = threading.Lock()
+    started = time.perf_counter()
+    with TestClient(server.app) as client:
+        wait_ready(client)
+        if args.tracemalloc:
+            client.post("/api/memory/baseline")
+        samples.append((0, rss_now()))
+
+        def one(i: int):
+            nonlocal errors, done
+            try:
+                ok = send(client, args, tickets, i)
+            except Exception as e:
+                print(f"   ❌ ticket {i}: {e}")
+                ok = False
+            with lock:
+                errors += not ok
+                done += 1
+
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for chunk_start in range(0, args.tickets, args.sample_every):
+                chunk = range(chunk_start, min(args.tickets, chunk_start + args.sample_every))
+                list(pool.map(one, chunk))
+                rss = rss_now()
+                samples.append((chunk.stop, rss))
+                rate = chunk.stop / (time.perf_counter() - started)
+                print(f"   {chunk.stop:>7} tickets | RSS {_mb(rss):>7} MB | threads {threading.active_count():>3} | "
+                      f"errors {errors} | {rate:.0f} tickets/s")
+
+        report = client.get("/api/memory", params={"top": 15 if args.tracemalloc else 0}).json()
+        # Let the ledger writer flush before the app shuts down
+        time.sleep(0.5)
+
+    print("\n📦 Live objects:", json.dumps(report.get("objects"), default=str)[:600])
+    print("📊 Per-path deltas:", json.dumps(report.get("runs_by_path")))
+    for site in report.get("top_sites", []):
+        print(f"   {site['size_diff_mb']:>8} MB  {site['count_diff']:>8}  {site['site']}")
+
+    failures = verdict(args, samples, errors, done)
+    settled = [rss for n, rss in samples if n >= args.warmup]
+    print(f"\nRSS start {_mb(samples[0][1])} MB | after warm-up {_mb(settled[0]) if settled else '-'} MB | "
+          f"end {_mb(samples[-1][1])} MB | {done / (time.perf_counter() - started):.0f} tickets/s")
+    if failures:
+        for failure in failures:
+            print(f"❌ {failure}")
+        sys.exit(1)
+    print("✅ Memory stable")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+Cache shared by all uvicorn workers of a node, without an external service.
+
+With SHARED_CACHE_PATH set, entries live in one SQLite file (WAL, memory-mapped): every
+worker reads and writes the same cache, so an embedding computed or a prefetch done by
+one worker is a hit for the others, and the node's cache memory is bounded by
+SHARED_CACHE_MAX_MB whatever the number of workers (the mapped pages are shared through
+the OS page cache). Without it, a bounded in-process LRU with the same interface.
+
+Values are bytes (JSON helpers included), grouped by namespace, with an optional TTL.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+# accessed_at is refreshed at most this often per entry (a hit shouldn't always be a write)
+TOUCH_INTERVAL_SECONDS = 60.0
+# Size check every N writes; eviction brings the cache back to this fraction of the cap
+SIZE_CHECK_EVERY = 64
+EVICT_TO_RATIO = 0.9
+
+
+# ====== STORAGE ======
+
+class _MemoryStore:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[bytes, Optional[float]]]" = OrderedDict()
+        self._bytes = 0
+        self.evicted = 0
+
+    def _live(self, entry_key, now: float) -> Optional[bytes]:
+        entry = self._entries.get(entry_key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= now:
+            self._remove(entry_key)
+            return None
+        self._entries.move_to_end(entry_key)
+        return value
+
+    def _remove(self, entry_key):
+        value, _ = self._entries.pop(entry_key)
+        self._bytes -= len(value)
+
+    def get_many(self, namespace: str, keys: Iterable[str]) -> Dict[str, bytes]:
+        now = time.time()
+        with self._lock:
+            found = {key: self._live((namespace, key), now) for key in keys}
+        return {key: value for key, value in found.items() if value is not None}
+
+    def set(self, namespace: str, key: str, value: bytes, expires_at: Optional[float], only_new: bool = False) -> bool:
+        entry_key = (namespace, key)
+        with self._lock:
+            if only_new and self._live(entry_key, time.time()) is not None:
+                return False
+            if entry_key in self._entries:
+                self._remove(entry_key)
+            self._entries[entry_key] = (value, expires_at)
+            self._bytes += len(value)
+            while self._bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                self.evicted += 1
+            return True
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            if (namespace, key) in self._entries:
+                self._remove((namespace, key))
+
+    def usage(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "evicted": self.evicted}
+
+
+class _SQLiteStore:
+    """Entries in a SQLite file shared by every worker (one connection per thread)"""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        self.evicted = 0
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_cache ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "expires_at REAL, accessed_at REAL NOT NULL, PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_shared_cache_accessed ON shared_cache (accessed_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")  # A cache can lose its last writes on power loss
+            # Reads go through the OS page cache shared by all workers instead of per-process buffers
+            conn.execute(f"PRAGMA mmap_size={self.max_bytes}")
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, namespace: str, keys: Iterable[str]) -> Dict[str, bytes]:
+        keys = list(keys)
+        if not keys:
+            return {}
+        conn = self._connect()
+        now = time.time()
+        found: Dict[str, bytes] = {}
+        stale = []
+        # SQLite's default limit on bound parameters is 999
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = conn.execute(
+                f"SELECT key, value, expires_at, accessed_at FROM shared_cache "
+                f"WHERE namespace = ? AND key IN ({','.join('?' * len(chunk))})",
+                (namespace, *chunk),
+            ).fetchall()
+            for key, value, expires_at, accessed_at in rows:
+                if expires_at is not None and expires_at <= now:
+                    continue
+                found[key] = value
+                if accessed_at < now - TOUCH_INTERVAL_SECONDS:
+                    stale.append(key)
+        if stale:
+            conn.executemany(
+                "UPDATE shared_cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                [(now, namespace, key) for key in stale],
+            )
+        return found
+
+    def set(self, namespace: str, key: str, value: bytes, expires_at: Optional[float], only_new: bool = False) -> bool:
+        conn = self._connect()
+        now = time.time()
+        if only_new:
+            # Atomic across workers: insert unless a live entry exists (an expired one is replaced)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "DELETE FROM shared_cache WHERE namespace = ? AND key = ? AND expires_at IS NOT NULL AND expires_at <= ?",
+                    (namespace, key, now),
+                )
+                inserted = conn.execute(
+                    "INSERT OR IGNORE INTO shared_cache (namespace, key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (namespace, key, value, len(value), expires_at, now),
+                ).rowcount == 1
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        else:
+            conn.execute(
+                "INSERT OR REPLACE INTO shared_cache (namespace, key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, value, len(value), expires_at, now),
+            )
+            inserted = True
+        if inserted:
+            self._maybe_evict(conn)
+        return inserted
+
+    def delete(self, namespace: str, key: str):
+        self._connect().execute("DELETE FROM shared_cache WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def _maybe_evict(self, conn: sqlite3.Connection):
+        with self._writes_lock:
+            self._writes += 1
+            if self._writes % SIZE_CHECK_EVERY:
+                return
+        conn.execute("DELETE FROM shared_cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM shared_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Least recently used first, until back under the target size
+        excess = total - int(self.max_bytes * EVICT_TO_RATIO)
+        victims, freed = [], 0
+        for namespace, key, size in conn.execute("SELECT namespace, key, size FROM shared_cache ORDER BY accessed_at"):
+            victims.append((namespace, key))
+            freed += size
+            if freed >= excess:
+                break
+        conn.executemany("DELETE FROM shared_cache WHERE namespace = ? AND key = ?", victims)
+        self.evicted += len(victims)
+
+    def usage(self) -> dict:
+        entries, size = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM shared_cache").fetchone()
+        return {"entries": entries, "bytes": size, "evicted": self.evicted}
+
+
+# ====== CACHE ======
+
+class SharedCache:
+    def __init__(self, path: Optional[str] = None, max_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._store = _SQLiteStore(path, max_bytes) if path else _MemoryStore(max_bytes)
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    @classmethod
+    def from_env(cls) -> "SharedCache":
+        return cls(
+            path=os.getenv("SHARED_CACHE_PATH") or None,
+            max_bytes=int(float(os.getenv("SHARED_CACHE_MAX_MB", "256")) * 1024 * 1024),
+        )
+
+    @property
+    def shared(self) -> bool:
+        """True when the entries are visible to the other worker processes"""
+        return self.path is not None
+
+    def _count(self, namespace: str, **values):
+        with self._lock:
+            counters = self._counters.setdefault(namespace, {"hits": 0, "misses": 0, "writes": 0})
+            for name, value in values.items():
+                counters[name] += value
+
+    @staticmethod
+    def _expires_at(ttl_seconds: Optional[float]) -> Optional[float]:
+        return time.time() + ttl_seconds if ttl_seconds else None
+
+    def get_many(self, namespace: str, keys: Iterable[str]) -> Dict[str, bytes]:
+        keys = list(keys)
+        found = self._store.get_many(namespace, keys)
+        self._count(namespace, hits=len(found), misses=len(keys) - len(found))
+        return found
+
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        return self.get_many(namespace, [key]).get(key)
+
+    def set(self, namespace: str, key: str, value: bytes, ttl_seconds: Optional[float] = None):
+        self._store.set(namespace, key, value, self._expires_at(ttl_seconds))
+        self._count(namespace, writes=1)
+
+    def add(self, namespace: str, key: str, value: bytes, ttl_seconds: Optional[float] = None) -> bool:
+        """Store only if there is no live entry (atomic across workers). True if stored"""
+        added = self._store.set(namespace, key, value, self._expires_at(ttl_seconds), only_new=True)
+        if added:
+            self._count(namespace, writes=1)
+        return added
+
+    def delete(self, namespace: str, key: str):
+        self._store.delete(namespace, key)
+
+    def get_json(self, namespace: str, key: str) -> Any:
+        value = self.get(namespace, key)
+        return json.loads(value) if value is not None else None
+
+    def set_json(self, namespace: str, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        self.set(namespace, key, json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"), ttl_seconds)
+
+    def stats(self) -> dict:
+        with self._lock:
+            namespaces = {name: dict(counters) for name, counters in self._counters.items()}
+        for counters in namespaces.values():
+            lookups = counters["hits"] + counters["misses"]
+            counters["hit_ratio"] = round(counters["hits"] / lookups, 4) if lookups else None
+        return {
+            "backend": "sqlite" if self.path else "memory",
+            "path": self.path,
+            "max_bytes": self.max_bytes,
+            **self._store.usage(),
+            # Lookups made by this worker (the entries are shared, the counters are not)
+            "namespaces": namespaces,
+        }
@@ -0,0 +1,127 @@
+"""
+Background startup of the RAG engine, warm-up and liveness/readiness state.
+
+The server starts listening right away (liveness), while the engine - heavy datapizza/
+OpenAI/Qdrant imports included - is built in a worker thread and warmed up: DB and
+schema metadata, Qdrant connection, OpenAI HTTP pools and a tiny embedding call, all in
+parallel. Readiness turns green only after that, so a restarted or autoscaled instance
+never takes traffic cold.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+STATES = ("starting", "warming", "ready", "failed")
+
+
+def timed_checks(checks: Dict[str, Callable[[], Any]], timeout: float = 10.0) -> Dict[str, dict]:
+    """Run the named checks in parallel: {name: {"ok", "latency_ms", ["detail"], ["error"]}}
+
+    A check fails by raising; a non-None return value is reported as its detail.
+    """
+    if not checks:
+        return {}
+    results: Dict[str, dict] = {}
+    pool = ThreadPoolExecutor(max_workers=len(checks), thread_name_prefix="check")
+
+    def timed(fn):
+        started = time.perf_counter()
+        detail = fn()
+        return detail, (time.perf_counter() - started) * 1000
+
+    futures = {name: pool.submit(timed, fn) for name, fn in checks.items()}
+    deadline = time.monotonic() + timeout
+    for name, future in futures.items():
+        try:
+            detail, latency_ms = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            results[name] = {"ok": True, "latency_ms": round(latency_ms, 1)}
+            if detail is not None:
+                results[name]["detail"] = detail
+        except FutureTimeout:
+            results[name] = {"ok": False, "latency_ms": round(timeout * 1000, 1), "error": "timeout"}
+        except Exception as e:
+            results[name] = {"ok": False, "latency_ms": None, "error": str(e)[:300]}
+    # Don't wait for checks stuck past the deadline
+    pool.shutdown(wait=False)
+    return results
+
+
+class EngineStartup:
+    """Builds the engine in background (with retries), then warms it up"""
+
+    def __init__(self, warm_up: bool = True, max_attempts: int = 3, retry_seconds: float = 5.0):
+        self.warm_up = warm_up
+        self.max_attempts = max(1, max_attempts)
+        self.retry_seconds = retry_seconds
+        self.state = "starting"
+        self.engine = None
+        self.error: Optional[str] = None
+        self.attempts = 0
+        self.started_at = time.time()
+        self.ready_at: Optional[float] = None
+        self.build_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self.warmup: Dict[str, dict] = {}
+
+    @classmethod
+    def from_env(cls) -> "EngineStartup":
+        return cls(
+            warm_up=os.getenv("STARTUP_WARMUP", "true").lower() == "true",
+            max_attempts=int(os.getenv("STARTUP_MAX_ATTEMPTS", "3")),
+            retry_seconds=float(os.getenv("STARTUP_RETRY_SECONDS", "5")),
+        )
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    async def run(self, build: Callable[[], Any], on_ready: Callable[[Any], Optional[Awaitable[None]]]):
+        """build() runs in a worker thread; on_ready(engine) is called once warm (or never, if it fails)"""
+        while True:
+            self.attempts += 1
+            self.state, self.error = "starting", None
+            try:
+                started = time.perf_counter()
+                engine = await run_in_threadpool(build)
+                self.build_seconds = round(time.perf_counter() - started, 2)
+                print(f"RAG engine built in {self.build_seconds}s")
+                break
+            except Exception as e:
+                self.error = str(e)[:500]
+                print(f"Failed to initialize RAG engine (attempt {self.attempts}/{self.max_attempts}): {e}")
+                if self.attempts >= self.max_attempts:
+                    self.state = "failed"
+                    return
+                await asyncio.sleep(self.retry_seconds * 2 ** (self.attempts - 1))
+
+        if self.warm_up:
+            self.state = "warming"
+            started = time.perf_counter()
+            self.warmup = await run_in_threadpool(engine.warm_up)
+            self.warmup_seconds = round(time.perf_counter() - started, 2)
+            failed = [name for name, check in self.warmup.items() if not check["ok"]]
+            print(f"🔥 Warm-up done in {self.warmup_seconds}s" + (f" (failed: {', '.join(failed)})" if failed else ""))
+
+        self.engine = engine
+        result = on_ready(engine)
+        if asyncio.iscoroutine(result):
+            await result
+        self.state = "ready"
+        self.ready_at = time.time()
+        print(f"RAG engine ready ({self.ready_at - self.started_at:.2f}s after startup)")
+
+    def describe(self) -> dict:
+        return {
+            "state": self.state,
+            "attempts": self.attempts,
+            "error": self.error,
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "time_to_ready_seconds": round(self.ready_at - self.started_at, 2) if self.ready_at else None,
+            "build_seconds": self.build_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "warmup": self.warmup,
+        }
@@ -0,0 +1,180 @@
+"""
+Resumable SSE runs: the pipeline is decoupled from the HTTP connection.
+
+Each streamed generate request becomes a StreamRun with an id. A producer task runs
+the engine's event generator (holding the scheduler slot) and publishes every event
+with a monotonic id into a bounded ring buffer. HTTP responses only *subscribe*: a
+dropped connection does not stop the run, and a reconnect with `Last-Event-ID`
+replays the buffered events after that id and then follows the live run - it never
+starts a second LLM pipeline.
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, Dict, Optional, Tuple
+
+# Client reconnection delay suggested to EventSource (ms)
+SSE_RETRY_MS = 2000
+HEARTBEAT_SECONDS = 15.0
+
+
+def format_sse(data: dict, event_id: Optional[int] = None, retry_ms: Optional[int] = None) -> str:
+    lines = []
+    if retry_ms is not None:
+        lines.append(f"retry: {retry_ms}")
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class StreamRun:
+    def __init__(self, run_id: str, ticket_id: str, buffer_size: int):
+        self.run_id = run_id
+        self.ticket_id = ticket_id
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.buffer: Deque[Tuple[int, dict]] = deque(maxlen=buffer_size)
+        self.last_id = 0
+        self.subscribers = 0
+        self.reconnects = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    def publish(self, event: dict):
+        self.last_id += 1
+        self.buffer.append((self.last_id, event))
+        self._wake()
+
+    def finish(self):
+        if self.finished_at is None:
+            self.finished_at = time.time()
+            self._wake()
+
+    def _wake(self):
+        # Wake every waiting subscriber, then arm a fresh event for the next change
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def events(self, after_id: int = 0, heartbeat_seconds: float = HEARTBEAT_SECONDS) -> AsyncIterator[Tuple[Optional[int], dict]]:
+        """(id, event) after `after_id`: buffered ones first, then live ones until the run ends.
+
+        Yields (None, {"type": "heartbeat"}) while idle, so proxies keep the connection open.
+        """
+        cursor = after_id
+        self.subscribers += 1
+        try:
+            while True:
+                if self.buffer and self.buffer[0][0] > cursor + 1:
+                    # The ring buffer already dropped events this client never saw
+                    missed = self.buffer[0][0] - cursor - 1
+                    yield None, {"type": "gap", "missed": missed, "message": f"{missed} eventi non più disponibili"}
+                    cursor = self.buffer[0][0] - 1
+                pending = [(i, e) for i, e in self.buffer if i > cursor]
+                for event_id, event in pending:
+                    cursor = event_id
+                    yield event_id, event
+                if pending:
+                    continue
+                if self.done:
+                    return
+                changed = self._changed
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield None, {"type": "heartbeat"}
+        finally:
+            self.subscribers -= 1
+
+    def describe(self) -> dict:
+        return {
+            "run_id": self.run_id,
+            "ticket_id": self.ticket_id,
+            "last_event_id": self.last_id,
+            "buffered": len(self.buffer),
+            "done": self.done,
+            "subscribers": self.subscribers,
+            "reconnects": self.reconnects,
+            "age_seconds": round(time.time() - self.created_at, 1),
+        }
+
+
+class StreamRunRegistry:
+    """Live and recently finished runs (finished ones are kept `retention_seconds` for late reconnects)"""
+
+    def __init__(self, buffer_size: int = 500, retention_seconds: float = 300.0, max_runs: int = 500):
+        self.buffer_size = buffer_size
+        self.retention_seconds = retention_seconds
+        self.max_runs = max_runs
+        self._runs: Dict[str, StreamRun] = {}
+        self._counters = {"started": 0, "reconnects": 0, "expired": 0}
+
+    @classmethod
+    def from_env(cls) -> "StreamRunRegistry":
+        return cls(
+            buffer_size=int(os.getenv("SSE_BUFFER_EVENTS", "500")),
+            retention_seconds=float(os.getenv("SSE_RETENTION_SECONDS", "300")),
+        )
+
+    def start(self, ticket_id: str, producer: Callable[[StreamRun], AsyncIterator[dict]]) -> StreamRun:
+        """Create a run and start `producer(run)` in background; every event it yields is published"""
+        self._expire()
+        run = StreamRun(uuid.uuid4().hex, ticket_id, self.buffer_size)
+        self._runs[run.run_id] = run
+        self._counters["started"] += 1
+
+        async def produce():
+            try:
+                async for event in producer(run):
+                    run.publish(event)
+            except asyncio.CancelledError:
+                run.publish({"type": "error", "message": "Esecuzione annullata"})
+                raise
+            except Exception as e:
+                print(f"SSE Error: {e}")
+                run.publish({"type": "error", "message": str(e)})
+            finally:
+                run.finish()
+
+        run.task = asyncio.create_task(produce())
+        return run
+
+    def get(self, run_id: str) -> Optional[StreamRun]:
+        self._expire()
+        return self._runs.get(run_id)
+
+    def reconnected(self, run: StreamRun):
+        run.reconnects += 1
+        self._counters["reconnects"] += 1
+
+    def _expire(self):
+        now = time.time()
+        expired = [
+            run_id for run_id, run in self._runs.items()
+            if run.done and now - run.finished_at > self.retention_seconds
+        ]
+        # Over capacity: drop the oldest finished runs first
+        finished = sorted((r for r in self._runs.values() if r.done and r.run_id not in expired), key=lambda r: r.finished_at)
+        overflow = len(self._runs) - len(expired) - self.max_runs
+        expired += [r.run_id for r in finished[:max(0, overflow)]]
+        for run_id in expired:
+            del self._runs[run_id]
+        self._counters["expired"] += len(expired)
+
+    def stats(self) -> dict:
+        self._expire()
+        return {
+            "live": sum(1 for r in self._runs.values() if not r.done),
+            "retained": len(self._runs),
+            "buffer_size": self.buffer_size,
+            "retention_seconds": self.retention_seconds,
+            **self._counters,
+            "runs": [r.describe() for r in self._runs.values() if not r.done],
+        }
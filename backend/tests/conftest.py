@@ -0,0 +1,71 @@
+import json
+import pathlib
+import sqlite3
+import sys
+import types
+
+import pytest
+
+BACKEND_DIR = pathlib.Path(__file__).resolve().parents[1]
+ROOT_DIR = BACKEND_DIR.parent
+# The backend modules are imported flat, as when the server runs from backend/
+sys.path.insert(0, str(BACKEND_DIR))
+
+CHILDREN = [
+    (1, "Mario Rossi", "Rome", 15, "Lego Star Wars", "APPROVED"),
+    (2, "Giulia Bianchi", "Milan", 22, "Barbie Dreamhouse", "APPROVED"),
+    (3, "Emma Johnson", "New York", 8, "Nintendo Switch", "APPROVED"),
+    (11, "Tommy Troublemaker", "Los Angeles", 75, "PlayStation 5", "COAL"),
+    (12, "Luca Cattivo", "Naples", 82, "Xbox Series X", "COAL"),
+    (14, "Pierre Méchant", "Lyon", 91, "iPhone 15", "COAL"),
+    (16, "Elena Santini", "Florence", 10, "Telescope", "APPROVED"),
+    (21, "Marco Limite", "Turin", 50, "Board Game", "PENDING"),
+    (8847, "Tommy Rossi", "Rome", 73, "PlayStation 5", "COAL"),
+]
+INVENTORY = [
+    (1, "Lego Star Wars Millennium Falcon", "High", "Sector 1A"),
+    (2, "Barbie Dreamhouse", "High", "Sector 1B"),
+    (5, "Pokemon Card Booster Box", "High", "Sector 3A"),
+    (6, "Minecraft Lego Set", "High", "Sector 1D"),
+    (14, "Lego Technic Crane", "High", "Sector 1G"),
+    (16, "PlayStation 5", "Low", "Sector 2B"),
+    (18, "iPhone 15 Kids Edition", "Critical", "Sector 2D"),
+]
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    """fake_clock(module, "monotonic", start): replaces `module.time` with a clock moved by hand.
+
+    Returns the one-element list holding the current time (`clock[0] += 30`).
+    """
+    def install(module, name: str = "monotonic", start: float = 0.0) -> list:
+        now = [start]
+        monkeypatch.setattr(module, "time", types.SimpleNamespace(**{name: lambda: now[0]}))
+        return now
+    return install
+
+
+@pytest.fixture
+def northpole_db(tmp_path) -> str:
+    """Small northpole.db with the children and items the example tickets talk about"""
+    path = str(tmp_path / "northpole.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE children_log (id INTEGER PRIMARY KEY, name TEXT NOT NULL, city TEXT, "
+        "naughty_score INTEGER, last_incident TEXT, gift_requested TEXT, status TEXT)"
+    )
+    conn.execute("CREATE TABLE inventory (item_id INTEGER PRIMARY KEY, item_name TEXT NOT NULL, stock_level TEXT, warehouse_sector TEXT)")
+    conn.executemany(
+        "INSERT INTO children_log (id, name, city, naughty_score, gift_requested, status) VALUES (?, ?, ?, ?, ?, ?)", CHILDREN
+    )
+    conn.executemany("INSERT INTO inventory VALUES (?, ?, ?, ?)", INVENTORY)
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def example_tickets() -> dict:
+    tickets = json.loads((ROOT_DIR / "data" / "example_tickets.json").read_text(encoding="utf-8"))
+    return {t["id"]: t for t in tickets}
@@ -0,0 +1,33 @@
+import pytest
+
+pytest.importorskip("datapizza")
+
+from cassettes import CassetteDeck, CassetteSettings
+from models import Ticket
+from rag_engine import RAGEngine
+
+
+@pytest.fixture
+def engine() -> RAGEngine:
+    engine = RAGEngine.__new__(RAGEngine)
+    engine.cassettes = CassetteDeck(CassetteSettings(mode="record"))
+    return engine
+
+
+def recorded_run(engine, ticket, image_base64):
+    image_id = engine._inline_image_id(image_base64)
+    name, meta = engine._cassette_run(ticket, image_base64, None, image_id, stream=False)
+    return name, meta, engine._build_task_input(ticket, image_base64, image_id=image_id)
+
+
+def test_base64_image_runs_replay_by_content_id(engine, example_tickets):
+    ticket = Ticket(**example_tickets["NP-2025-001"])
+    name, meta, prompt = recorded_run(engine, ticket, "iVBORw0KGgo=")
+
+    # What scripts/replay_cassettes.py re-issues: no image payload, the recorded id
+    replay_name, _ = engine._cassette_run(ticket, None, meta["regeneration_feedback"], meta["image_id"], stream=False)
+    assert replay_name == name and meta["has_image_base64"]
+    assert engine._build_task_input(ticket, image_id=meta["image_id"]) == prompt
+
+    # Another photo is another run
+    assert recorded_run(engine, ticket, "R0lGODlhAQABAA==")[0] != name
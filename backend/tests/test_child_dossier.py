@@ -0,0 +1,32 @@
+import pytest
+
+from child_dossier import GiftMatcher
+from conftest import INVENTORY
+
+
+@pytest.fixture
+def matcher():
+    return GiftMatcher((item_id, name) for item_id, name, _, _ in INVENTORY)
+
+
+@pytest.mark.parametrize("gift, item_id, how", [
+    ("Barbie Dreamhouse", 2, "exact"),
+    ("barbie dreamhouse", 2, "exact"),
+    ("Lego Star Wars", 1, "tokens"),
+    ("Pokemon Cards", 5, "tokens"),  # plural folded
+    ("iPhone 15", 18, "tokens"),  # "Kids Edition" is packaging
+])
+def test_match(matcher, gift, item_id, how):
+    matched, kind, score = matcher.match(gift)
+    assert (matched, kind) == (item_id, how)
+    assert 0 < score <= 1
+
+
+def test_shared_brand_is_not_enough(matcher):
+    # "Lego" alone covers too little of "Lego Friends Heartlake"
+    assert matcher.match("Lego Friends Heartlake") == (None, "none", 0.0)
+
+
+@pytest.mark.parametrize("gift", [None, "", "Unicorno peluche gigante"])
+def test_no_match(matcher, gift):
+    assert matcher.match(gift) == (None, "none", 0.0)
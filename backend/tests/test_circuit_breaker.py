@@ -0,0 +1,70 @@
+import pytest
+
+import circuit_breaker
+from circuit_breaker import CircuitBreaker
+
+
+@pytest.fixture
+def clock(fake_clock):
+    return fake_clock(circuit_breaker, "monotonic", start=1000.0)
+
+
+def breaker(**kwargs):
+    return CircuitBreaker(**{"min_calls": 4, "error_rate": 0.5, "slow_call_seconds": 10, "cooldown_seconds": 30, **kwargs})
+
+
+def test_opens_on_error_rate(clock):
+    b = breaker()
+    for error in (False, True, False):
+        b.record(1.0, error=error)
+    assert b.allow() and b.state == "closed"  # Below min_calls
+    b.record(1.0, error=True)
+    assert b.state == "open" and b.is_open
+    assert not b.allow()
+    assert b.describe()["rejected"] == 1
+
+
+def test_opens_on_slow_calls(clock):
+    b = breaker()
+    for latency in (12, 15, 1, 11):
+        b.record(latency)
+    assert b.state == "open"
+    assert "slower" in b.reason
+
+
+def test_old_calls_leave_the_window(clock):
+    b = breaker(window_seconds=60)
+    b.record(1.0, error=True)
+    b.record(1.0, error=True)
+    clock[0] += 61
+    b.record(1.0)
+    b.record(1.0)
+    b.record(1.0)
+    assert b.state == "closed"
+
+
+def test_half_open_probe_closes_or_reopens(clock):
+    b = breaker()
+    for _ in range(4):
+        b.record(1.0, error=True)
+    clock[0] += 30
+    assert b.allow()  # The probe
+    assert not b.allow()  # Only one at a time
+    b.record(1.0, error=True)
+    assert b.state == "open" and b.describe()["opened"] == 2
+
+    clock[0] += 30
+    assert b.allow()
+    b.record(1.0)
+    assert b.state == "closed" and not b.is_open
+    assert b.allow()
+
+
+def test_forced_modes(clock):
+    assert not CircuitBreaker(mode="always").allow()
+    assert CircuitBreaker(mode="always").is_open
+    off = CircuitBreaker(mode="off", min_calls=1)
+    off.record(1.0, error=True)
+    assert off.allow() and off.state == "disabled"
+    with pytest.raises(ValueError):
+        CircuitBreaker(mode="sometimes")
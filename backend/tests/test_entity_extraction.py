@@ -0,0 +1,100 @@
+import pytest
+from sqlalchemy import create_engine
+
+from entity_extraction import EntityExtractor, canonical_queries
+
+
+@pytest.fixture
+def extractor(northpole_db):
+    return EntityExtractor(create_engine(f"sqlite:///{northpole_db}"))
+
+
+def extract(extractor, ticket):
+    return extractor.extract(f"{ticket['subject']}\n{ticket['message']}")
+
+
+def test_child_id_and_gift(extractor, example_tickets):
+    entities = extract(extractor, example_tickets["NP-2025-001"])
+    assert entities.child_ids == [8847]
+    # "Tommy" + "Rossi" (the mother's surname) is Tommy Rossi, not Tommy Troublemaker
+    assert entities.names == ["Tommy Rossi"]
+    assert entities.gifts == ["PlayStation 5"]
+
+
+def test_full_name(extractor, example_tickets):
+    entities = extract(extractor, example_tickets["NP-2025-002"])
+    assert entities.names == ["Giulia Bianchi"]
+    assert entities.gifts == ["Barbie Dreamhouse"]
+
+
+@pytest.mark.parametrize("ticket_id", ["NP-2025-003", "NP-2025-006", "NP-2025-007"])
+def test_first_name_alone_identifies_nobody(extractor, example_tickets, ticket_id):
+    # "Marco e Luca", the mother's "Elena", "Emma": children who merely share the first name
+    entities = extract(extractor, example_tickets[ticket_id])
+    assert entities.child_ids == [] and entities.names == []
+    assert canonical_queries(entities) == []
+
+
+def test_first_name_narrowed_by_surname_or_city(extractor, example_tickets):
+    entities = extract(extractor, example_tickets["NP-2025-004"])  # "mio figlio Pierre", "Isabelle Méchant da Lyon"
+    assert entities.names == ["Pierre Méchant"]
+    assert extractor.extract("Mio figlio Pierre vive a Lyon").names == ["Pierre Méchant"]
+    assert extractor.extract("Mio figlio Pierre vive a Roma").names == []
+
+
+def test_city_alone_identifies_nobody(extractor):
+    entities = extractor.extract("Siamo una famiglia di Roma, nostro figlio non ha ricevuto nulla")
+    assert entities.cities == ["Rome"]
+    assert entities.names == []
+    assert canonical_queries(entities) == []
+
+
+def test_longest_gift_wins(extractor, example_tickets):
+    entities = extract(extractor, example_tickets["NP-2025-005"])
+    assert entities.gifts == ["Lego Star Wars"]
+
+
+def test_canonical_queries_are_parameterized_and_bounded(extractor):
+    entities = extractor.extract("child_id: CH-12, Giulia Bianchi, Barbie Dreamhouse")
+    queries = canonical_queries(entities)
+    assert [table for table, _, _ in queries] == ["children_log", "children_log", "inventory"]
+    for _, sql, params in queries:
+        assert "LIMIT" in sql
+        assert "Giulia" not in sql and params
+
+
+# ====== FAST PATH TOOL CALLS ======
+
+@pytest.fixture
+def engine(northpole_db):
+    pytest.importorskip("datapizza")
+    from types import SimpleNamespace
+    from cassettes import CassetteDeck, CassetteSettings
+    from child_dossier import ChildDossier
+    from rag_engine import RAGEngine
+
+    db = create_engine(f"sqlite:///{northpole_db}")
+    engine = RAGEngine.__new__(RAGEngine)
+    engine.db_tool = SimpleNamespace(engine=db)
+    engine.entity_extractor = EntityExtractor(db)
+    engine.child_dossier = ChildDossier(db)
+    engine.child_dossier.install()
+    engine.cassettes = CassetteDeck(CassetteSettings(mode="off"))
+    return engine
+
+
+def test_each_query_is_traced_with_its_own_rows(engine, example_tickets):
+    from evidence_cache import TicketEvidence
+    from models import Ticket
+
+    ticket = Ticket(**example_tickets["NP-2025-001"])
+    facts, lookups, entities = engine._lookup_db_facts(ticket)
+    evidence = TicketEvidence(ticket.id)
+    engine._add_db_evidence(evidence, ticket, facts, lookups, entities)
+
+    extraction, *queries = evidence.tool_calls
+    assert extraction.tool_name == "entity_extraction"
+    assert [tc.tool_input for tc in queries] == evidence.sql_queries == [query for query, _ in lookups]
+    assert len({tc.tool_output for tc in queries}) > 1  # Not the combined facts on every query
+    for tc, (_, rows) in zip(queries, lookups):
+        assert tc.tool_name == "run_sql_query" and tc.tool_output == str(rows)[:500]
@@ -0,0 +1,41 @@
+from starlette.requests import Request
+
+from http_cache import StaticAsset, etag_for, is_not_modified
+
+
+def request(**headers) -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": [
+        (k.replace("_", "-").encode(), v.encode()) for k, v in headers.items()
+    ]})
+
+
+def test_is_not_modified():
+    etag = etag_for(b"body")
+    assert is_not_modified(request(if_none_match=etag), etag)
+    assert is_not_modified(request(if_none_match=f'"other", W/{etag}'), etag)
+    assert is_not_modified(request(if_none_match=etag[:-1] + '-br"'), etag)  # Compressed variant
+    assert is_not_modified(request(if_none_match="*"), etag)
+    assert not is_not_modified(request(if_none_match='"other"'), etag)
+    assert not is_not_modified(request(), etag)
+
+
+def test_if_modified_since():
+    assert is_not_modified(request(if_modified_since="Wed, 01 Jan 2025 00:00:00 GMT"), '"x"', last_modified=1735689600)
+    assert not is_not_modified(request(if_modified_since="Wed, 01 Jan 2025 00:00:00 GMT"), '"x"', last_modified=1735689601)
+    assert not is_not_modified(request(if_modified_since="garbage"), '"x"', last_modified=1)
+    # If-None-Match wins
+    assert not is_not_modified(request(if_none_match='"y"', if_modified_since="Wed, 01 Jan 2025 00:00:00 GMT"), '"x"', last_modified=1)
+
+
+def test_static_asset_304_and_variants(tmp_path):
+    page = tmp_path / "index.html"
+    page.write_text("<html>" + "x" * 2000 + "</html>")
+    asset = StaticAsset(page, media_type="text/html")
+
+    response = asset.response(request(accept_encoding="gzip"))
+    assert response.status_code == 200 and response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"] == asset.etag[:-1] + '-gzip"'
+    assert asset.response(request(if_none_match=response.headers["etag"])).status_code == 304
+
+    page.write_text("<html>changed</html>")
+    assert asset.response(request(if_none_match=response.headers["etag"])).status_code == 200
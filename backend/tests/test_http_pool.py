@@ -0,0 +1,99 @@
+import asyncio
+import threading
+
+import httpcore
+import httpx
+import pytest
+
+from http_pool import AsyncHedgedTransport, HedgedTransport, HttpPoolSettings, SharedHttpPool, _CachingAsyncBackend, _CachingSyncBackend
+from rate_limiter import ModelLimit, RateLimitGovernor, _Plan
+
+EMBEDDINGS_URL = "https://api.test/v1/embeddings"
+PAYLOAD = {"model": "m", "input": "renne"}
+
+
+def pool() -> SharedHttpPool:
+    return SharedHttpPool(HttpPoolSettings(hedge_after_seconds=0.05, hedge_max_ratio=1.0))
+
+
+def governor(rpm: int = 60) -> RateLimitGovernor:
+    return RateLimitGovernor(limits={"m": ModelLimit(rpm=rpm, tpm=100000)}, burst_seconds=10)
+
+
+class SlowFirst(httpx.BaseTransport):
+    """The first request answers after 0.5 s, the others right away"""
+
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def handle_request(self, request):
+        with self._lock:
+            self.calls += 1
+            first = self.calls == 1
+        if first:
+            threading.Event().wait(0.5)
+        return httpx.Response(200, json={"slow": first})
+
+
+def granted(g: RateLimitGovernor) -> int:
+    return g.stats()["models"].get("m", {}).get("granted", 0)
+
+
+def test_hedge_reserves_its_own_budget():
+    g, p, inner = governor(), pool(), SlowFirst()
+    with httpx.Client(transport=HedgedTransport(inner, p, g)) as client:
+        response = client.post(EMBEDDINGS_URL, json=PAYLOAD)
+    assert response.json() == {"slow": False} and inner.calls == 2
+    assert granted(g) == 1  # The original request is reserved by the GovernedTransport above
+    assert p.stats()["hedges_won"] == 1
+
+
+def test_hedge_skipped_when_it_would_wait():
+    g, p, inner = governor(rpm=6), pool(), SlowFirst()  # 1 request per burst
+    g.reserve(_Plan("m", 10))
+    with httpx.Client(transport=HedgedTransport(inner, p, g)) as client:
+        response = client.post(EMBEDDINGS_URL, json=PAYLOAD)
+    assert response.json() == {"slow": True} and inner.calls == 1
+    assert p.stats()["hedges_throttled"] == 1
+    assert g.reserve(_Plan("m", 10)) <= 10  # The skipped hedge left no debt (else ~20 s)
+
+
+def test_async_hedge_reserves_its_own_budget():
+    g, p, calls = governor(), pool(), []
+
+    async def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            await asyncio.sleep(0.5)
+        return httpx.Response(200, json={"slow": len(calls) == 1})
+
+    async def run():
+        async with httpx.AsyncClient(transport=AsyncHedgedTransport(httpx.MockTransport(handler), p, g)) as client:
+            return await client.post(EMBEDDINGS_URL, json=PAYLOAD)
+
+    assert asyncio.run(run()).status_code == 200 and len(calls) == 2
+    assert granted(g) == 1
+
+
+@pytest.mark.parametrize("error", [httpcore.ConnectError, httpcore.ConnectTimeout])
+def test_connect_falls_through_to_the_next_address(monkeypatch, error):
+    p = pool()
+    monkeypatch.setattr(p.dns, "resolve", lambda host, port: ["10.0.0.1", "10.0.0.2"])
+    monkeypatch.setattr(p.dns, "cached", lambda host, port: ["10.0.0.1", "10.0.0.2"])
+    tried = []
+
+    def connect(self, host, *args, **kwargs):
+        tried.append(host)
+        if host == "10.0.0.1":
+            raise error("unreachable")
+        return "stream"
+
+    async def a_connect(self, host, *args, **kwargs):
+        return connect(self, host)
+
+    monkeypatch.setattr(httpcore.SyncBackend, "connect_tcp", connect)
+    monkeypatch.setattr(httpcore.AnyIOBackend, "connect_tcp", a_connect)
+    assert _CachingSyncBackend(p).connect_tcp("api.test", 443) == "stream"
+    assert asyncio.run(_CachingAsyncBackend(p).connect_tcp("api.test", 443)) == "stream"
+    assert tried == ["10.0.0.1", "10.0.0.2"] * 2 and p.stats()["connections_opened"] == 2
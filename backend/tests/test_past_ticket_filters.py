@@ -0,0 +1,124 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("datapizza")
+
+from datapizza.type import Chunk, DenseEmbedding
+from datapizza.vectorstores.qdrant import QdrantVectorstore
+from qdrant_client import QdrantClient, models as qmodels
+
+from cassettes import CassetteDeck, CassetteSettings
+from rag_engine import FILTER_FALLBACK_NOTE, RAGEngine
+from vector_settings import CollectionSettings
+from conftest import ROOT_DIR
+
+VECTOR_NAME = "test-embedding"
+COLLECTION = "northpole_tickets"
+
+
+@pytest.fixture(scope="module")
+def past_tickets() -> list:
+    return json.loads((ROOT_DIR / "data" / "past_tickets.json").read_text(encoding="utf-8"))
+
+
+def vector(i: int) -> list:
+    return [1.0 if j == i % 4 else 0.1 for j in range(4)]
+
+
+def test_no_filters():
+    assert RAGEngine._build_ticket_filter() is None
+    assert RAGEngine._build_ticket_filter(category="", priority=None) is None
+
+
+def test_comma_separated_values_match_any():
+    query_filter = RAGEngine._build_ticket_filter(category="Logistics", priority="critical, high,")
+    category, priority = query_filter.must
+    assert category.key == "category" and category.match == qmodels.MatchValue(value="Logistics")
+    assert priority.key == "priority" and priority.match == qmodels.MatchAny(any=["critical", "high"])
+
+
+def test_ranges():
+    satisfaction, resolved = RAGEngine._build_ticket_filter(
+        min_satisfaction=4, resolved_after="2024-12-24T12:00:00Z"
+    ).must
+    assert satisfaction.range.gte == 4
+    assert isinstance(resolved.range, qmodels.DatetimeRange)
+    assert resolved.range.gte is not None and resolved.range.lte is None
+
+
+@pytest.fixture(scope="module")
+def client(past_tickets) -> QdrantClient:
+    client = QdrantClient(":memory:")
+    client.create_collection(COLLECTION, vectors_config=qmodels.VectorParams(size=4, distance=qmodels.Distance.COSINE))
+    client.upsert(COLLECTION, [
+        qmodels.PointStruct(id=i, vector=vector(i), payload=RAGEngine.ticket_chunk_metadata(t))
+        for i, t in enumerate(past_tickets)
+    ])
+    return client
+
+
+def matching_ids(client, **filters) -> set:
+    points = client.query_points(
+        COLLECTION, query=vector(0), limit=10, query_filter=RAGEngine._build_ticket_filter(**filters)
+    ).points
+    return {p.payload["ticket_id"] for p in points}
+
+
+@pytest.mark.parametrize("filters, expected", [
+    ({"category": "Logistics"}, {"NP-004"}),
+    ({"category": "Logistics,Elf Relations"}, {"NP-002", "NP-004"}),
+    ({"priority": "critical", "min_satisfaction": 5}, {"NP-001", "NP-003"}),
+    ({"resolved_after": "2024-12-24T20:00:00Z"}, {"NP-001", "NP-004"}),
+    ({"resolved_after": "2024-12-24T12:00:00Z", "resolved_before": "2024-12-24T23:00:00Z"}, {"NP-001", "NP-003"}),
+    ({"category": "Sleigh Maintenance", "priority": "medium"}, set()),
+])
+def test_filters_on_ticket_payloads(client, past_tickets, filters, expected):
+    assert matching_ids(client, **filters) == expected
+
+
+# ====== EMPTY PARTITION FALLBACK ======
+
+@pytest.fixture(scope="module")
+def engine(past_tickets) -> RAGEngine:
+    """Just what the past ticket search needs: in-memory vector store, no OpenAI"""
+    engine = RAGEngine.__new__(RAGEngine)
+    engine.vectorstore = QdrantVectorstore(location=":memory:")
+    engine.vector_name = VECTOR_NAME
+    engine.tickets_collection = COLLECTION
+    engine.collection_settings = CollectionSettings()
+    engine.cassettes = CassetteDeck(CassetteSettings(mode="off"))
+    engine.vectorstore.get_client().create_collection(
+        COLLECTION, vectors_config={VECTOR_NAME: qmodels.VectorParams(size=4, distance=qmodels.Distance.COSINE)}
+    )
+    engine.vectorstore.add([
+        Chunk(
+            id=f"00000000-0000-0000-0000-00000000000{i}",
+            text=RAGEngine.ticket_chunk_text(t),
+            metadata=RAGEngine.ticket_chunk_metadata(t),
+            embeddings=[DenseEmbedding(name=VECTOR_NAME, vector=vector(i))],
+        )
+        for i, t in enumerate(past_tickets)
+    ], collection_name=COLLECTION)
+    return engine
+
+
+def test_filtered_search(engine):
+    result = engine._query_past_tickets(vector(0), 3, category="Logistics")
+    assert not result.startswith(FILTER_FALLBACK_NOTE)
+    assert "Logistics" in result or "NP-004" in result
+    assert result.count("[Ticket Simile") == 1
+
+
+def test_empty_partition_falls_back_to_the_whole_collection(engine):
+    result = engine._query_past_tickets(vector(0), 3, category="Non esiste")
+    assert result.startswith(FILTER_FALLBACK_NOTE)
+    assert result.count("[Ticket Simile") == 3
+
+
+def test_async_search_same_fallback(engine):
+    filtered = asyncio.run(engine._a_search_past_tickets_by_vector(vector(0), 3, category="Logistics"))
+    fallback = asyncio.run(engine._a_search_past_tickets_by_vector(vector(0), 3, category="Non esiste"))
+    assert filtered == engine._query_past_tickets(vector(0), 3, category="Logistics")
+    assert fallback.startswith(FILTER_FALLBACK_NOTE) and fallback.count("[Ticket Simile") == 3
@@ -0,0 +1,176 @@
+import asyncio
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+from evidence_cache import EvidenceCache, TicketEvidence
+from shared_cache import SharedCache
+from conftest import ROOT_DIR
+
+
+def collect_after(seconds: float):
+    async def collect():
+        await asyncio.sleep(seconds)
+        return TicketEvidence("NP-1")
+    return collect
+
+
+def test_async_prefetch_is_never_awaited_on_the_loop():
+    async def run():
+        cache = EvidenceCache()
+        cache.start_async("k", collect_after(0.2), asyncio.get_running_loop())
+        started = time.perf_counter()
+        on_loop = cache.get("k", wait_seconds=3)
+        on_loop_seconds = time.perf_counter() - started
+        # From a worker thread the same wait returns as soon as the prefetch (running on the loop) is done
+        started = time.perf_counter()
+        in_thread = await asyncio.to_thread(cache.get, "k", 3)
+        return on_loop, on_loop_seconds, in_thread, time.perf_counter() - started
+
+    on_loop, on_loop_seconds, in_thread, in_thread_seconds = asyncio.run(run())
+    assert on_loop is None and on_loop_seconds < 0.1
+    assert in_thread is not None and in_thread.ticket_id == "NP-1"
+    assert in_thread_seconds < 1
+
+
+def test_shared_cache_is_polled_only_off_the_loop(tmp_path):
+    path = str(tmp_path / "shared.db")
+    collector, other_worker = EvidenceCache(shared=SharedCache(path)), EvidenceCache(shared=SharedCache(path))
+
+    def collect():
+        time.sleep(0.3)
+        return TicketEvidence("NP-1")
+
+    assert collector.start("k", collect)
+    assert not other_worker.start("k", collect)  # Claimed by the first worker
+
+    async def run():
+        started = time.perf_counter()
+        on_loop = other_worker.get("k", wait_seconds=3)
+        on_loop_seconds = time.perf_counter() - started
+        in_thread = await asyncio.to_thread(other_worker.get, "k", 3)
+        return on_loop, on_loop_seconds, in_thread
+
+    on_loop, on_loop_seconds, in_thread = asyncio.run(run())
+    assert on_loop is None and on_loop_seconds < 0.1
+    assert in_thread is not None and in_thread.ticket_id == "NP-1"
+
+
+def test_failed_prefetch_can_be_retried():
+    cache = EvidenceCache()
+
+    def fail():
+        raise RuntimeError("qdrant down")
+
+    assert cache.start("k", fail)
+    assert cache.get("k", wait_seconds=1) is None
+    assert cache.start("k", lambda: TicketEvidence("NP-1"))
+    assert cache.get("k", wait_seconds=1).ticket_id == "NP-1"
+
+
+class ThreadRecordingCache(SharedCache):
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.threads = set()
+
+    def get_many(self, namespace, keys):
+        self.threads.add(threading.get_ident())
+        return super().get_many(namespace, keys)
+
+    def set(self, namespace, key, value, ttl_seconds=None):
+        self.threads.add(threading.get_ident())
+        return super().set(namespace, key, value, ttl_seconds)
+
+
+def test_async_embed_uses_the_shared_cache_off_the_loop(tmp_path):
+    pytest.importorskip("datapizza")
+    from openai_clients import NorthPoleEmbedder
+
+    cache = ThreadRecordingCache(str(tmp_path / "shared.db"))
+    embedder = NorthPoleEmbedder(api_key="test", model_name="text-embedding-3-small", cache=cache)
+    calls = []
+
+    async def create(input, **kwargs):
+        calls.append(input)
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[0.25, 0.5]) for _ in input])
+
+    embedder.a_client = SimpleNamespace(embeddings=SimpleNamespace(create=create))
+
+    async def run():
+        return await embedder.a_embed("renne"), await embedder.a_embed("renne"), threading.get_ident()
+
+    first, second, loop_thread = asyncio.run(run())
+    assert first == second == [0.25, 0.5] and len(calls) == 1
+    assert cache.threads and loop_thread not in cache.threads
+
+
+# ====== PREFETCH + STREAM (whole app, offline) ======
+
+@pytest.fixture
+def offline_app(monkeypatch, tmp_path):
+    pytest.importorskip("datapizza")
+    monkeypatch.chdir(ROOT_DIR)  # northpole.db, data/
+    for name, value in {
+        "OPENAI_API_KEY": "test",
+        "OPENAI_BASE_URL": "http://127.0.0.1:9/v1",  # Fails fast, never reaches the network
+        "QDRANT_URL": "",  # In-memory Qdrant
+        "STARTUP_WARMUP": "false",
+        "DEGRADED_MODE": "off",
+        "CASSETTE_MODE": "off",
+        "SHARED_CACHE_PATH": "",
+        "RUN_LEDGER_PATH": str(tmp_path / "run_ledger.db"),
+        "IMAGE_STORE_DIR": str(tmp_path / "image_store"),
+    }.items():
+        monkeypatch.setenv(name, value)
+    import main
+    with TestClient(main.app) as client:
+        deadline = time.monotonic() + 60
+        while client.get("/api/health/ready").status_code != 200:
+            assert time.monotonic() < deadline, "engine not ready"
+            time.sleep(0.2)
+        yield client, main.rag_engine
+
+
+def test_stream_uses_async_prefetch_without_blocking(offline_app, monkeypatch):
+    from models import OpsResponse
+
+    client, engine = offline_app
+    monkeypatch.setattr(engine, "_a_collect_evidence", lambda ticket: collect_after(0.2)())
+    monkeypatch.setattr(engine, "_synthesize", lambda ticket, evidence, run, *args, **kwargs: OpsResponse(
+        thought_process="", sql_query_used="N/A", action_checklist=[], coal_alert=False, final_response="from prefetch"
+    ))
+    ticket = json.loads((ROOT_DIR / "data" / "example_tickets.json").read_text(encoding="utf-8"))[0]
+
+    assert client.post("/api/tickets/prefetch", json=ticket).json()["status"] == "started"
+    started = time.perf_counter()
+    with client.stream("POST", "/api/tickets/generate-response-stream", json={"ticket": ticket}) as response:
+        events = [json.loads(line[6:]) for line in response.iter_lines() if line.startswith("data: ")]
+    elapsed = time.perf_counter() - started
+
+    complete = [e for e in events if e["type"] == "complete"]
+    assert complete and complete[0]["response"]["suggested_response"] == "from prefetch"
+    assert elapsed < 5  # Not the PREFETCH_WAIT_SECONDS stall
+
+
+def test_sync_collection_reuses_the_engine_executor(offline_app, monkeypatch, example_tickets):
+    from models import Ticket
+
+    _, engine = offline_app
+    threads = []
+
+    def search(vector):
+        threads.append(threading.current_thread())
+        return "ok"
+
+    monkeypatch.setattr(engine.embedder, "embed", lambda query: [0.0])
+    monkeypatch.setattr(engine, "_search_manuals_by_vector", search)
+    monkeypatch.setattr(engine, "_search_past_tickets_by_vector", search)
+    for ticket_id in ("NP-2025-001", "NP-2025-002"):
+        evidence = engine._collect_evidence(Ticket(**example_tickets[ticket_id]))
+        assert evidence.manuals == evidence.past_tickets == "ok" and evidence.has_db_facts
+
+    assert len(threads) == 4 and set(threads) <= set(engine.evidence_executor._threads)
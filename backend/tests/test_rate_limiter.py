@@ -0,0 +1,95 @@
+import asyncio
+import threading
+
+import httpx
+import pytest
+
+import rate_limiter
+from rate_limiter import AsyncGovernedTransport, ModelLimit, RateLimitGovernor, RateLimitShed, _Plan
+
+
+@pytest.fixture
+def clock(fake_clock):
+    return fake_clock(rate_limiter, "time", start=1000.0)
+
+
+def governor(**kwargs) -> RateLimitGovernor:
+    # 60 RPM / 6000 TPM, buckets of 10 s: 10 requests, 1000 tokens
+    return RateLimitGovernor(limits={"m": ModelLimit(rpm=60, tpm=6000)}, burst_seconds=10, **kwargs)
+
+
+def test_burst_then_debt(clock):
+    g = governor(max_wait_seconds=30)
+    assert [g.reserve(_Plan("m", 100)) for _ in range(10)] == [0.0] * 10
+    # Buckets empty: each caller waits behind the debt of the previous ones
+    assert g.reserve(_Plan("m", 100)) == pytest.approx(1.0)
+    assert g.reserve(_Plan("m", 100)) == pytest.approx(2.0)
+    clock[0] += 2
+    assert g.reserve(_Plan("m", 100)) == pytest.approx(1.0)
+    assert g.stats()["models"]["m"]["waited"] == 3
+
+
+def test_token_debt(clock):
+    g = governor(max_wait_seconds=30)
+    assert g.reserve(_Plan("m", 1000)) == 0.0
+    assert g.reserve(_Plan("m", 600)) == pytest.approx(6.0)  # 600 tokens at 100 tokens/s
+
+
+def test_shed_without_debiting(clock):
+    g = governor(max_wait_seconds=5)
+    g.reserve(_Plan("m", 1000))
+    with pytest.raises(RateLimitShed) as shed:
+        g.reserve(_Plan("m", 1000))
+    assert shed.value.retry_after == pytest.approx(10.0)
+    # The shed call took nothing: a small call still fits
+    assert g.reserve(_Plan("m", 100)) == pytest.approx(1.0)
+    assert g.stats()["models"]["m"]["shed"] == 1
+
+
+def test_refund_and_observe(clock):
+    g = governor(max_wait_seconds=30)
+    plan = _Plan("m", 1000)
+    g.reserve(plan)
+    g.refund(plan)  # e.g. rejected with 429
+    assert g.reserve(_Plan("m", 1000)) == 0.0
+    g.observe(plan, rate_limiter.httpx.Response(200), actual_tokens=100)  # Estimate was 900 too high
+    assert g.reserve(_Plan("m", 900)) == 0.0
+
+
+def test_pause_blocks_every_caller(clock):
+    g = governor(max_wait_seconds=30)
+    g.pause("m", 4)
+    assert g.reserve(_Plan("m", 10)) == pytest.approx(4.0)
+
+
+def test_unlimited_models_pass(clock):
+    assert governor().reserve(_Plan("other", 10 ** 9)) == 0.0
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_async_transport_keeps_shared_buckets_off_the_loop(tmp_path, shared):
+    g = governor(backoff_base_seconds=0.01, state_path=str(tmp_path / "buckets.db") if shared else None)
+    threads = []
+    transact = g._buckets.transact
+
+    def recording(*args):
+        threads.append(threading.get_ident())
+        return transact(*args)
+
+    g._buckets.transact = recording
+    statuses = iter([429, 200])
+
+    async def handler(request):
+        return httpx.Response(next(statuses), json={"usage": {"total_tokens": 50}})
+
+    async def run():
+        transport = AsyncGovernedTransport(g, httpx.MockTransport(handler))
+        async with httpx.AsyncClient(transport=transport) as client:
+            response = await client.post("https://api.test/v1/embeddings", json={"model": "m", "input": "renne"})
+        return response.status_code, threading.get_ident()
+
+    status, loop_thread = asyncio.run(run())
+    assert status == 200
+    assert len(threads) == 5  # reserve, refund, pause (429), reserve, observe
+    # In-memory buckets stay inline, SQLite transactions go to worker threads
+    assert all((t == loop_thread) != shared for t in threads)
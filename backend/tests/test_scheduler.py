@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+import scheduler
+from scheduler import PriorityScheduler, SchedulerQueueFull, SchedulerSettings
+
+
+@pytest.fixture
+def clock(fake_clock):
+    return fake_clock(scheduler, "monotonic", start=0.0)
+
+
+def make(**settings) -> PriorityScheduler:
+    return PriorityScheduler(SchedulerSettings(**{"max_concurrency": 1, "reservations": {}, **settings}))
+
+
+def serve(s: PriorityScheduler, leases, clock, n: int, service_seconds: float = 0.0) -> str:
+    """Release the running lease n times: initials of the priorities admitted, in order"""
+    order = ""
+    for _ in range(n):
+        running = next(l for l in leases if l.admitted and not l._released)
+        clock[0] += service_seconds
+        running.release()
+        admitted = [l for l in leases if l.admitted and not l._released]
+        if admitted:
+            order += admitted[0].priority[0]
+    return order
+
+
+def test_weighted_fair_share(clock):
+    async def run():
+        s = make(aging_seconds=0)
+        leases = [s.acquire("critical")]
+        leases += [s.acquire("medium") for _ in range(3)] + [s.acquire("critical") for _ in range(20)]
+        return serve(s, leases, clock, 18)
+
+    order = asyncio.run(run())
+    # critical gets weights["critical"] (8) slots for each medium one, medium is never shut out
+    assert order.count("m") == 2
+    first = order.index("m")
+    assert order[first + 1:].index("m") == 8
+
+
+def test_aging_moves_starved_requests_ahead(clock):
+    def medium_positions(aging_seconds):
+        async def run():
+            s = make(aging_seconds=aging_seconds)
+            leases = [s.acquire("critical")]
+            leases += [s.acquire("medium") for _ in range(3)] + [s.acquire("critical") for _ in range(40)]
+            return serve(s, leases, clock, 43, service_seconds=5)
+        order = asyncio.run(run())
+        return [i for i, p in enumerate(order) if p == "m"]
+
+    without, with_aging = medium_positions(0), medium_positions(30)
+    assert len(with_aging) == 3
+    assert with_aging[-1] < without[-1]
+    assert with_aging[-1] <= 8  # About one aging period each, not behind the whole critical backlog
+
+
+def test_reservation_keeps_a_slot_for_critical(clock):
+    async def run():
+        s = make(max_concurrency=2, reservations={"critical": 1})
+        first, second = s.acquire("medium"), s.acquire("medium")
+        critical = s.acquire("critical")
+        return first.admitted, second.admitted, critical.admitted
+
+    assert asyncio.run(run()) == (True, False, True)
+
+
+def test_queue_full_and_cancel(clock):
+    async def run():
+        s = make(max_queue=2)
+        running = s.acquire("high")
+        waiting = [s.acquire("high"), s.acquire("medium")]
+        with pytest.raises(SchedulerQueueFull):
+            s.acquire("critical")
+        waiting[0].release()  # Client gone while queued
+        running.release()
+        return waiting[1].admitted, s.stats()["priorities"]
+
+    admitted, stats = asyncio.run(run())
+    assert admitted
+    assert stats["critical"]["shed"] == 1 and stats["high"]["cancelled"] == 1
+
+
+def test_stream_sheds_with_503_before_starting_a_run(monkeypatch):
+    from types import SimpleNamespace
+    from fastapi.testclient import TestClient
+    import main
+
+    monkeypatch.setattr(main, "rag_engine", SimpleNamespace(breaker=SimpleNamespace(is_open=False)))
+    s = make()
+
+    def acquire(priority):  # Filled up between a queue check and the acquire
+        raise SchedulerQueueFull("Scheduler queue full (0 waiting)")
+
+    monkeypatch.setattr(s, "acquire", acquire)
+    monkeypatch.setattr(main, "scheduler", s)
+    started = main.stream_runs.stats()["started"]
+    ticket = {"id": "NP-1", "category": "Altro", "priority": "high", "subject": "s", "message": "m"}
+
+    response = TestClient(main.app).post("/api/tickets/generate-response-stream", json={"ticket": ticket})
+    assert response.status_code == 503 and response.headers["retry-after"] == "5"
+    assert main.stream_runs.stats()["started"] == started
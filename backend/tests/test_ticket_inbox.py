@@ -0,0 +1,76 @@
+import json
+import sqlite3
+
+import pytest
+from fastapi.testclient import TestClient
+
+from ticket_inbox import INBOX_TABLE_SQL, TicketInbox
+from conftest import ROOT_DIR
+
+SEED_PATH = str(ROOT_DIR / "data" / "example_tickets.json")
+
+
+def add_open_ticket(db_path: str, ticket_id: str):
+    conn = sqlite3.connect(db_path)
+    conn.execute(INBOX_TABLE_SQL)
+    conn.execute(
+        "INSERT INTO ticket_inbox (id, category, priority, subject, message, created_at) VALUES (?, 'Altro', 'high', 's', 'm', '2025-12-24')",
+        (ticket_id,),
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_inbox_etag_stable_across_reloads(northpole_db):
+    first = TicketInbox(SEED_PATH, northpole_db)
+    _, etag = first.page()
+    # Writes to other tables (dossier sync, triggers) and restarts keep the ETag
+    conn = sqlite3.connect(northpole_db)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("UPDATE children_log SET naughty_score = naughty_score + 1")
+    conn.commit()
+    assert first.page()[1] == etag
+    assert TicketInbox(SEED_PATH, northpole_db).page()[1] == etag
+    conn.close()
+
+
+def test_inbox_picks_up_wal_commits(northpole_db):
+    conn = sqlite3.connect(northpole_db)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(INBOX_TABLE_SQL)
+    conn.commit()
+    inbox = TicketInbox(SEED_PATH, northpole_db)
+    body, etag = inbox.page()
+    conn.execute("INSERT INTO ticket_inbox (id, category, priority, subject, message) VALUES ('NP-9999', 'Altro', 'high', 's', 'm')")
+    conn.commit()  # Only in the WAL file until a checkpoint: the main file keeps its mtime
+    new_body, new_etag = inbox.page()
+    assert new_etag != etag and b"NP-9999" in new_body
+    conn.close()
+
+
+def test_inbox_pagination(northpole_db):
+    add_open_ticket(northpole_db, "NP-9000")
+    inbox = TicketInbox(SEED_PATH, northpole_db)
+    body, etag = inbox.page(offset=0, limit=5)
+    page = json.loads(body)
+    assert len(page["tickets"]) == 5 and page["total"] == inbox.total == 8 and page["next_offset"] == 5
+    assert inbox.page(offset=0, limit=5) == (body, etag)
+    assert inbox.page(offset=5, limit=5)[1] != etag
+
+
+@pytest.fixture
+def examples_client(monkeypatch, northpole_db):
+    import main
+    monkeypatch.setattr(main, "ticket_inbox", TicketInbox(SEED_PATH, northpole_db))
+    return TestClient(main.app)  # No startup: the engine isn't needed
+
+
+def test_examples_endpoint_304(examples_client, northpole_db):
+    response = examples_client.get("/api/tickets/examples", params={"limit": 3})
+    assert response.status_code == 200 and len(response.json()["tickets"]) == 3
+    etag = response.headers["etag"]
+    assert examples_client.get("/api/tickets/examples", params={"limit": 3}, headers={"If-None-Match": etag}).status_code == 304
+
+    add_open_ticket(northpole_db, "NP-9001")
+    response = examples_client.get("/api/tickets/examples", params={"limit": 3}, headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.headers["etag"] != etag
@@ -0,0 +1,167 @@
+"""
+Ticket inbox for the operator console.
+
+Seed/example tickets come from data/example_tickets.json, open tickets from the
+`ticket_inbox` table of northpole.db. Everything is loaded and serialized to JSON
+bytes once; pages are assembled by joining pre-serialized tickets and cached with
+their ETag, so listing thousands of tickets never rebuilds Ticket objects per request.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from models import Ticket
+
+PRIORITY_ORDER = {"critical": 0, "high": 1, "medium": 2}
+
+INBOX_TABLE_SQL = '''
+CREATE TABLE IF NOT EXISTS ticket_inbox (
+    id TEXT PRIMARY KEY,
+    category TEXT NOT NULL,
+    priority TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    message TEXT NOT NULL,
+    created_at TEXT,
+    status TEXT NOT NULL DEFAULT 'open'
+)
+'''
+INBOX_INDEX_SQL = "CREATE INDEX IF NOT EXISTS idx_ticket_inbox_status ON ticket_inbox (status, created_at)"
+
+# Seed tickets have no arrival time: a fixed one keeps their JSON (and every ETag) stable across reloads
+SEED_CREATED_AT = datetime(2025, 12, 1, tzinfo=timezone.utc)
+
+
+class TicketInbox:
+    def __init__(self, seed_path: str, db_path: Optional[str] = None, max_cached_pages: int = 64):
+        self.seed_path = seed_path
+        self.db_path = db_path
+        self.max_cached_pages = max_cached_pages
+        self._lock = threading.Lock()
+        self._signature = None
+        self._db: Optional[sqlite3.Connection] = None  # Kept open: PRAGMA data_version is per connection
+        self._db_identity = None
+        self._tickets: List[bytes] = []
+        self._version = ""
+        self._pages: "OrderedDict[Tuple[int, int], Tuple[bytes, str]]" = OrderedDict()
+        self.reload()
+
+    # ====== LOADING ======
+
+    def _seed_signature(self):
+        try:
+            stat = os.stat(self.seed_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _db_signature(self):
+        """(file identity, PRAGMA data_version) of northpole.db.
+
+        data_version changes with every commit of another connection, WAL writes included
+        (they may not touch the main file's mtime). Commits to other tables (dossier sync)
+        trigger a reload too, but the content-hashed version keeps the ETags unchanged.
+        """
+        if not self.db_path:
+            return None
+        try:
+            stat = os.stat(self.db_path)
+        except OSError:
+            return None
+        identity = (stat.st_dev, stat.st_ino)
+        try:
+            # Called under self._lock
+            if self._db is None or self._db_identity != identity:  # First check, or the file was recreated
+                if self._db is not None:
+                    self._db.close()
+                self._db = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+                self._db_identity = identity
+            return identity, self._db.execute("PRAGMA data_version").fetchone()[0]
+        except sqlite3.Error:
+            self._db = None
+            return None
+
+    def _source_signature(self):
+        with self._lock:
+            return self._seed_signature(), self._db_signature()
+
+    def _load_seed(self) -> List[Ticket]:
+        if not os.path.exists(self.seed_path):
+            print(f"⚠️ Example tickets file not found: {self.seed_path}")
+            return []
+        with open(self.seed_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return [Ticket(**{"created_at": SEED_CREATED_AT, **item}) for item in data]
+
+    def _load_open_tickets(self) -> List[Ticket]:
+        if not self.db_path or not os.path.exists(self.db_path):
+            return []
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        try:
+            rows = conn.execute(
+                "SELECT id, category, priority, subject, message, created_at "
+                "FROM ticket_inbox WHERE status = 'open' ORDER BY created_at DESC"
+            ).fetchall()
+        except sqlite3.OperationalError:
+            return []  # Table not created yet (run setup_db.py)
+        finally:
+            conn.close()
+        return [
+            Ticket(id=r[0], category=r[1], priority=r[2], subject=r[3], message=r[4], created_at=r[5])
+            for r in rows
+        ]
+
+    def reload(self):
+        """(Re)load seed + inbox tickets and pre-serialize them"""
+        signature = self._source_signature()
+        seed = self._load_seed()
+        seed_ids = {t.id for t in seed}
+        inbox = [t for t in self._load_open_tickets() if t.id not in seed_ids]
+        # Most urgent first, the inbox is already newest-first inside each priority
+        inbox.sort(key=lambda t: PRIORITY_ORDER.get(t.priority, len(PRIORITY_ORDER)))
+        tickets = [t.model_dump_json().encode("utf-8") for t in seed + inbox]
+
+        version = hashlib.sha256(b"\n".join(tickets)).hexdigest()[:16]
+        with self._lock:
+            self._tickets = tickets
+            self._version = version
+            self._pages.clear()
+            self._signature = signature
+        print(f"📥 Ticket inbox loaded: {len(seed)} examples + {len(inbox)} open tickets")
+
+    def _maybe_reload(self):
+        if self._source_signature() != self._signature:
+            self.reload()
+
+    # ====== READ API ======
+
+    @property
+    def total(self) -> int:
+        return len(self._tickets)
+
+    def page(self, offset: int = 0, limit: int = 50) -> Tuple[bytes, str]:
+        """JSON body (ExampleTicketsResponse shape) and strong ETag for one page"""
+        self._maybe_reload()
+        key = (offset, limit)
+        with self._lock:
+            cached = self._pages.get(key)
+            if cached is not None:
+                self._pages.move_to_end(key)
+                return cached
+
+            total = len(self._tickets)
+            items = self._tickets[offset:offset + limit]
+            next_offset = offset + limit if offset + limit < total else None
+            body = b"".join([
+                b'{"tickets":[', b",".join(items), b"],",
+                json.dumps({"total": total, "offset": offset, "limit": limit, "next_offset": next_offset})[1:].encode("utf-8"),
+            ])
+            etag = f'"{self._version}-{offset}-{limit}"'
+            self._pages[key] = (body, etag)
+            if len(self._pages) > self.max_cached_pages:
+                self._pages.popitem(last=False)
+            return body, etag
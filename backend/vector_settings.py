@@ -0,0 +1,165 @@
+"""
+Collection settings for the Qdrant vector store (quantization, on-disk storage,
+HNSW parameters, embedding dimensions) and memory budgeting helpers.
+"""
+import math
+import os
+from typing import Optional
+
+from pydantic import BaseModel, field_validator
+from qdrant_client import models as qmodels
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_MAX_DIMENSIONS = 1536
+
+QUANTIZATION_MODES = ("none", "scalar", "binary")
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+class CollectionSettings(BaseModel):
+    """Storage/index settings applied when the RAG collections are created.
+
+    Defaults reproduce the original layout (full precision float32 vectors in RAM).
+    Typical memory-saving profile for the tickets corpus:
+    quantization="binary" + on_disk=True + rescore=True (+ dimensions=512).
+    """
+    dimensions: int = EMBEDDING_MAX_DIMENSIONS
+    quantization: str = "none"  # "none", "scalar" (int8) or "binary" (1 bit)
+    quantization_always_ram: bool = True  # Keep the quantized copy in RAM
+    rescore: bool = True  # Re-rank quantized candidates with the original vectors
+    oversampling: float = 2.0  # Candidates fetched = k * oversampling before rescoring
+    on_disk: bool = False  # Original vectors memory-mapped from disk
+    on_disk_payload: bool = False
+    hnsw_m: Optional[int] = None  # None = Qdrant default (16)
+    hnsw_ef_construct: Optional[int] = None  # None = Qdrant default (100)
+    hnsw_ef: Optional[int] = None  # Search-time ef, None = Qdrant default
+    hnsw_on_disk: bool = False
+
+    @field_validator("quantization")
+    @classmethod
+    def _check_quantization(cls, value: str) -> str:
+        value = value.lower()
+        if value not in QUANTIZATION_MODES:
+            raise ValueError(f"quantization must be one of {QUANTIZATION_MODES}")
+        return value
+
+    @field_validator("dimensions")
+    @classmethod
+    def _check_dimensions(cls, value: int) -> int:
+        if not 1 <= value <= EMBEDDING_MAX_DIMENSIONS:
+            raise ValueError(f"dimensions must be between 1 and {EMBEDDING_MAX_DIMENSIONS}")
+        return value
+
+    @classmethod
+    def from_env(cls) -> "CollectionSettings":
+        """Read settings from environment variables (.env)"""
+        return cls(
+            dimensions=_env_int("EMBEDDING_DIMENSIONS") or EMBEDDING_MAX_DIMENSIONS,
+            quantization=os.getenv("QDRANT_QUANTIZATION", "none"),
+            quantization_always_ram=_env_bool("QDRANT_QUANTIZATION_ALWAYS_RAM", True),
+            rescore=_env_bool("QDRANT_RESCORE", True),
+            oversampling=float(os.getenv("QDRANT_OVERSAMPLING", "2.0")),
+            on_disk=_env_bool("QDRANT_ON_DISK", False),
+            on_disk_payload=_env_bool("QDRANT_ON_DISK_PAYLOAD", False),
+            hnsw_m=_env_int("QDRANT_HNSW_M"),
+            hnsw_ef_construct=_env_int("QDRANT_HNSW_EF_CONSTRUCT"),
+            hnsw_ef=_env_int("QDRANT_HNSW_EF"),
+            hnsw_on_disk=_env_bool("QDRANT_HNSW_ON_DISK", False),
+        )
+
+    # ====== QDRANT CONFIG OBJECTS ======
+
+    def quantization_config(self):
+        if self.quantization == "scalar":
+            return qmodels.ScalarQuantization(scalar=qmodels.ScalarQuantizationConfig(
+                type=qmodels.ScalarType.INT8,
+                quantile=0.99,
+                always_ram=self.quantization_always_ram
+            ))
+        if self.quantization == "binary":
+            return qmodels.BinaryQuantization(binary=qmodels.BinaryQuantizationConfig(
+                always_ram=self.quantization_always_ram
+            ))
+        return None
+
+    def hnsw_config(self) -> Optional[qmodels.HnswConfigDiff]:
+        if self.hnsw_m is None and self.hnsw_ef_construct is None and not self.hnsw_on_disk:
+            return None
+        return qmodels.HnswConfigDiff(
+            m=self.hnsw_m,
+            ef_construct=self.hnsw_ef_construct,
+            on_disk=self.hnsw_on_disk or None
+        )
+
+    def vector_params(self) -> qmodels.VectorParams:
+        return qmodels.VectorParams(
+            size=self.dimensions,
+            distance=qmodels.Distance.COSINE,
+            on_disk=self.on_disk or None,
+            hnsw_config=self.hnsw_config(),
+            quantization_config=self.quantization_config()
+        )
+
+    def search_params(self) -> Optional[qmodels.SearchParams]:
+        """Search-time parameters (None when the Qdrant defaults apply)"""
+        quantization = None
+        if self.quantization != "none":
+            quantization = qmodels.QuantizationSearchParams(
+                rescore=self.rescore,
+                oversampling=self.oversampling if self.rescore else None
+            )
+        if quantization is None and self.hnsw_ef is None:
+            return None
+        return qmodels.SearchParams(hnsw_ef=self.hnsw_ef, quantization=quantization)
+
+    # ====== MEMORY BUDGET ======
+
+    def estimate_bytes_per_vector(self) -> dict:
+        """Approximate storage per point, split between RAM and disk"""
+        original = self.dimensions * 4  # float32
+        if self.quantization == "scalar":
+            quantized = self.dimensions  # int8
+        elif self.quantization == "binary":
+            quantized = math.ceil(self.dimensions / 8)  # 1 bit per dimension
+        else:
+            quantized = 0
+        # HNSW layer 0 keeps 2*m links of 4 bytes, upper layers add ~10%
+        graph = int((self.hnsw_m or 16) * 2 * 4 * 1.1)
+
+        ram = 0
+        disk = 0
+        for size, in_ram in (
+            (original, not self.on_disk),
+            (quantized, self.quantization_always_ram),
+            (graph, not self.hnsw_on_disk),
+        ):
+            if in_ram:
+                ram += size
+            else:
+                disk += size
+        return {"ram": ram, "disk": disk}
+
+    def estimate_ram_bytes(self, num_vectors: int) -> int:
+        """Approximate resident memory for a collection of `num_vectors` points"""
+        return self.estimate_bytes_per_vector()["ram"] * num_vectors
+
+    def describe(self) -> str:
+        parts = [f"dims={self.dimensions}", f"quant={self.quantization}"]
+        if self.quantization != "none":
+            parts.append(f"rescore={self.rescore}x{self.oversampling}" if self.rescore else "rescore=off")
+        if self.on_disk:
+            parts.append("on_disk")
+        if self.hnsw_m or self.hnsw_ef_construct or self.hnsw_ef:
+            parts.append(f"hnsw(m={self.hnsw_m}, ef_c={self.hnsw_ef_construct}, ef={self.hnsw_ef})")
+        return ", ".join(parts)